@@ -0,0 +1,102 @@
+"""Benchmark loading a large manifest with and without the manifest cache
+
+Run from the repository root with: python -m benchmarks.bench_manifest
+"""
+import fnmatch
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import click
+import yaml
+from metarepo import manifest
+
+from benchmarks import common
+
+
+def create_include_tree(root: Path, manifests: int, repos_per_manifest: int) -> Path:
+    """
+    Create a tree of manifests where every manifest includes three others and all share a repository
+    :param root: Workspace root
+    :param manifests: Number of manifests
+    :param repos_per_manifest: Number of repositories in each manifest
+    :return: Path to the top manifest
+    """
+    timestamp = time.time() - 60
+    for i in range(manifests):
+        path = root / manifest.MANIFEST_NAME if i == 0 else root / f"component_{i}" / manifest.MANIFEST_NAME
+        repos = [{"url": "https://localhost/shared", "path": "shared"}]
+        repos += [
+            {"url": f"https://localhost/repo_{i}_{j}", "path": f"repos/repo_{i}_{j}"} for j in range(repos_per_manifest)
+        ]
+        children = [child for child in range(3 * i + 1, 3 * i + 4) if child < manifests]
+        repos += [{"url": f"https://localhost/component_{child}", "path": f"component_{child}"} for child in children]
+
+        # Included manifests are relative to the including manifest
+        includes = [
+            os.path.relpath(root / f"component_{child}" / manifest.MANIFEST_NAME, path.parent) for child in children
+        ]
+        data = {"repos": repos, "include": includes}
+        path.parent.mkdir(exist_ok=True)
+        with open(path, "w") as fp:
+            yaml.safe_dump(data, fp)
+        os.utime(path, (timestamp, timestamp))
+    return root / manifest.MANIFEST_NAME
+
+
+@click.command()
+@click.option("-n", "--repos", type=int, default=6000, show_default=True, help="Number of repositories")
+@click.option("--includes", type=int, default=50, show_default=True, help="Number of nested manifests")
+def main(repos, includes):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.environ["XDG_CACHE_HOME"] = str(Path(temp_dir) / "cache")
+        manifest_path = Path(temp_dir) / manifest.MANIFEST_NAME
+        data = {
+            "repos": [
+                {"url": f"https://localhost/repo_{i}", "path": f"repos/repo_{i}", "groups": [f"group_{i % 100}"]}
+                for i in range(repos)
+            ]
+        }
+        with open(manifest_path, "w") as fp:
+            yaml.safe_dump(data, fp)
+
+        # The modification time is only trusted once the manifest is old enough
+        timestamp = time.time() - 60
+        os.utime(manifest_path, (timestamp, timestamp))
+
+        uncached = common.timed(manifest.load_manifest, manifest_path, use_cache=False)
+        manifest.load_manifest(manifest_path)
+        cached = common.timed(manifest.load_manifest, manifest_path)
+
+        click.echo(f"uncached {uncached:8.3f}s")
+        click.echo(f"cached   {cached:8.3f}s  speedup {uncached / cached:7.1f}x")
+
+        # Selecting three repositories, compared to matching every path
+        loaded = manifest.load_manifest(manifest_path)
+        patterns = ["repos/repo_1", "repos/repo_2?", "repos/repo_300"]
+        scan = common.timed(
+            lambda: [
+                repo
+                for repo in loaded.get_repos()
+                if any(fnmatch.fnmatchcase(repo.path.as_posix(), pattern) for pattern in patterns)
+            ]
+        )
+        indexed = common.timed(loaded.get_index().select, patterns=patterns)
+        grouped = common.timed(loaded.get_index().select, groups=["group_7"])
+        click.echo(f"select by path, scan  {scan * 1000:8.3f}ms")
+        click.echo(f"select by path, index {indexed * 1000:8.3f}ms  speedup {scan / indexed:7.1f}x")
+        click.echo(f"select by group       {grouped * 1000:8.3f}ms")
+
+        # Resolving a tree of included manifests, the first resolve fills the cache of every manifest
+        top_path = create_include_tree(Path(temp_dir) / "includes", includes, 20)
+        cold = common.timed(manifest.resolve_manifest, top_path, repeat=1)
+        warm = common.timed(manifest.resolve_manifest, top_path)
+        count = len(manifest.resolve_manifest(top_path).get_repos())
+        click.echo(f"resolve {includes} manifests, {count} repositories")
+        click.echo(f"resolve cold {cold * 1000:8.3f}ms")
+        click.echo(f"resolve warm {warm * 1000:8.3f}ms")
+
+
+if __name__ == "__main__":
+    main()  # pragma: no cover
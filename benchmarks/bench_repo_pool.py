@@ -0,0 +1,74 @@
+"""Benchmark sharing open repositories, and their 'git cat-file --batch' processes, within a process
+
+Compares opening every repository separately, as before, with sharing them through
+vcs_git.shared_repositories(). Both runs are done in this process so that the
+interpreter startup does not hide the difference.
+
+Run from the repository root with: python -m benchmarks.bench_repo_pool
+"""
+import contextlib
+from pathlib import Path
+from types import SimpleNamespace
+
+import click
+from metarepo import manifest, sync_engine, vcs_git
+from metarepo.commands.status_cmd import get_repo_status
+
+from benchmarks import common
+
+
+@contextlib.contextmanager
+def separate_repositories():
+    """Open every repository separately, which is what happened before repositories were shared"""
+    shared_repositories = vcs_git.shared_repositories
+    vcs_git.shared_repositories = contextlib.nullcontext
+    try:
+        yield
+    finally:
+        vcs_git.shared_repositories = shared_repositories
+
+
+def status_passes(root: Path, repos: list, passes: int):
+    """Get the status of all repositories a number of times, like a watching status would"""
+    with vcs_git.shared_repositories():
+        for _ in range(passes):
+            for repo_data in repos:
+                get_repo_status(root, repo_data)
+
+
+def sync_all(root: Path, repos: list, engine: str):
+    """Synchronize all repositories, they are up to date so this is the local work of a sync"""
+    progress = lambda: SimpleNamespace(label=None)  # noqa: E731
+    tasks = [sync_engine.SyncTask(root / repo_data.path, repo_data) for repo_data in repos]
+    if engine == "async":
+        sync_engine.AsyncSyncEngine(progress, parallel=8).run(tasks)
+    else:
+        sync_engine.run_threaded(progress, tasks, parallel=8)
+
+
+@click.command()
+@click.option("-n", "--repos", "num_repos", type=int, default=200, show_default=True, help="Number of repositories")
+@click.option("--passes", type=int, default=3, show_default=True, help="Status passes sharing the repositories")
+def main(num_repos, passes):
+    with common.workspace(num_repos) as root:
+        common.run_cli("sync", "-j", "8")
+        repos = manifest.load_manifest(root / manifest.MANIFEST_NAME).get_repos()
+
+        cases = [
+            ("status", lambda: status_passes(root, repos, 1)),
+            (f"status x{passes}", lambda: status_passes(root, repos, passes)),
+            ("sync thread", lambda: sync_all(root, repos, "thread")),
+            ("sync async", lambda: sync_all(root, repos, "async")),
+        ]
+
+        for name, func in cases:
+            with separate_repositories():
+                separate = common.timed(func)
+            shared = common.timed(func)
+            click.echo(
+                f"{name:<12} separate {separate:7.3f}s  shared {shared:7.3f}s  speedup {separate / shared:5.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()  # pragma: no cover
@@ -0,0 +1,22 @@
+"""Benchmark the startup time of the command line interface
+
+Run from the repository root with: python -m benchmarks.bench_startup
+"""
+import click
+
+from benchmarks import common
+
+
+@click.command()
+@click.option("-n", "--repos", type=int, default=10, show_default=True, help="Number of repositories")
+def main(repos):
+    with common.workspace(repos):
+        common.run_cli("sync")
+
+        for args in (["--help"], ["list"], ["status"]):
+            elapsed = common.timed(common.run_cli, *args, repeat=10)
+            click.echo(f"{' '.join(args):<8} {elapsed * 1000:8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()  # pragma: no cover
@@ -0,0 +1,25 @@
+"""Benchmark the 'status' command with different levels of parallelism
+
+Run from the repository root with: python -m benchmarks.bench_status
+"""
+import click
+
+from benchmarks import common
+
+
+@click.command()
+@click.option("-n", "--repos", type=int, default=100, show_default=True, help="Number of repositories")
+@click.option("-j", "--parallel", type=int, multiple=True, default=[1, 4, 8, 16], show_default=True)
+def main(repos, parallel):
+    with common.workspace(repos):
+        common.run_cli("sync", "-j", "8")
+
+        baseline = None
+        for jobs in parallel:
+            elapsed = common.timed(common.run_cli, "status", "-j", str(jobs))
+            baseline = baseline or elapsed
+            click.echo(f"status -j {jobs:<3} {elapsed:8.3f}s  speedup {baseline / elapsed:5.2f}x")
+
+
+if __name__ == "__main__":
+    main()  # pragma: no cover
@@ -0,0 +1,38 @@
+"""Benchmark the sync engines
+
+Run from the repository root with: python -m benchmarks.bench_sync
+
+Remotes are local paths by default. Use --hosts to fetch over SSH from several hosts
+that each take --latency seconds to connect, to compare the engines under network latency.
+"""
+import shutil
+
+import click
+
+from benchmarks import common
+
+
+@click.command()
+@click.option("-n", "--repos", type=int, multiple=True, default=[10, 50, 200], show_default=True)
+@click.option("-j", "--parallel", type=int, default=8, show_default=True, help="Number of parallel repositories")
+@click.option("--engine", "engines", multiple=True, default=["thread", "process", "async"], show_default=True)
+@click.option("--hosts", type=int, default=0, show_default=True, help="Fetch over SSH from this many hosts")
+@click.option(
+    "--latency", type=float, default=0.2, show_default=True, help="Seconds to set up an SSH connection, with --hosts"
+)
+def main(repos, parallel, engines, hosts, latency):
+    for num_repos in repos:
+        with common.workspace(num_repos, hosts, latency) as root:
+            for engine in engines:
+                args = ["sync", "-j", str(parallel), "--engine", engine, "--no-probe"]
+
+                for repo_path in root.glob("repo_*"):
+                    shutil.rmtree(repo_path)
+                initial = common.timed(common.run_cli, *args, repeat=1)
+                incremental = common.timed(common.run_cli, *args)
+
+                click.echo(f"{num_repos:5} repos  {engine:<8} initial {initial:8.3f}s  incremental {incremental:8.3f}s")
+
+
+if __name__ == "__main__":
+    main()  # pragma: no cover
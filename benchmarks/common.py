@@ -0,0 +1,122 @@
+"""Common benchmark helpers"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import git
+import yaml
+from metarepo import manifest
+
+# Make sure the metarepo being benchmarked is the one in this tree
+PROJECT_ROOT = str(Path(__file__).resolve().parent.parent)
+
+
+def create_source_repo(path: Path, num_commits: int = 10) -> git.Repo:
+    """
+    Create a repository with a few commits
+    :param path: Path where the repository should be created
+    :param num_commits: Number of commits to create
+    :return: Repo
+    """
+    repo = git.Repo.init(path)
+    filename = path / "output.txt"
+    for i in range(num_commits):
+        with open(filename, "a+") as output_file:
+            output_file.write(f"This is a test {i}\n")
+        repo.index.add([str(filename)])
+        repo.index.commit(f"Commit message {i}")
+    return repo
+
+
+# ssh replacement that waits before running the remote command locally, like a remote with a network round trip
+LATENCY_SSH = """#!/bin/sh
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -o|-p|-O) shift 2 ;;
+        -*) shift ;;
+        *) break ;;
+    esac
+done
+shift
+[ $# -gt 0 ] || exit 0
+sleep {latency}
+exec sh -c "$*"
+"""
+
+
+@contextmanager
+def workspace(num_repos: int, hosts: int = 0, latency: float = 0.0):
+    """
+    Create a temporary workspace with a manifest referring to num_repos source repositories
+    :param num_repos: Number of repositories in the manifest
+    :param hosts: Spread the repositories over this many SSH hosts instead of using local paths
+    :param latency: Seconds every SSH connection waits before it is set up, if hosts are used
+    :return: Path to the workspace
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_path = Path(temp_dir)
+        source = temp_path / "source"
+        create_source_repo(source)
+
+        root = temp_path / "workspace"
+        root.mkdir()
+        if hosts:
+            # All hosts are served locally by a delaying ssh replacement
+            urls = [f"host{i % hosts}:{source / '.git'}" for i in range(num_repos)]
+            ssh_path = temp_path / "ssh"
+            ssh_path.write_text(LATENCY_SSH.format(latency=latency))
+            ssh_path.chmod(0o755)
+        else:
+            urls = [str(source / ".git")] * num_repos
+
+        repos = [{"url": url, "path": f"repo_{i}"} for i, url in enumerate(urls)]
+        with open(root / manifest.MANIFEST_NAME, "w") as fp:
+            yaml.safe_dump({"repos": repos}, fp)
+
+        cwd = os.getcwd()
+        previous_ssh = os.environ.get("GIT_SSH_COMMAND")
+        os.chdir(root)
+        if hosts:
+            os.environ["GIT_SSH_COMMAND"] = str(ssh_path)
+        try:
+            yield root
+        finally:
+            os.chdir(cwd)
+            if hosts:
+                if previous_ssh is None:
+                    del os.environ["GIT_SSH_COMMAND"]
+                else:
+                    os.environ["GIT_SSH_COMMAND"] = previous_ssh
+
+
+def timed(func, *args, repeat: int = 3, **kwargs) -> float:
+    """
+    Measure the best wall time of calling func
+    :param func: Function to measure
+    :param repeat: Number of measurements
+    :return: Best time in seconds
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_cli(*args: str):
+    """
+    Run metarepo in a separate process, just like a user would
+    :param args: Command line arguments
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [PROJECT_ROOT, os.environ.get("PYTHONPATH")])))
+    subprocess.run(
+        [sys.executable, "-m", "metarepo.cli", *args],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        env=env,
+    )
@@ -0,0 +1,96 @@
+"""Caches shared between workspaces"""
+import hashlib
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+# Name of the object cache directory inside the cache directory
+OBJECT_CACHE_NAME = "objects"
+
+
+def get_cache_dir() -> Path:
+    """Get the directory where metarepo stores its caches"""
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME")
+    base_dir = Path(xdg_cache_home) if xdg_cache_home else Path.home() / ".cache"
+    return base_dir / "metarepo"
+
+
+class ObjectCache:
+    """
+    Bare repositories holding the objects of each remote URL
+
+    Workspace repositories borrow objects from the cache through
+    objects/info/alternates, so every object is only downloaded once
+    per machine regardless of how many workspaces use it.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        """
+        Object cache
+        :param path: Directory for the cached repositories (default: <cache dir>/objects)
+        """
+        self._path = Path(path) if path else get_cache_dir() / OBJECT_CACHE_NAME
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def __getstate__(self):
+        # Locks only serialize updates within one process, worker processes get their own
+        return {"_path": self._path}
+
+    def __setstate__(self, state):
+        self.__init__(state["_path"])
+
+    def get_repo_path(self, url: str) -> Path:
+        """
+        Get the path of the cached repository for a URL
+        :param url: Remote URL
+        :return: Path to bare repository
+        """
+        return self._path / f"{hashlib.sha1(url.encode('utf-8')).hexdigest()}.git"
+
+    def _get_lock(self, url: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(url, threading.Lock())
+
+    def update(self, url: str, ref: str, filter_spec: Optional[str] = None) -> Path:
+        """
+        Fetch ref from url into the cache, creating the cached repository if needed
+        :param url: Remote URL
+        :param ref: Ref to fetch
+        :param filter_spec: Partial clone filter
+        :return: Path to bare repository
+        """
+        import git
+
+        repo_path = self.get_repo_path(url)
+
+        with self._get_lock(url):
+            if not repo_path.exists():
+                repo = git.Repo.init(repo_path, bare=True, mkdir=True)
+                repo.create_remote("origin", url)
+                # Workspaces depend on the objects in the cache,
+                # so they must never be pruned even if they become unreachable
+                with repo.config_writer() as config:
+                    config.set_value("gc", "pruneExpire", "never")
+            else:
+                repo = git.Repo(repo_path)
+
+            options = {"filter": filter_spec} if filter_spec else {}
+            repo.remote("origin").fetch(ref, **options)
+
+        return repo_path
+
+    def link(self, url: str, git_dir: Path):
+        """
+        Let a repository borrow objects from the cache
+        :param url: Remote URL
+        :param git_dir: Git directory of the repository that should use the cache
+        """
+        objects_path = str(self.get_repo_path(url) / "objects")
+        alternates_file = Path(git_dir) / "objects" / "info" / "alternates"
+
+        alternates = alternates_file.read_text().splitlines() if alternates_file.exists() else []
+        if objects_path not in alternates:
+            alternates_file.parent.mkdir(parents=True, exist_ok=True)
+            alternates_file.write_text("\n".join(alternates + [objects_path]) + "\n")
@@ -1,22 +1,46 @@
 """Command line interface"""
+import importlib
+
 import click
 
-from .commands.init_cmd import init
-from .commands.list_cmd import list_repos
-from .commands.status_cmd import status
-from .commands.sync_cmd import sync
 
+class LazyGroup(click.Group):
+    """Group that only imports the module of a command when the command is used"""
+
+    def __init__(self, *args, lazy_commands=None, **kwargs):
+        """
+        Lazy group
+        :param lazy_commands: Dictionary mapping command names to 'module:attribute'
+        """
+        super().__init__(*args, **kwargs)
+        self._lazy_commands = lazy_commands or {}
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(self._lazy_commands))
 
-@click.group(context_settings={"help_option_names": ["-h", "--help"]})
+    def get_command(self, ctx, cmd_name):
+        if cmd_name in self._lazy_commands and cmd_name not in self.commands:
+            module_name, attribute = self._lazy_commands[cmd_name].split(":")
+            self.add_command(getattr(importlib.import_module(module_name), attribute), cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+
+@click.group(
+    cls=LazyGroup,
+    context_settings={"help_option_names": ["-h", "--help"]},
+    lazy_commands={
+        "status": "metarepo.commands.status_cmd:status",
+        "list": "metarepo.commands.list_cmd:list_repos",
+        "sync": "metarepo.commands.sync_cmd:sync",
+        "init": "metarepo.commands.init_cmd:init",
+        "history": "metarepo.commands.history_cmd:history",
+        "prefetch": "metarepo.commands.prefetch_cmd:prefetch",
+        "tune": "metarepo.commands.tune_cmd:tune",
+    },
+)
 def cli():
     """Metarepo is a tool to help you to keep multiple git repositories in sync and organized"""
 
 
-# Register commands
-cli.add_command(status)
-cli.add_command(list_repos)
-cli.add_command(sync)
-cli.add_command(init)
-
 if __name__ == "__main__":
     cli()  # pragma: no cover
@@ -1,9 +1,87 @@
 """CLI decorators"""
 import functools
 import sys
-from pathlib import Path
 
-from . import manifest, ui, vcs_git
+import click
+
+from .parallel import AUTO
+
+
+class ParallelLevel(click.ParamType):
+    """Number of repositories to process in parallel, or 'auto'"""
+
+    name = "parallel"
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, int) or value == AUTO:
+            return value
+
+        if not value.isdigit() or int(value) < 1:
+            self.fail(f"{value!r} is neither a number >= 1 nor {AUTO!r}", param, ctx)
+        return int(value)
+
+
+def parallel_option(help_text: str):
+    """
+    Add the -j/--parallel option, which can also be set with METAREPO_PARALLEL
+    The option is None if not given so that the manifest setting can be used.
+    :param help_text: Help text of the option
+    """
+    return click.option(
+        "-j",
+        "--parallel",
+        type=ParallelLevel(),
+        envvar="METAREPO_PARALLEL",
+        metavar="N|auto",
+        help=f"{help_text} [default: {AUTO}]",
+    )
+
+
+def repo_filter_options(func):
+    """Add the --group and --path options selecting a subset of the repositories, see select_repos()"""
+    func = click.option(
+        "-p",
+        "--path",
+        "paths",
+        multiple=True,
+        metavar="GLOB",
+        help="Only repositories whose path matches, or is below, GLOB (can be repeated)",
+    )(func)
+    return click.option(
+        "-g", "--group", "groups", multiple=True, help="Only repositories in this group (can be repeated)"
+    )(func)
+
+
+def select_repos(manifest, groups, paths) -> list:
+    """
+    Select the repositories given by the --group and --path options
+    Exits if no repository matches.
+    :param manifest: Manifest
+    :param groups: Groups given with --group
+    :param paths: Path patterns given with --path
+    :return: Selected repositories in manifest order
+    """
+    from . import ui
+
+    index = manifest.get_index()
+    repos = index.select(groups, paths)
+    if not repos:
+        unknown = sorted(set(groups) - set(index.get_groups()))
+        ui.error(f"Unknown group: {', '.join(unknown)}" if unknown else "No repositories match the filters")
+        sys.exit(1)
+    return repos
+
+
+def show_pending_includes(manifest, root_path):
+    """
+    Tell about included manifests that are in repositories that have not been synchronized yet
+    :param manifest: Manifest
+    :param root_path: Path to the workspace root
+    """
+    from . import ui
+
+    for include_path in manifest.get_pending_includes():
+        ui.info(f"Not included until synchronized: {include_path.relative_to(root_path)}")
 
 
 def require_manifest(func):
@@ -11,28 +89,28 @@ def require_manifest(func):
 
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        # Assume the manifest is in the current directory
-        try:
-            # If we are in a repository, we want to look in
-            # the root of that repository for the manifest
-            current_repo = vcs_git.RepoTool(Path.cwd(), search_parent=True)
-            root_path = current_repo.get_root_path()
-        except vcs_git.InvalidRepository:
-            # Since we are not in a repository we will look
-            # for the manifest in the current directory
-            root_path = Path.cwd()
+        from . import manifest, ui, workspace
 
+        # If we are in a repository, we want to look in
+        # the root of that repository for the manifest
+        root_path = workspace.find_root_path()
         manifest_path = root_path / manifest.MANIFEST_NAME
 
         try:
-            loaded_manifest = manifest.load_manifest(manifest_path)
-            return func(loaded_manifest, root_path, *args, **kwargs)
-        except manifest.NotFound:
-            ui.error(f"Unable to load manifest: Not found: {str(manifest_path)}")
+            loaded_manifest = manifest.resolve_manifest(manifest_path, root_path)
+        except manifest.NotFound as exc:
+            # Included manifests that are missing are named by the exception
+            ui.error(f"Unable to load manifest: Not found: {exc or str(manifest_path)}")
             sys.exit(1)
         except manifest.ValidationFailed as exc:
-            ui.error(f"Unable to load manifest: Validation failed")
+            ui.error("Unable to load manifest: Validation failed")
             ui.error(str(exc))
             sys.exit(1)
+        except manifest.ManifestError as exc:
+            ui.error(f"Unable to load manifest: {exc}")
+            sys.exit(1)
+
+        show_pending_includes(loaded_manifest, root_path)
+        return func(loaded_manifest, root_path, *args, **kwargs)
 
     return wrapper
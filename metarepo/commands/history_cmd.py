@@ -0,0 +1,47 @@
+"""History command"""
+import click
+from metarepo.cli_decorators import require_manifest
+
+
+def format_size(size: int) -> str:
+    """
+    Format a number of bytes
+    :param size: Number of bytes
+    :return: Formatted size, e.g. '1.5 MiB'
+    """
+    for unit in ("bytes", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "bytes" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+@click.command()
+@require_manifest
+def history(manifest, root_path):
+    """Show recorded sync timings, in the order the next sync starts the repositories"""
+    from metarepo import ui
+    from metarepo.history import History
+
+    sync_history = History.load(root_path)
+    repos = sync_history.order_longest_first(manifest.get_repos())
+
+    ui.info(f"Sync history for {len(repos)} repositories")
+
+    for repo in repos:
+        timings = sync_history.get_timings(repo.path)
+        if not timings:
+            ui.item(str(repo.path), "no history")
+            continue
+
+        last = timings[-1]
+        attributes = [
+            ("expected", f"{sync_history.expected_seconds(repo.path):.2f}s"),
+            ("fetch", f"{last.fetch_seconds:.2f}s"),
+            ("checkout", f"{last.checkout_seconds:.2f}s"),
+        ]
+        if last.bytes_received is not None:
+            attributes.append(("received", format_size(last.bytes_received)))
+        attributes.append(("runs", len(timings)))
+
+        ui.item(str(repo.path), *attributes)
@@ -1,22 +1,18 @@
 """Command for creating a manifest file"""
 import sys
-from pathlib import Path
 
 import click
-import prompt_toolkit
-from metarepo import manifest, ui, vcs_git
-from prompt_toolkit.completion.filesystem import PathCompleter
-from prompt_toolkit.validation import Validator
 
 
 @click.command()
 def init():
     """Creates a manifest file in the root of the repository or the current directory"""
-    try:
-        current_repo = vcs_git.RepoTool(Path.cwd(), search_parent=True)
-        root_path = current_repo.get_root_path()
-    except vcs_git.InvalidRepository:
-        root_path = Path.cwd()
+    import prompt_toolkit
+    from metarepo import manifest, ui, workspace
+    from prompt_toolkit.completion.filesystem import PathCompleter
+    from prompt_toolkit.validation import Validator
+
+    root_path = workspace.find_root_path()
 
     manifest_file = root_path / manifest.MANIFEST_NAME
 
@@ -1,16 +1,21 @@
 """List repositories command"""
 import click
-from metarepo import ui
-from metarepo.cli_decorators import require_manifest
+from metarepo.cli_decorators import repo_filter_options, require_manifest, select_repos
 
 
 @click.command(name="list")
+@repo_filter_options
 @require_manifest
-def list_repos(manifest, _):
+def list_repos(manifest, _, groups, paths):
     """List all configured repositories"""
-    repos = manifest.get_repos()
+    from metarepo import ui
+
+    repos = select_repos(manifest, groups, paths)
 
     ui.info(f"Listing {len(repos)} configured repositories")
 
-    for repo in manifest.get_repos():
-        ui.item(f"{repo.path}", ("uri", repo.url))
+    for repo in repos:
+        attributes = [("uri", repo.url)]
+        if repo.groups:
+            attributes.append(("groups", ",".join(repo.groups)))
+        ui.item(f"{repo.path}", *attributes)
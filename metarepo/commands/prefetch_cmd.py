@@ -0,0 +1,114 @@
+"""Prefetch command"""
+import contextlib
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import click
+from metarepo.cli_decorators import parallel_option, repo_filter_options, require_manifest, select_repos
+
+
+def prefetch_repo(root_path: Path, repo_data) -> Tuple[str, Optional[str]]:
+    """
+    Fetch the tracked branch of one repository into the prefetch namespace
+    :param root_path: Path to the workspace root
+    :param repo_data: Repository data
+    :return: (Formatted status line, fetched SHA or None if the prefetch failed)
+    """
+    import git
+    from metarepo import ui, vcs_git
+
+    repo_path = str(repo_data.path)
+
+    try:
+        repo = vcs_git.RepoTool(root_path / repo_data.path, repo_data.url)
+        sha = repo.prefetch(repo_data.track, filter_spec=repo_data.filter)
+    except vcs_git.NotFound:
+        return ui.format_item_error(repo_path, "NOT FOUND, synchronize it first"), None
+    except vcs_git.InvalidRepository:
+        return ui.format_item_error(repo_path, "INVALID"), None
+    except vcs_git.WrongOrigin:
+        return ui.format_item_error(repo_path, "ORIGIN MISMATCH"), None
+    except git.GitCommandError as exc:
+        return ui.format_item_error(f"Unable to prefetch {repo_path}", vcs_git.get_error_message(str(exc.stderr))), None
+
+    return ui.format_item_ok(repo_path, ("track", repo_data.track), ("commit", sha[0:7])), sha
+
+
+def prefetch_all(root_path: Path, repos: List, parallel: int, ssh_multiplex: bool) -> bool:
+    """
+    Prefetch all repositories once and record the fetched commits
+    :param root_path: Path to the workspace root
+    :param repos: Repositories
+    :param parallel: Number of repositories to fetch in parallel
+    :param ssh_multiplex: Share one SSH connection per host between all fetches
+    :return: True if all repositories were prefetched
+    """
+    import concurrent.futures
+
+    from metarepo import prefetch, ssh, vcs_git
+
+    prefetch_log = prefetch.PrefetchLog.load(root_path)
+    multiplexing = ssh.multiplexed(repo.url for repo in repos) if ssh_multiplex else contextlib.nullcontext()
+    success = True
+
+    with multiplexing, vcs_git.shared_repositories():
+        with concurrent.futures.ThreadPoolExecutor(max_workers=parallel) as thread_pool:
+            # Results are yielded in manifest order even if they complete out of order
+            for repo_data, (line, sha) in zip(
+                repos, thread_pool.map(lambda repo_data: prefetch_repo(root_path, repo_data), repos)
+            ):
+                click.echo(line)
+                if sha is None:
+                    success = False
+                else:
+                    prefetch_log.record(repo_data, sha)
+
+    prefetch_log.save()
+    return success
+
+
+@click.command()
+@parallel_option("Number of repositories to fetch in parallel")
+@click.option(
+    "--interval",
+    type=click.IntRange(min=1),
+    metavar="SECONDS",
+    help="Keep running and prefetch again every SECONDS instead of exiting",
+)
+@click.option(
+    "--ssh-multiplex/--no-ssh-multiplex",
+    default=True,
+    show_default=True,
+    help="Share one SSH connection per host between all fetches",
+)
+@repo_filter_options
+@require_manifest
+def prefetch(manifest, root_path, parallel, interval, ssh_multiplex, groups, paths):
+    """
+    Fetch the tracked branches in the background so that sync only has to check them out
+
+    The working trees and the remote-tracking branches are left alone. Run it from cron or
+    a timer, or keep it running with --interval.
+    """
+    from metarepo import ui
+    from metarepo.parallel import AUTO, get_auto_range, resolve_level
+
+    repos = select_repos(manifest, groups, paths)
+
+    # Fetches wait on the network, use the upper end of the automatic range
+    parallel = resolve_level(parallel, manifest.settings.parallel)
+    if parallel == AUTO:
+        _, parallel = get_auto_range(len(repos))
+
+    try:
+        while True:
+            ui.info(f"Prefetching {len(repos)} repositories")
+            success = prefetch_all(root_path, repos, parallel, ssh_multiplex)
+
+            if interval is None:
+                sys.exit(0 if success else 1)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
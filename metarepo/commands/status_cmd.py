@@ -1,29 +1,118 @@
 """Status command"""
+import sys
+from pathlib import Path
+from typing import Iterable, List, Tuple
+
 import click
-from metarepo import ui, vcs_git
-from metarepo.cli_decorators import require_manifest
+from metarepo.cli_decorators import parallel_option, repo_filter_options, require_manifest, select_repos
+
+
+def get_repo_status(root_path: Path, repo_data, optional_locks: bool = True) -> str:
+    """
+    Retrieve the status of one repository
+    :param root_path: Path to the workspace root
+    :param repo_data: Repository data
+    :param optional_locks: Allow git to refresh the index of the repository
+    :return: Formatted status line
+    """
+    from metarepo import ui, vcs_git
+
+    repo_path = str(repo_data.path)
+
+    try:
+        repo = vcs_git.RepoTool(root_path / repo_data.path, repo_data.url)
+        repo_status = repo.get_status(optional_locks)
+        current_head = repo_status.branch if repo_status.branch else repo_status.head_sha[0:8]
+
+        return ui.format_item_ok(
+            repo_path, ("track", repo_data.track), ("head", current_head), ("dirty", repo_status.is_dirty)
+        )
+    except vcs_git.NotFound:
+        return ui.format_item_error(repo_path, "NOT FOUND")
+    except vcs_git.InvalidRepository:
+        return ui.format_item_error(repo_path, "INVALID")
+    except vcs_git.WrongOrigin:
+        return ui.format_item_error(repo_path, "ORIGIN MISMATCH")
+
+
+def update_lines(lines: List[str], updates: Iterable[Tuple[int, str]]):
+    """
+    Replace printed status lines that changed
+    Without a terminal the lines that changed are printed again instead.
+    :param lines: Lines that have been printed, updated in place
+    :param updates: (Index, new line)
+    """
+    from metarepo import ui
+
+    interactive = sys.stdout.isatty()
+    for index, line in updates:
+        if line == lines[index]:
+            continue
+
+        lines[index] = line
+        if interactive:
+            ui.rewrite_line(line, len(lines) - index)
+        else:
+            click.echo(line)
+
+
+def watch_status(root_path: Path, repos: list, thread_pool):
+    """
+    Show the status of repositories and update it when they change, until interrupted
+    :param root_path: Path to the workspace root
+    :param repos: Repositories
+    :param thread_pool: Executor the status is retrieved in
+    """
+    from metarepo import watcher
+
+    # Refreshing the index would be seen as a change and trigger another refresh
+    def get_status(repo_data):
+        return get_repo_status(root_path, repo_data, optional_locks=False)
+
+    with watcher.create_watcher() as repo_watcher:
+        for repo_data in repos:
+            if (root_path / repo_data.path).is_dir():
+                repo_watcher.add(repo_data.path, root_path / repo_data.path)
+
+        lines = list(thread_pool.map(get_status, repos))
+        for line in lines:
+            click.echo(line)
+
+        try:
+            while True:
+                changed = repo_watcher.wait()
+                indexes = [index for index, repo_data in enumerate(repos) if repo_data.path in changed]
+                update_lines(lines, zip(indexes, thread_pool.map(lambda index: get_status(repos[index]), indexes)))
+        except KeyboardInterrupt:
+            pass
 
 
 @click.command()
+@parallel_option("Number of repositories to check in parallel")
+@click.option("-w", "--watch", is_flag=True, help="Keep running and update repositories as they change")
+@repo_filter_options
 @require_manifest
-def status(manifest, root_path):
+def status(manifest, root_path, parallel, watch, groups, paths):
     """Show the status of all configured repositories"""
-    repos = manifest.get_repos()
+    import concurrent.futures
+
+    from metarepo import ui, vcs_git
+    from metarepo.parallel import AUTO, get_auto_range, resolve_level
+
+    repos = select_repos(manifest, groups, paths)
+
+    # Status is local work, the initial automatic level already keeps all CPUs busy
+    parallel = resolve_level(parallel, manifest.settings.parallel)
+    if parallel == AUTO:
+        parallel, _ = get_auto_range(len(repos))
 
     ui.info(f"Checking status for {len(repos)} repositories")
 
-    for repo_data in repos:
-        repo_path = str(repo_data.path)
+    with vcs_git.shared_repositories(), concurrent.futures.ThreadPoolExecutor(max_workers=parallel) as thread_pool:
+        if watch:
+            watch_status(root_path, repos, thread_pool)
+            return
 
-        try:
-            repo = vcs_git.RepoTool(root_path / repo_data.path, repo_data.url)
-            repo_status = repo.get_status()
-            current_head = repo_status.active_branch.name if repo_status.active_branch else repo_status.head.hexsha[0:8]
-
-            ui.item_ok(repo_path, ("track", repo_data.track), ("head", current_head), ("dirty", repo_status.is_dirty))
-        except vcs_git.NotFound:
-            ui.item_error(repo_path, "NOT FOUND")
-        except vcs_git.InvalidRepository:
-            ui.item_error(repo_path, "INVALID")
-        except vcs_git.WrongOrigin:
-            ui.item_error(repo_path, "ORIGIN MISMATCH")
+        # Results are yielded in manifest order even if they complete out of order
+        for line in thread_pool.map(lambda repo_data: get_repo_status(root_path, repo_data), repos):
+            click.echo(line)
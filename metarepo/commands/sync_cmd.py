@@ -1,93 +1,433 @@
-"""Status command"""
-import concurrent.futures
+"""Sync command"""
+import contextlib
 import sys
+from collections import namedtuple
 from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
 
 import click
-import git
-from metarepo import ui, vcs_git
-from metarepo.cli_decorators import require_manifest
-from metarepo.manifest import Manifest, Repository
-from prompt_toolkit import ANSI
-from prompt_toolkit.shortcuts.progress_bar import ProgressBar, formatters
+from metarepo.cli_decorators import parallel_option, repo_filter_options, require_manifest, select_repos
+from metarepo.defaults import DEFAULT_RETRIES, FETCHES_PER_HOST, LOCK_NAME, PREFETCH_MAX_AGE
 
+# The retry budget covers at least this many repositories
+RETRY_BUDGET_REPOS = 5
 
-def do_sync_repo(progress: ProgressBar, repo_path: Path, repo_data: Repository):
+
+# Command line options of sync that apply to every round of repositories
+SyncOptions = namedtuple(
+    "SyncOptions",
+    [
+        "parallel",
+        "cache",
+        "locked",
+        "probe",
+        "max_prefetch_age",
+        "engine",
+        "max_per_host",
+        "host_limits",
+        "ssh_multiplex",
+        "tune",
+        "fail_fast",
+        "retries",
+    ],
+)
+
+
+class HostLimit(click.ParamType):
+    """HOST=N parameter"""
+
+    name = "host_limit"
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, tuple):
+            return value
+
+        host, _, limit = value.partition("=")
+        if not host or not limit.isdigit() or int(limit) < 1:
+            self.fail(f"{value!r} is not in the format HOST=N with N >= 1", param, ctx)
+        return host.lower(), int(limit)
+
+
+def load_lock(root_path: Path, repos) -> Dict[Path, str]:
     """
-    Perform synchronization of one repository
-    :param progress: ProgressBar instance
-    :param repo_path: Path to repository
-    :param repo_data: Repository data
-    :return: True if successful
+    Load the locked commits
+    :param root_path: Path to the workspace root
+    :param repos: Repositories that will be synchronized
+    :return: Dictionary with the locked commit for each repository path
     """
-    pb = progress()
-    pb.label = ANSI(ui.format_item(str(repo_data.path), ("track", repo_data.track)))
+    from metarepo import manifest, ui
 
-    if not repo_path.exists():
-        repo = git.Repo.init(repo_path)
-        repo.create_remote("origin", repo_data.url)
+    lock_path = root_path / LOCK_NAME
 
     try:
-        repo = vcs_git.RepoTool(repo_path, repo_data.url)
-    except vcs_git.InvalidRepository:
-        pb.label = ANSI(ui.format_item_error(f"Unable to open {repo_data.path!s}", "Invalid repository"))
-        return False
-
-    # Fetch
-    fetch_result = repo.fetch(repo_data.track)
-
-    # Warn if ahead
-    if fetch_result.ahead:
-        pb.label = ANSI(
-            ui.format_item_error(f"Skipped {repo_data.path!s}", err=f"Ahead by {len(fetch_result.ahead)} commit(s)")
-        )
-        return False
+        lock = manifest.load_lock(lock_path)
+    except manifest.NotFound:
+        ui.error(f"Unable to load lock: Not found: {lock_path!s}")
+        sys.exit(1)
+    except manifest.ValidationFailed as exc:
+        ui.error("Unable to load lock: Validation failed")
+        ui.error(str(exc))
+        sys.exit(1)
+
+    locked_commits = {repo.path: lock.get_commit(repo) for repo in repos}
+
+    missing = [str(path) for path, commit in locked_commits.items() if commit is None]
+    if missing:
+        ui.error(f"Repositories missing from {LOCK_NAME}: {', '.join(missing)}")
+        sys.exit(1)
+
+    return locked_commits
+
+
+def update_lock(root_path: Path, manifest_data, results):
+    """
+    Record the resolved commits
+    Repositories that were not synchronized keep the commits they were locked to before.
+    :param root_path: Path to the workspace root
+    :param manifest_data: Manifest
+    :param results: Results of the synchronized repositories
+    """
+    from metarepo import manifest
+
+    lock_path = root_path / LOCK_NAME
+    try:
+        previous = manifest.load_lock(lock_path).repos
+    except (manifest.NotFound, manifest.ValidationFailed):
+        previous = []
+
+    commits = {(locked.path, locked.url): locked.commit for locked in previous}
+    commits.update({(result.repo.path, result.repo.url): result.commit for result in results})
+
+    lock = manifest.Lock(
+        repos=[
+            manifest.LockedRepository(url=repo.url, path=repo.path, commit=commits[(repo.path, repo.url)])
+            for repo in manifest_data.get_repos()
+            if (repo.path, repo.url) in commits
+        ]
+    )
+    manifest.save_lock(lock, lock_path)
+
+
+def resolve_new_repos(root_path: Path, synchronized, groups, paths):
+    """
+    Resolve the manifest again after a sync and find the repositories that were added by included manifests
+    :param root_path: Path to the workspace root
+    :param synchronized: Repositories that have been synchronized
+    :param groups: Groups given with --group
+    :param paths: Path patterns given with --path
+    :return: (Manifest, new repositories) or (None, None) if the manifest could not be resolved
+    """
+    from metarepo import manifest, ui
+    from metarepo.cli_decorators import show_pending_includes
+
+    try:
+        manifest_data = manifest.resolve_manifest(root_path / manifest.MANIFEST_NAME, root_path)
+    except manifest.ManifestError as exc:
+        ui.error(f"Unable to load included manifests: {exc}")
+        return None, None
+
+    show_pending_includes(manifest_data, root_path)
+    done = {(repo.path, repo.url) for repo in synchronized}
+    repos = [repo for repo in manifest_data.get_index().select(groups, paths) if (repo.path, repo.url) not in done]
+    return manifest_data, repos
+
+
+def select_parallel(level: Union[int, str], engine: str, count: int):
+    """
+    Select the number of repositories to synchronize in parallel
+    :param level: Number of repositories or 'auto'
+    :param engine: Sync engine
+    :param count: Number of repositories
+    :return: (Maximum number of repositories in parallel, AdaptiveLimiter if the thread engine adapts the level)
+    """
+    from metarepo.parallel import AUTO, AdaptiveLimiter, get_auto_range
+
+    if level != AUTO:
+        return level, None
+
+    initial, maximum = get_auto_range(count)
+    if engine == "thread":
+        return maximum, AdaptiveLimiter(initial, maximum)
+    if engine == "async":
+        # Remotes are protected by the per host limits, use the upper bound of the automatic range
+        return maximum, None
+
+    # Worker processes are expensive to start, use the lower bound
+    return initial, None
+
+
+def sync_round(root_path: Path, repos, settings, sync_history, options: SyncOptions):
+    """
+    Synchronize repositories
+    :param root_path: Path to the workspace root
+    :param repos: Repositories to synchronize
+    :param settings: Settings from the manifest
+    :param sync_history: History of previous syncs
+    :param options: Command line options
+    :return: (Results, whether fetches could be skipped by probing the remotes or using prefetched commits)
+    """
+    from metarepo import prefetch, ssh, sync_engine, ui
+    from metarepo.parallel import AUTO, resolve_level
+    from prompt_toolkit import ANSI
+    from prompt_toolkit.shortcuts.progress_bar import ProgressBar, formatters
+
+    locked_commits = load_lock(root_path, repos) if options.locked else {}
+    max_parallel, limiter = select_parallel(
+        resolve_level(options.parallel, settings.parallel), options.engine, len(repos)
+    )
+
+    # Enough retries for a tenth of the repositories, so one unreachable host cannot stall the whole run
+    retries = options.retries
+    retry_policy = sync_engine.RetryPolicy(retries, budget=retries * max(RETRY_BUDGET_REPOS, len(repos) // 10))
+
+    title = ANSI(ui.format_info(f"Synchronizing {len(repos)} repositories"))
 
-    status = repo.get_status()
+    progress_formatter = [
+        formatters.Label(),
+    ]
+
+    # All git processes started within share one SSH connection per host. Locked repositories rarely need the network,
+    # setting up master connections up front would connect to every host even if nothing is fetched.
+    multiplex = options.ssh_multiplex and not options.locked
+    multiplexing = ssh.multiplexed(repo.url for repo in repos) if multiplex else contextlib.nullcontext()
+
+    with multiplexing:
+        remote_shas = sync_engine.probe_remotes(root_path, repos) if options.probe else {}
+        prefetch_shas = (
+            {}
+            if options.locked
+            else prefetch.PrefetchLog.load(root_path).get_usable_shas(repos, remote_shas, options.max_prefetch_age)
+        )
 
-    # Warn if dirty
-    if status.is_dirty:
-        pb.label = ANSI(ui.format_item_error(f"Skipped {repo_data.path!s}", err="Workspace is dirty"))
-        return False
+        tasks = [
+            sync_engine.SyncTask(
+                root_path / repo.path,
+                repo,
+                locked_commits.get(repo.path),
+                remote_shas.get(repo.path),
+                options.tune,
+                prefetch_shas.get(repo.path),
+            )
+            for repo in repos
+        ]
 
-    current_commit = status.head
-    new_commit = fetch_result.fetch_head
+        # Start the slowest repositories first so they do not end up running alone at the end
+        tasks = sync_history.order_longest_first(tasks, lambda task: task.repo_data.path)
 
-    extras = []
+        # Synchronize all repositories
+        with ProgressBar(title, formatters=progress_formatter) as progress_bar:
+            if options.engine == "async":
+                results = sync_engine.AsyncSyncEngine(
+                    progress_bar,
+                    max_parallel,
+                    options.cache,
+                    max_per_host=options.max_per_host or settings.max_per_host,
+                    host_limits={**settings.host_limits, **options.host_limits},
+                    retry_policy=retry_policy,
+                ).run(tasks, stop_on_failure=options.fail_fast)
+            elif options.engine == "process":
+                results = sync_engine.run_process_pool(
+                    progress_bar,
+                    tasks,
+                    max_parallel,
+                    options.cache,
+                    stop_on_failure=options.fail_fast,
+                    retry_policy=retry_policy,
+                )
+            else:
+                results = sync_engine.run_threaded(
+                    progress_bar,
+                    tasks,
+                    max_parallel,
+                    options.cache,
+                    stop_on_failure=options.fail_fast,
+                    limiter=limiter,
+                    retry_policy=retry_policy,
+                )
 
-    if current_commit is None:
-        extras.append(f"Checked out {repo_data.track}")
-    elif current_commit == new_commit:
-        extras.append(f"Already up to date")
+    if limiter:
+        ui.info(f"Parallel: {AUTO} (started at {limiter.initial}, peak {limiter.peak}, ended at {limiter.limit})")
     else:
-        extras.append(("update", f"{str(current_commit)[0:7]} -> {str(new_commit)[0:7]}"))
-        extras.append(("commits", len(fetch_result.behind)))
+        ui.info(f"Parallel: {max_parallel}")
+
+    return results, bool(remote_shas or prefetch_shas)
+
+
+def show_results(repos, results):
+    """
+    Print a table with the outcome of every repository
+    :param repos: Repositories that were to be synchronized
+    :param results: Results of the repositories that have been synchronized
+    """
+    from collections import Counter
 
-    repo.checkout("origin/" + repo_data.track, repo_data.track)
-    pb.label = ANSI(ui.format_item_ok(str(repo_data.path), *extras))
+    from metarepo import ui
 
-    return True
+    results_by_path = {result.repo.path: result for result in results}
+    rows = []
+
+    for repo in repos:
+        result = results_by_path.get(repo.path)
+        if result is None:
+            rows.append([str(repo.path), "not started", "", "", ""])
+            continue
+
+        outcome = "ok" if result.success else "skipped" if result.skipped else "failed"
+        duration = f"{result.timing.fetch_seconds + result.timing.checkout_seconds:.1f}s" if result.timing else ""
+        rows.append([str(repo.path), outcome, result.details, str(result.retries or ""), duration])
+
+    ui.table(["Repository", "Result", "Details", "Retries", "Time"], rows)
+
+    counts = Counter(row[1] for row in rows)
+    summary = ", ".join(f"{counts[outcome]} {outcome}" for outcome in ("ok", "skipped", "failed", "not started"))
+    if counts["ok"] == len(rows):
+        ui.info(f"Synchronized {len(rows)} repositories: {summary}")
+    else:
+        ui.error(f"Synchronized {len(rows)} repositories: {summary}")
 
 
 @click.command()
+@parallel_option("Number of repositories to synchronize in parallel")
+@click.option(
+    "--object-cache",
+    type=click.Path(file_okay=False),
+    is_flag=False,
+    flag_value="",
+    envvar="METAREPO_OBJECT_CACHE",
+    help="Borrow objects for new repositories from a shared local cache (default location if no path is given)",
+)
+@click.option("--locked", is_flag=True, help=f"Check out the commits recorded in {LOCK_NAME}")
+@click.option(
+    "--probe/--no-probe",
+    default=True,
+    show_default=True,
+    help="Only fetch repositories whose tracked branch has changed on the remote",
+)
+@click.option(
+    "--max-prefetch-age",
+    type=click.IntRange(min=0),
+    default=PREFETCH_MAX_AGE,
+    show_default=True,
+    metavar="SECONDS",
+    help="Use commits fetched by the prefetch command up to this old instead of fetching, any age if probed",
+)
 @click.option(
-    "-j", "--parallel", type=int, default=1, show_default=True, help="Number of repositories to synchronize in parallel"
+    "--engine",
+    type=click.Choice(["thread", "async", "process"]),
+    default="thread",
+    show_default=True,
+    help="Run each repository in a thread, run fetches as asyncio subprocesses with per host limits, "
+    "or run each repository in a worker process",
 )
+@click.option(
+    "--max-per-host",
+    type=click.IntRange(min=1),
+    help=f"Maximum concurrent fetches per host (async engine) [default: {FETCHES_PER_HOST}]",
+)
+@click.option(
+    "--host-limit",
+    "host_limits",
+    type=HostLimit(),
+    multiple=True,
+    metavar="HOST=N",
+    help="Maximum concurrent fetches for a specific host (async engine)",
+)
+@click.option(
+    "--ssh-multiplex/--no-ssh-multiplex",
+    default=True,
+    show_default=True,
+    help="Share one SSH connection per host between all fetches",
+)
+@click.option(
+    "--tune/--no-tune",
+    default=True,
+    show_default=True,
+    help="Configure repositories for fast status, like the tune command",
+)
+@click.option("--fail-fast", is_flag=True, help="Stop starting new repositories after the first failure")
+@click.option(
+    "--retries",
+    type=click.IntRange(min=0),
+    default=DEFAULT_RETRIES,
+    show_default=True,
+    help="Retry transient fetch failures this many times per repository",
+)
+@repo_filter_options
 @require_manifest
-def sync(manifest: Manifest, root_path: str, parallel: int):
+def sync(
+    manifest_data,
+    root_path: Path,
+    parallel: Union[int, str, None],
+    object_cache: Optional[str],
+    locked: bool,
+    probe: bool,
+    max_prefetch_age: int,
+    engine: str,
+    max_per_host: Optional[int],
+    host_limits: Tuple[Tuple[str, int], ...],
+    ssh_multiplex: bool,
+    tune: bool,
+    fail_fast: bool,
+    retries: int,
+    groups: Tuple[str, ...],
+    paths: Tuple[str, ...],
+):
     """Synchronize all configured repositories"""
-    repos = manifest.get_repos()
+    from metarepo import history, ui
+    from metarepo.cache import ObjectCache
 
-    title = ANSI(ui.format_info(f"Synchronizing {len(repos)} repositories"))
+    options = SyncOptions(
+        parallel,
+        ObjectCache(object_cache or None) if object_cache is not None else None,
+        locked,
+        probe and not locked,
+        max_prefetch_age,
+        engine,
+        max_per_host,
+        dict(host_limits),
+        ssh_multiplex,
+        tune,
+        fail_fast,
+        retries,
+    )
+    sync_history = history.History.load(root_path)
 
-    progress_formatter = [
-        formatters.Label(),
-    ]
+    repos = select_repos(manifest_data, groups, paths)
+    all_repos, results, shortcut = [], [], False
+    success = True
+
+    while repos:
+        round_results, round_shortcut = sync_round(root_path, repos, manifest_data.settings, sync_history, options)
+        all_repos += repos
+        results += round_results
+        shortcut = shortcut or round_shortcut
+        success = all(result.success for result in results)
+        if not success or not manifest_data.include:
+            break
+
+        # The synchronized repositories may include manifests, or changed the manifests they include
+        resolved, repos = resolve_new_repos(root_path, all_repos, groups, paths)
+        if resolved is None:
+            success = False
+            break
+        manifest_data = resolved
+
+    show_results(all_repos, results)
+
+    for result in results:
+        if result.timing is not None:
+            sync_history.record(result.repo.path, result.timing)
+    sync_history.save()
+
+    # The repositories that were synchronized are recorded even if others failed
+    synchronized = [result for result in results if result.success]
+
+    if shortcut:
+        skipped = sum(1 for result in synchronized if not result.fetched)
+        ui.info(f"Skipped fetching {skipped} of {len(synchronized)} repositories unchanged on the remote or prefetched")
+
+    if not locked:
+        update_lock(root_path, manifest_data, synchronized)
 
-    # Synchronize all repositories
-    with ProgressBar(title, formatters=progress_formatter) as progress_bar:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=parallel) as thread_pool:
-            tasks = [thread_pool.submit(do_sync_repo, progress_bar, root_path / repo.path, repo) for repo in repos]
-            for future in concurrent.futures.as_completed(tasks):
-                if not future.result():
-                    sys.exit(1)
+    if not success:
+        sys.exit(1)
@@ -0,0 +1,78 @@
+"""Tune command"""
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import click
+from metarepo.cli_decorators import repo_filter_options, require_manifest, select_repos
+
+
+def format_latency(seconds: Optional[float]) -> str:
+    """
+    Format a status latency
+    :param seconds: Latency in seconds or None if unknown
+    :return: Formatted latency, e.g. '120 ms'
+    """
+    return "" if seconds is None else f"{seconds * 1000:.0f} ms"
+
+
+def tune_repo(root_path: Path, repo_data, fsmonitor: bool) -> Tuple[List[str], Optional[float], Optional[float]]:
+    """
+    Tune one repository and measure the latency of status before and after
+    :param root_path: Path to the workspace root
+    :param repo_data: Repository data
+    :param fsmonitor: Use the file system monitor, if git has one on this platform
+    :return: (Table row, latency before, latency after), the latencies are None if the repository failed
+    """
+    import git
+    from metarepo import vcs_git
+
+    repo_path = str(repo_data.path)
+
+    try:
+        repo = vcs_git.RepoTool(root_path / repo_data.path, repo_data.url)
+        before = repo.measure_status()
+        changed = repo.tune(fsmonitor)
+        # The first status after tuning rewrites the index and fills the caches
+        repo.measure_status(repeat=1)
+        after = repo.measure_status()
+    except vcs_git.NotFound:
+        return [repo_path, "NOT FOUND", "", ""], None, None
+    except vcs_git.InvalidRepository:
+        return [repo_path, "INVALID", "", ""], None, None
+    except vcs_git.WrongOrigin:
+        return [repo_path, "ORIGIN MISMATCH", "", ""], None, None
+    except git.GitCommandError as exc:
+        return [repo_path, vcs_git.get_error_message(str(exc.stderr)), "", ""], None, None
+
+    row = [repo_path, ", ".join(changed) or "already tuned", format_latency(before), format_latency(after)]
+    return row, before, after
+
+
+@click.command()
+@click.option(
+    "--fsmonitor/--no-fsmonitor",
+    default=True,
+    show_default=True,
+    help="Watch working trees with git's built-in file system monitor, where git has one",
+)
+@repo_filter_options
+@require_manifest
+def tune(manifest, root_path, fsmonitor, groups, paths):
+    """Configure all repositories for fast status and show the status latency before and after"""
+    from metarepo import ui
+
+    repos = select_repos(manifest, groups, paths)
+    ui.info(f"Tuning {len(repos)} repositories")
+
+    # One repository at a time, parallel work would distort the measured latencies
+    rows = []
+    total_before = total_after = 0.0
+    for repo_data in repos:
+        row, before, after = tune_repo(root_path, repo_data, fsmonitor)
+        rows.append(row)
+        if before is not None:
+            total_before += before
+            total_after += after
+
+    ui.table(["Repository", "Changed", "Status before", "Status after"], rows)
+    ui.info(f"Total status latency: {format_latency(total_before)} before, {format_latency(total_after)} after")
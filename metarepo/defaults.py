@@ -0,0 +1,13 @@
+"""Defaults shared by the commands and the modules implementing them, importable without any heavy dependencies"""
+
+# Lock filename, stored next to the manifest
+LOCK_NAME = "manifest.lock"
+
+# Prefetched commits older than this many seconds are not used by sync unless the remote has been probed
+PREFETCH_MAX_AGE = 900
+
+# Default maximum number of concurrent fetches against the same host (async engine)
+FETCHES_PER_HOST = 8
+
+# Number of times a transient fetch failure is retried per repository
+DEFAULT_RETRIES = 2
@@ -0,0 +1,134 @@
+"""Timing history of synchronized repositories"""
+import json
+import os
+import time
+from collections import namedtuple
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+# Directory in the workspace root for local state that is not part of the manifest
+STATE_DIR = ".metarepo"
+
+# History filename, stored in STATE_DIR
+HISTORY_NAME = "history.json"
+
+# Bump when the format of the history file changes
+HISTORY_VERSION = 1
+
+# Number of synchronizations remembered per repository
+HISTORY_LENGTH = 5
+
+
+def load_state(path: Path, version: int) -> dict:
+    """
+    Load the entries of each repository from a state file
+    :param path: Path to the state file
+    :param version: Expected version of the file format
+    :return: Entries for each repository path, empty if the file is missing, unreadable or of another version
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+    if not isinstance(data, dict) or data.get("version") != version:
+        return {}
+
+    return data.get("repos", {})
+
+
+def save_state(path: Path, version: int, entries: dict):
+    """
+    Atomically write the entries of each repository to a state file
+    :param path: Path to the state file
+    :param version: Version of the file format
+    :param entries: Entries for each repository path
+    """
+    # The state directory ignores itself so it never shows up in the workspace repository
+    path.parent.mkdir(parents=True, exist_ok=True)
+    gitignore = path.parent / ".gitignore"
+    if not gitignore.exists():
+        gitignore.write_text("*\n")
+
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump({"version": version, "repos": entries}, file, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+Timing = namedtuple("Timing", ["fetch_seconds", "checkout_seconds", "bytes_received"], defaults=[None])
+
+
+class History:
+    """Recent fetch and checkout timings of every repository in a workspace"""
+
+    def __init__(self, path: Path, entries: Optional[Dict[str, List[dict]]] = None):
+        """
+        Timing history
+        :param path: Path to the history file
+        :param entries: Recorded timings for each repository path, oldest first
+        """
+        self._path = path
+        self._entries = entries or {}
+
+    @classmethod
+    def load(cls, root_path: Path) -> "History":
+        """
+        Load the history of a workspace, a missing or unreadable history is empty
+        :param root_path: Path to the workspace root
+        :return: History
+        """
+        path = root_path / STATE_DIR / HISTORY_NAME
+        return cls(path, load_state(path, HISTORY_VERSION))
+
+    def save(self):
+        """Write the history to disk"""
+        save_state(self._path, HISTORY_VERSION, self._entries)
+
+    def record(self, repo_path: Path, timing: Timing):
+        """
+        Record the timing of one synchronization
+        :param repo_path: Path of the repository relative to the workspace root
+        :param timing: Timing
+        """
+        entries = self._entries.setdefault(Path(repo_path).as_posix(), [])
+        entries.append({"time": time.time(), **timing._asdict()})
+        del entries[:-HISTORY_LENGTH]
+
+    def get_timings(self, repo_path: Path) -> List[Timing]:
+        """
+        Get the recorded timings of a repository
+        :param repo_path: Path of the repository relative to the workspace root
+        :return: Timings, oldest first
+        """
+        return [
+            Timing(entry["fetch_seconds"], entry["checkout_seconds"], entry.get("bytes_received"))
+            for entry in self._entries.get(Path(repo_path).as_posix(), [])
+        ]
+
+    def expected_seconds(self, repo_path: Path) -> Optional[float]:
+        """
+        Get the expected duration of synchronizing a repository
+        :param repo_path: Path of the repository relative to the workspace root
+        :return: Average duration of the recorded synchronizations or None if there are none
+        """
+        timings = self.get_timings(repo_path)
+        if not timings:
+            return None
+        return sum(timing.fetch_seconds + timing.checkout_seconds for timing in timings) / len(timings)
+
+    def order_longest_first(self, items: list, get_path: Callable = lambda repo: repo.path) -> list:
+        """
+        Order items so that the longest expected synchronizations are started first
+        Repositories without history are expected to be cloned and go before all others.
+        :param items: Repositories or anything get_path can retrieve the repository path from
+        :param get_path: Function returning the repository path of an item
+        :return: Reordered items
+        """
+
+        def sort_key(item):
+            expected = self.expected_seconds(get_path(item))
+            return (expected is not None, -(expected or 0.0))
+
+        return sorted(items, key=sort_key)
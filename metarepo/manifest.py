@@ -1,13 +1,40 @@
 """Manifest loading"""
+import bisect
+import concurrent.futures
+import fnmatch
+import functools
+import hashlib
+import os
+import pickle
+import posixpath
+import time
 from pathlib import Path
-from typing import Any, List, Optional, Union
+from typing import Any, Dict, Iterable, List, Literal, Optional, Tuple, Union
 
 import pydantic
 import yaml
 
+from .cache import get_cache_dir
+from .defaults import LOCK_NAME  # noqa: F401
+
+# Use the much faster libyaml based loader when available
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 # Manifest filename
 MANIFEST_NAME = "manifest.yml"
 
+# Bump when the format of the cached manifests changes
+MANIFEST_CACHE_VERSION = 2
+
+# Characters that start the wildcard part of a path pattern
+GLOB_CHARACTERS = "*?["
+
+# Number of included manifests loaded in parallel
+INCLUDE_PARALLEL = 8
+
+# Files modified this recently can be modified again without changing mtime or size
+RACY_TIMESTAMP_NS = 2_000_000_000
+
 
 class ManifestError(Exception):
     """Basic error"""
@@ -24,53 +51,451 @@ class NotFound(ManifestError):
     """Manifest was not found"""
 
 
+class IncludeCycle(ManifestError):
+    """Manifests include each other"""
+
+
+class Conflict(ManifestError):
+    """Manifests put different repositories at the same path"""
+
+
 class Repository(pydantic.BaseModel):
     """Data for one repository"""
 
     url: str
     path: Path
     track: Optional[str] = "master"
+    depth: Optional[pydantic.PositiveInt] = None
+    filter: Optional[str] = None
+    sparse: Optional[List[str]] = None
+    groups: List[str] = []
+
+
+class RepositoryIndex:
+    """Index of the repositories of a manifest that makes selecting a few of them cheap"""
+
+    def __init__(self, repos: List[Repository]):
+        """
+        Repository index
+        :param repos: Repositories in manifest order
+        """
+        self._repos = repos
+        self._positions_by_group: Dict[str, List[int]] = {}
+        for position, repo in enumerate(repos):
+            for group in repo.groups:
+                self._positions_by_group.setdefault(group, []).append(position)
+
+        # Sorted paths, the repositories matching a pattern are found by bisecting on its literal prefix
+        self._paths = sorted((repo.path.as_posix(), position) for position, repo in enumerate(repos))
+        self._path_keys = [path for path, _ in self._paths]
+
+    def get_groups(self) -> List[str]:
+        """Get the names of all groups"""
+        return sorted(self._positions_by_group)
+
+    def _match_group(self, group: str) -> Iterable[int]:
+        return self._positions_by_group.get(group, [])
+
+    def _with_prefix(self, prefix: str) -> list:
+        """Get the (path, position) of all paths starting with prefix"""
+        start = bisect.bisect_left(self._path_keys, prefix)
+        end = bisect.bisect_left(self._path_keys, prefix + "\U0010ffff", lo=start)
+        return self._paths[start:end]
+
+    def _match_path(self, pattern: str) -> Iterable[int]:
+        """
+        Get the repositories matching a path pattern
+        A pattern matches the path itself and, like a directory, every path below it.
+        """
+        # Normalized like the paths in the manifest, e.g. './libs/' is 'libs'
+        pattern = posixpath.normpath(pattern.replace("\\", "/")).strip("/")
+        wildcard = min((pattern.find(char) for char in GLOB_CHARACTERS if char in pattern), default=None)
+
+        if wildcard is None:
+            # A plain path does not need to be matched against anything
+            start = bisect.bisect_left(self._path_keys, pattern)
+            if start < len(self._paths) and self._path_keys[start] == pattern:
+                yield self._paths[start][1]
+            for _, position in self._with_prefix(f"{pattern}/"):
+                yield position
+            return
+
+        for path, position in self._with_prefix(pattern[0:wildcard]):
+            if fnmatch.fnmatchcase(path, pattern) or fnmatch.fnmatchcase(path, f"{pattern}/*"):
+                yield position
+
+    def select(self, groups: Iterable[str] = (), patterns: Iterable[str] = ()) -> List[Repository]:
+        """
+        Select repositories
+        :param groups: Select repositories in any of these groups
+        :param patterns: Select repositories matching any of these path patterns, e.g. 'libs/*'
+        :return: Repositories in manifest order that match both the groups and the patterns, if given
+        """
+        selections = []
+        for match, values in ((self._match_group, groups), (self._match_path, patterns)):
+            if values:
+                selections.append({position for value in values for position in match(value)})
+
+        if not selections:
+            return list(self._repos)
+        return [self._repos[position] for position in sorted(set.intersection(*selections))]
+
+
+class Settings(pydantic.BaseModel):
+    """Settings for commands operating on the repositories"""
+
+    parallel: Optional[Union[pydantic.PositiveInt, Literal["auto"]]] = None
+    max_per_host: Optional[pydantic.PositiveInt] = None
+    host_limits: Dict[str, pydantic.PositiveInt] = {}
 
 
 class Manifest(pydantic.BaseModel):
     """Manifest data"""
 
     repos: pydantic.conlist(Repository, min_items=1)
+    settings: Settings = Settings()
+    include: List[Path] = []
+
+    _index: Optional[RepositoryIndex] = pydantic.PrivateAttr(None)
+    _pending_includes: List[Path] = pydantic.PrivateAttr([])
 
     def get_repos(self) -> List[Repository]:
         return self.repos
 
+    def get_pending_includes(self) -> List[Path]:
+        """Get the included manifests that are in repositories that have not been synchronized yet"""
+        return self._pending_includes
+
+    def get_index(self) -> RepositoryIndex:
+        """Get the index of the repositories, it is built on first use and cached along with the manifest"""
+        if self._index is None:
+            self._index = RepositoryIndex(self.repos)
+        return self._index
+
+
+class LockedRepository(pydantic.BaseModel):
+    """Resolved commit for one repository"""
+
+    url: str
+    path: Path
+    commit: str
+
+
+class Lock(pydantic.BaseModel):
+    """Resolved commits for all repositories after a sync"""
 
-def load_manifest(path: Union[Path, str]) -> Manifest:
+    repos: List[LockedRepository] = []
+
+    def get_commit(self, repo: Repository) -> Optional[str]:
+        """
+        Get the locked commit of a repository
+        :param repo: Repository from the manifest
+        :return: Commit SHA or None if the repository is not locked
+        """
+        for locked_repo in self.repos:
+            if locked_repo.path == repo.path and locked_repo.url == repo.url:
+                return locked_repo.commit
+        return None
+
+
+def load_manifest(path: Union[Path, str], use_cache: bool = True) -> Manifest:
     """
     Load manifest from a file
     :param path: Path to file
+    :param use_cache: Reuse the previously validated manifest if the file is unchanged
     :return: Manifest
     """
     try:
-        with open(path, "r") as manifest_file:
-            return parse_manifest(yaml.load(manifest_file, yaml.SafeLoader))
+        if not use_cache:
+            with open(path, "rb") as manifest_file:
+                return parse_manifest(yaml.load(manifest_file, SafeLoader))
+
+        return _load_cached_manifest(Path(path))
     except FileNotFoundError:
         raise NotFound()
 
 
+def resolve_manifest(
+    path: Union[Path, str], root_path: Union[Path, str, None] = None, parallel: int = INCLUDE_PARALLEL
+) -> Manifest:
+    """
+    Load a manifest and all manifests it includes, directly or through other included manifests
+
+    Included manifests are given relative to the manifest including them, the paths of their
+    repositories are relative to the workspace root. The manifests are loaded level by level,
+    all manifests of a level in parallel. A repository requested by several manifests is only
+    added once, the manifest closest to the top decides how it is synchronized. Only the settings
+    of the top manifest are used. Included manifests that are in repositories that have not been
+    synchronized yet are left out and listed by get_pending_includes().
+
+    :param path: Path to the top manifest
+    :param root_path: Path to the workspace root, defaults to the directory of the top manifest
+    :param parallel: Number of manifests to load in parallel
+    :return: Manifest with the repositories of all manifests
+    """
+    path = Path(os.path.abspath(path))
+    top = load_manifest(path)
+    if not top.include:
+        return top
+
+    root_path = Path(os.path.abspath(root_path or path.parent))
+    repos: Dict[str, Tuple[Repository, Path]] = {}
+    pending = []
+
+    # Manifests included by each manifest, including the ones that were already loaded through another manifest
+    graph: Dict[Path, List[Path]] = {}
+    seen = {path}
+
+    # Manifests of the current level
+    level = [(path, top)]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parallel) as thread_pool:
+        while level:
+            for manifest_path, manifest in level:
+                _add_repos(repos, manifest_path, manifest.repos)
+
+            includes = _get_includes(level, graph, seen)
+            loaded = thread_pool.map(lambda include: _load_included_manifest(*include), includes)
+            level = []
+            for (manifest_path, include_path), manifest in zip(includes, loaded):
+                if manifest is not None:
+                    level.append((include_path, manifest))
+                elif _is_in_repository(root_path, include_path, repos):
+                    pending.append(include_path)
+                else:
+                    raise NotFound(f"{include_path}, included by {manifest_path}")
+
+    _check_cycles(graph)
+
+    resolved = Manifest.construct(
+        repos=[repo for repo, _ in repos.values()], settings=top.settings, include=top.include
+    )
+    resolved._pending_includes = pending
+    return resolved
+
+
+def _get_includes(level: list, graph: Dict[Path, List[Path]], seen: set) -> list:
+    """
+    Get the manifests included by a level of manifests that have not been seen yet
+    :param level: (Path, Manifest) of each manifest of the level
+    :param graph: Manifests included by each manifest, updated with the level
+    :param seen: Paths of all manifests seen so far, updated with the new ones
+    :return: (Path to the including manifest, path to the included manifest) of each new manifest
+    """
+    includes = []
+    for manifest_path, manifest in level:
+        graph[manifest_path] = []
+        for include in manifest.include:
+            include_path = Path(os.path.normpath(manifest_path.parent / include))
+            graph[manifest_path].append(include_path)
+
+            # Included by several manifests
+            if include_path not in seen:
+                seen.add(include_path)
+                includes.append((manifest_path, include_path))
+    return includes
+
+
+def _check_cycles(graph: Dict[Path, List[Path]]):
+    """
+    Check that no manifests include each other, directly or through other manifests
+    :param graph: Manifests included by each manifest
+    :raises IncludeCycle: If there is a cycle
+    """
+    # Manifests that are being visited, with the chain leading to them, and manifests that are done
+    visiting: Dict[Path, int] = {}
+    done = set()
+
+    def visit(manifest_path: Path, chain: List[Path]):
+        visiting[manifest_path] = len(chain)
+        chain.append(manifest_path)
+        for include_path in graph.get(manifest_path, []):
+            if include_path in visiting:
+                start = visiting[include_path]
+                cycle = " -> ".join(str(item) for item in (*chain[start:], include_path))
+                raise IncludeCycle(f"Manifests include each other: {cycle}")
+            if include_path not in done:
+                visit(include_path, chain)
+        chain.pop()
+        del visiting[manifest_path]
+        done.add(manifest_path)
+
+    for manifest_path in graph:
+        if manifest_path not in done:
+            visit(manifest_path, [])
+
+
+def _load_included_manifest(manifest_path: Path, include_path: Path) -> Optional[Manifest]:
+    """
+    Load an included manifest
+    :param manifest_path: Path to the including manifest
+    :param include_path: Path to the included manifest
+    :return: Manifest or None if it does not exist
+    """
+    try:
+        return load_manifest(include_path)
+    except NotFound:
+        return None
+    except ValidationFailed as exception:
+        raise ManifestError(f"{include_path}, included by {manifest_path}: {exception}")
+
+
+def _add_repos(repos: Dict[str, Tuple[Repository, Path]], manifest_path: Path, new_repos: List[Repository]):
+    """
+    Add the repositories of a manifest to the repositories of the manifests before it
+    :param repos: Repositories and the manifests requesting them, by path
+    :param manifest_path: Path to the manifest
+    :param new_repos: Repositories of the manifest
+    """
+    for repo in new_repos:
+        key = os.path.normpath(repo.path).replace("\\", "/")
+        existing = repos.setdefault(key, (repo, manifest_path))
+        if existing[0].url != repo.url:
+            raise Conflict(f"{key} is {existing[0].url} in {existing[1]} but {repo.url} in {manifest_path}")
+
+
+def _is_in_repository(root_path: Path, path: Path, repos: Dict[str, Tuple[Repository, Path]]) -> bool:
+    """Check if a path is inside the working tree of one of the repositories"""
+    try:
+        relative = path.relative_to(root_path)
+    except ValueError:
+        return False
+    return any(parent.as_posix() in repos for parent in relative.parents)
+
+
+def _get_manifest_cache_path(path: Path) -> Path:
+    """
+    Get the path of the cached version of a manifest
+    :param path: Path to manifest
+    :return: Path to cache file
+    """
+    key = hashlib.sha1(str(path.absolute()).encode("utf-8")).hexdigest()
+    return get_cache_dir() / "manifests" / f"{key}.pickle"
+
+
+def _get_package_version() -> str:
+    """
+    Get the installed version of metarepo
+    The version is taken from the name of the dist-info directory next to the package, importlib.metadata is slow to
+    import.
+    :return: Version or an empty string when running from a source tree
+    """
+    for dist_info in Path(__file__).parent.parent.glob("metarepo-*.dist-info"):
+        return dist_info.stem.split("-", 1)[1]
+    return ""
+
+
+@functools.lru_cache(maxsize=None)
+def _get_manifest_cache_key() -> str:
+    """Key that invalidates the cache when the manifest model, e.g. the default of a field, or metarepo changes"""
+    data = f"{MANIFEST_CACHE_VERSION}\0{_get_package_version()}\0{Manifest.schema_json()}"
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def _load_cached_manifest(path: Path) -> Manifest:
+    """
+    Load manifest from the cache if the file is unchanged, otherwise parse and cache it
+    :param path: Path to file
+    :return: Manifest
+    """
+    stat = path.stat()
+    cache_path = _get_manifest_cache_path(path)
+
+    try:
+        with open(cache_path, "rb") as cache_file:
+            entry = pickle.load(cache_file)
+        if entry["key"] != _get_manifest_cache_key():
+            entry = None
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, KeyError, TypeError, ValueError):
+        # Missing, truncated or incompatible cache, parse the manifest instead
+        entry = None
+
+    # Unchanged modification time and size
+    if entry and entry["stat"] == (stat.st_mtime_ns, stat.st_size):
+        return entry["manifest"]
+
+    data = path.read_bytes()
+    digest = hashlib.sha256(data).hexdigest()
+
+    # Touched but unchanged content
+    if entry and entry["digest"] == digest:
+        manifest = entry["manifest"]
+    else:
+        manifest = parse_manifest(yaml.load(data, SafeLoader))
+        manifest.get_index()
+
+    # Only trust the modification time if the file can not be modified again within the same timestamp
+    racy = time.time_ns() - stat.st_mtime_ns < RACY_TIMESTAMP_NS
+    entry = {
+        "key": _get_manifest_cache_key(),
+        "stat": None if racy else (stat.st_mtime_ns, stat.st_size),
+        "digest": digest,
+        "manifest": manifest,
+    }
+
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        with open(temp_path, "wb") as cache_file:
+            pickle.dump(entry, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        # The cache is just an optimization
+        pass
+
+    return manifest
+
+
 def save_manifest(manifest: Manifest, path: Union[Path, str]):
     """
     Save a manifest to a file
     :param manifest: Manifest to save
     :param path: Path to save to
     """
+    _save_yaml(manifest.dict(exclude_unset=True), path)
+
+
+def load_lock(path: Union[Path, str]) -> Lock:
+    """
+    Load lock from a file
+    :param path: Path to file
+    :return: Lock
+    """
+    try:
+        with open(path, "r") as lock_file:
+            return Lock(**yaml.load(lock_file, SafeLoader))
+    except FileNotFoundError:
+        raise NotFound()
+    except pydantic.ValidationError as exception:
+        raise ValidationFailed(exception)
+
+
+def save_lock(lock: Lock, path: Union[Path, str]):
+    """
+    Save a lock to a file
+    :param lock: Lock to save
+    :param path: Path to save to
+    """
+    _save_yaml(lock.dict(), path)
+
+
+def _save_yaml(data: Any, path: Union[Path, str]):
+    """
+    Save data to a YAML file
+    :param data: Data to save
+    :param path: Path to save to
+    """
 
     def path_representer(dump: yaml.Dumper, dump_path: Path) -> str:
         """Representer that dum path objects to YAML"""
         return dump.represent_str(str(dump_path))
 
-    with path.open("w") as fp:
+    with open(path, "w") as fp:
         try:
             dumper = yaml.SafeDumper(fp)
             dumper.add_multi_representer(Path, path_representer)
             dumper.open()
-            dumper.represent(manifest.dict(exclude_unset=True))
+            dumper.represent(data)
             dumper.close()
         finally:
             dumper.dispose()
@@ -0,0 +1,131 @@
+"""Selection of the number of repositories processed in parallel"""
+import contextlib
+import os
+import threading
+import time
+from typing import Optional, Tuple, Union
+
+# Value selecting the adaptive level
+AUTO = "auto"
+
+# Upper bound of the automatically selected level, remotes start throttling beyond this
+AUTO_MAX_PARALLEL = 32
+
+# Throughput has to improve by this factor for the level to keep increasing
+RAMP_UP_THRESHOLD = 1.05
+
+# Fraction of the available CPU time in use above which the level is not increased
+CPU_SATURATION = 0.8
+
+
+def get_cpu_count() -> int:
+    """Number of CPUs this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def get_cpu_seconds() -> float:
+    """CPU time used by this process and its finished child processes"""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def resolve_level(*levels: Optional[Union[int, str]]) -> Union[int, str]:
+    """
+    Pick the parallel level from the sources in order of precedence
+    :param levels: Levels from the command line, environment and manifest, None if not set
+    :return: Number of repositories or AUTO
+    """
+    return next((level for level in levels if level is not None), AUTO)
+
+
+def get_auto_range(count: int) -> Tuple[int, int]:
+    """
+    Get the range the automatically selected level stays within
+    :param count: Number of repositories
+    :return: (Initial level, maximum level)
+    """
+    cpus = get_cpu_count()
+    initial = max(1, min(count, 2 * cpus))
+    maximum = max(initial, min(count, 8 * cpus, AUTO_MAX_PARALLEL))
+    return initial, maximum
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit that follows the observed throughput
+
+    Every time as many repositories as the current limit have completed, the
+    throughput of that window is compared to the previous one. The limit grows
+    by one while throughput keeps improving and the CPU is mostly waiting on
+    I/O, and is halved when a repository failed with an error.
+    """
+
+    def __init__(self, initial: int, maximum: int):
+        """
+        Adaptive limiter
+        :param initial: Initial number of concurrent repositories
+        :param maximum: Maximum number of concurrent repositories
+        """
+        self.initial = initial
+        self.limit = initial
+        self.maximum = maximum
+        self.peak = initial
+        self._active = 0
+        self._condition = threading.Condition()
+        self._last_throughput = None
+        self._start_window()
+
+    def _start_window(self):
+        self._completed = 0
+        self._failed = False
+        self._window_start = time.monotonic()
+        self._cpu_start = get_cpu_seconds()
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Wait until the limit allows one more repository and hold the slot within the context"""
+        with self._condition:
+            while self._active >= self.limit:
+                self._condition.wait()
+            self._active += 1
+
+        try:
+            yield
+        except Exception:
+            self._complete(failed=True)
+            raise
+        self._complete(failed=False)
+
+    def report_failure(self):
+        """Report an error that was handled within the slot"""
+        with self._condition:
+            self._failed = True
+
+    def _complete(self, failed: bool):
+        with self._condition:
+            self._active -= 1
+            self._completed += 1
+            self._failed = self._failed or failed
+
+            if self._completed >= self.limit:
+                self._adjust()
+            self._condition.notify_all()
+
+    def _adjust(self):
+        """Change the limit based on the window that just completed"""
+        elapsed = max(time.monotonic() - self._window_start, 1e-6)
+        throughput = self._completed / elapsed
+        cpu_busy = (get_cpu_seconds() - self._cpu_start) / (elapsed * get_cpu_count())
+
+        if self._failed:
+            self.limit = max(1, self.limit // 2)
+        elif cpu_busy < CPU_SATURATION and (
+            self._last_throughput is None or throughput > self._last_throughput * RAMP_UP_THRESHOLD
+        ):
+            self.limit = min(self.maximum, self.limit + 1)
+
+        self.peak = max(self.peak, self.limit)
+        self._last_throughput = throughput
+        self._start_window()
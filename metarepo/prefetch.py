@@ -0,0 +1,93 @@
+"""Record of the commits fetched in the background by the prefetch command"""
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .defaults import PREFETCH_MAX_AGE
+from .history import STATE_DIR, load_state, save_state
+from .manifest import Repository
+
+# Prefetch log filename, stored in STATE_DIR
+PREFETCH_NAME = "prefetch.json"
+
+# Bump when the format of the prefetch log changes
+PREFETCH_VERSION = 1
+
+
+class PrefetchLog:
+    """The commit fetched by the last prefetch of every repository in a workspace"""
+
+    def __init__(self, path: Path, entries: Optional[Dict[str, dict]] = None):
+        """
+        Prefetch log
+        :param path: Path to the prefetch log
+        :param entries: Last prefetch of each repository path
+        """
+        self._path = path
+        self._entries = entries or {}
+
+    @classmethod
+    def load(cls, root_path: Path) -> "PrefetchLog":
+        """
+        Load the prefetch log of a workspace, a missing or unreadable log is empty
+        :param root_path: Path to the workspace root
+        :return: PrefetchLog
+        """
+        path = root_path / STATE_DIR / PREFETCH_NAME
+        return cls(path, load_state(path, PREFETCH_VERSION))
+
+    def save(self):
+        """Write the prefetch log to disk"""
+        save_state(self._path, PREFETCH_VERSION, self._entries)
+
+    def record(self, repo_data: Repository, sha: str):
+        """
+        Record a prefetch
+        :param repo_data: Repository that was prefetched
+        :param sha: Commit of the tracked branch that was fetched
+        """
+        self._entries[Path(repo_data.path).as_posix()] = {
+            "time": time.time(),
+            "url": repo_data.url,
+            "track": repo_data.track,
+            "sha": sha,
+        }
+
+    def get_sha(self, repo_data: Repository, max_age: Optional[float] = None) -> Optional[str]:
+        """
+        Get the commit fetched by the last prefetch of a repository
+        :param repo_data: Repository
+        :param max_age: Ignore prefetches older than this many seconds, None to accept any age
+        :return: Hex SHA or None if there is no prefetch of the tracked branch that is recent enough
+        """
+        entry = self._entries.get(Path(repo_data.path).as_posix())
+        if entry is None or entry.get("url") != repo_data.url or entry.get("track") != repo_data.track:
+            return None
+
+        if max_age is not None and time.time() - entry["time"] > max_age:
+            return None
+        return entry["sha"]
+
+    def get_usable_shas(
+        self, repos: List[Repository], remote_shas: Dict[Path, Optional[str]], max_age: float = PREFETCH_MAX_AGE
+    ) -> Dict[Path, str]:
+        """
+        Get the prefetched commits that sync can use instead of fetching
+        :param repos: Repositories
+        :param remote_shas: SHA of the tracked branch on the remote for the repositories that have been probed
+        :param max_age: Maximum age in seconds of prefetches of repositories that have not been probed
+        :return: Dictionary of repository paths and prefetched SHAs
+        """
+        shas = {}
+        for repo_data in repos:
+            remote_sha = remote_shas.get(repo_data.path)
+            if remote_sha is not None:
+                # Any prefetch of the current commit on the remote is as good as a fetch
+                sha = self.get_sha(repo_data)
+                sha = sha if sha == remote_sha else None
+            else:
+                sha = self.get_sha(repo_data, max_age)
+
+            if sha is not None:
+                shas[repo_data.path] = sha
+        return shas
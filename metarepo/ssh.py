@@ -0,0 +1,182 @@
+"""SSH connection multiplexing"""
+import concurrent.futures
+import contextlib
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+from collections import namedtuple
+from typing import Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+# How long an idle master connection is kept if it is not torn down explicitly
+CONTROL_PERSIST = "120s"
+
+# Seconds to wait for a master connection to be set up or torn down
+CONNECT_TIMEOUT = 30
+
+SSH_SCHEMES = ("ssh", "git+ssh", "ssh+git")
+
+SshTarget = namedtuple("SshTarget", ["user", "host", "port"])
+
+
+def get_ssh_target(url: str) -> Optional[SshTarget]:
+    """
+    Get the SSH destination of a remote URL
+    :param url: Remote URL
+    :return: SshTarget or None if the URL does not use SSH
+    """
+    if "://" in url:
+        parts = urlsplit(url)
+        if parts.scheme not in SSH_SCHEMES or not parts.hostname:
+            return None
+        return SshTarget(parts.username, parts.hostname, parts.port)
+
+    # scp-like syntax, a colon before the first slash
+    host, colon, _ = url.partition(":")
+    if colon and "/" not in host and len(host) > 1:
+        user, _, host = host.rpartition("@")
+        return SshTarget(user or None, host, None)
+
+    return None
+
+
+def _get_destination_args(target: SshTarget) -> List[str]:
+    """
+    Get the ssh arguments selecting a target
+    :param target: SshTarget
+    :return: List of arguments
+    """
+    port_args = ["-p", str(target.port)] if target.port else []
+    return [*port_args, f"{target.user}@{target.host}" if target.user else target.host]
+
+
+def _get_configured_ssh_command(cwd: str) -> Optional[str]:
+    """
+    Get core.sshCommand from the system and global git configuration
+    :param cwd: Directory outside of any repository
+    :return: Command or None if not configured
+    """
+    try:
+        output = subprocess.run(
+            ["git", "config", "--get", "core.sshCommand"],
+            cwd=cwd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            timeout=CONNECT_TIMEOUT,
+        ).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return output.decode("utf-8", "replace").strip() or None
+
+
+def _get_base_command(control_dir: str) -> Optional[Tuple[str, str]]:
+    """
+    Get the SSH command git would use and how to extend it without changing what git runs otherwise
+
+    GIT_SSH_COMMAND takes precedence over everything, so it can be extended in place. Otherwise
+    the extended command is installed as GIT_SSH, which git uses only if no core.sshCommand is
+    configured, so repositories with an SSH command of their own keep using it, unshared.
+
+    :param control_dir: Directory outside of any repository
+    :return: (Base command, environment variable to install the extended command in) or None if
+             the SSH command can not be extended
+    """
+    ssh_command = os.environ.get("GIT_SSH_COMMAND")
+    if ssh_command:
+        return ssh_command, "GIT_SSH_COMMAND"
+
+    # A global core.sshCommand beats GIT_SSH, extending it in GIT_SSH_COMMAND would override the repositories' own
+    if _get_configured_ssh_command(control_dir):
+        return None
+
+    ssh_program = os.environ.get("GIT_SSH")
+    if ssh_program:
+        # The control options are only understood by OpenSSH
+        if "plink" in os.path.basename(ssh_program).lower() or os.environ.get("GIT_SSH_VARIANT", "ssh") != "ssh":
+            return None
+        return shlex.quote(ssh_program), "GIT_SSH"
+
+    return "ssh", "GIT_SSH"
+
+
+@contextlib.contextmanager
+def multiplexed(urls: Iterable[str]):
+    """
+    Share one SSH connection per host for all git commands run within the context
+
+    The SSH command used by git is extended with ControlMaster options for the duration of
+    the context, see _get_base_command(). A master connection is set up for every SSH host
+    in urls before yielding, and all master connections are closed afterwards.
+
+    :param urls: Remote URLs that will be used
+    """
+    targets = {target for target in map(get_ssh_target, urls) if target is not None}
+
+    # OpenSSH on Windows does not support control sockets
+    if not targets or os.name == "nt":
+        yield
+        return
+
+    control_dir = tempfile.mkdtemp(prefix="metarepo-ssh-")
+    base = _get_base_command(control_dir)
+    if base is None:
+        shutil.rmtree(control_dir, ignore_errors=True)
+        yield
+        return
+
+    base_command, variable = base
+    previous_command = os.environ.get(variable)
+    control_options = [
+        "-o",
+        "ControlMaster=auto",
+        "-o",
+        f"ControlPath={os.path.join(control_dir, '%C')}",
+        "-o",
+        f"ControlPersist={CONTROL_PERSIST}",
+    ]
+    ssh_command = [*shlex.split(base_command), *control_options]
+    extended_command = " ".join([base_command, *map(shlex.quote, control_options)])
+
+    def run_ssh(target: SshTarget, *args: str):
+        try:
+            subprocess.run(
+                [*ssh_command, *args, *_get_destination_args(target)],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=CONNECT_TIMEOUT,
+            )
+        except (OSError, subprocess.TimeoutExpired):
+            # Without a master connection every git command connects by itself
+            pass
+
+    if variable == "GIT_SSH":
+        # GIT_SSH is a program without arguments, named ssh so that git passes OpenSSH style options
+        wrapper = os.path.join(control_dir, "wrapper", "ssh")
+        os.mkdir(os.path.dirname(wrapper))
+        with open(wrapper, "w") as fp:
+            fp.write(f'#!/bin/sh\nexec {extended_command} "$@"\n')
+        os.chmod(wrapper, 0o755)
+        extended_command = wrapper
+
+    os.environ[variable] = extended_command
+
+    try:
+        # Set up the master connections up front, otherwise
+        # concurrent git commands would race to become the master
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(targets)) as pool:
+            list(pool.map(lambda target: run_ssh(target, "-o", "BatchMode=yes", "-N", "-f"), targets))
+
+        yield
+    finally:
+        if previous_command is None:
+            del os.environ[variable]
+        else:
+            os.environ[variable] = previous_command
+
+        for target in targets:
+            run_ssh(target, "-O", "exit")
+        shutil.rmtree(control_dir, ignore_errors=True)
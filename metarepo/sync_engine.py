@@ -0,0 +1,957 @@
+"""Synchronization of repositories"""
+import asyncio
+import concurrent.futures
+import contextlib
+import copy
+import functools
+import itertools
+import multiprocessing
+import multiprocessing.managers
+import multiprocessing.util
+import queue
+import random
+import re
+import threading
+import time
+from collections import defaultdict, namedtuple
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import git
+from prompt_toolkit import ANSI
+from prompt_toolkit.shortcuts.progress_bar import ProgressBar
+
+from . import history, ui, vcs_git
+from .cache import ObjectCache
+from .defaults import FETCHES_PER_HOST
+from .manifest import Repository
+from .parallel import AdaptiveLimiter
+
+SyncResult = namedtuple(
+    "SyncResult",
+    ["repo", "success", "commit", "fetched", "timing", "details", "skipped", "retries"],
+    defaults=[True, None, "", False, 0],
+)
+SyncTask = namedtuple(
+    "SyncTask",
+    ["repo_path", "repo_data", "locked_commit", "remote_sha", "tune", "prefetch_sha"],
+    defaults=[None, None, False, None],
+)
+
+# Maximum number of concurrent remote probes against the same host
+PROBES_PER_HOST = 8
+
+# Amount of data in git progress output, e.g. "1.25 MiB" but not the rate "1.25 MiB/s"
+TRANSFER_SIZE_PATTERN = re.compile(r"(\d+(?:\.\d+)?) (bytes|KiB|MiB|GiB)(?!/s)")
+TRANSFER_SIZE_UNITS = {"bytes": 1, "KiB": 1024, "MiB": 1024**2, "GiB": 1024**3}
+
+# Fetch errors that are worth retrying, matched against the lower cased error output of git
+TRANSIENT_ERRORS = (
+    "connection reset",
+    "connection refused",
+    "connection timed out",
+    "operation timed out",
+    "timed out",
+    "could not resolve host",
+    "temporary failure in name resolution",
+    "early eof",
+    "the remote end hung up unexpectedly",
+    "unexpected disconnect",
+    "rpc failed",
+    "ssl_error_syscall",
+    "gnutls_handshake",
+    "returned error: 429",
+    "returned error: 502",
+    "returned error: 503",
+    "returned error: 504",
+)
+
+
+class SyncSkipped(Exception):
+    """Repository was left untouched"""
+
+
+def is_transient_error(message: str) -> bool:
+    """
+    Check if a fetch failed for a reason that is likely to go away by itself
+    :param message: Error output of git
+    :return: True if the fetch is worth retrying
+    """
+    message = message.lower()
+    return any(error in message for error in TRANSIENT_ERRORS)
+
+
+class RetryPolicy:
+    """
+    Retries transient fetch failures with exponential backoff
+
+    The number of retries is limited per repository and by a budget shared by
+    all repositories, so an unreachable host does not delay the whole run.
+    """
+
+    def __init__(
+        self, retries: int = 0, budget: Optional[int] = None, base_delay: float = 1.0, max_delay: float = 30.0
+    ):
+        """
+        Retry policy
+        :param retries: Maximum number of retries per repository
+        :param budget: Maximum number of retries in total (unlimited if None)
+        :param base_delay: Delay before the first retry in seconds, doubled for every following retry
+        :param max_delay: Maximum delay in seconds
+        """
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Remaining budget in a list, which can be replaced by a list shared between processes
+        self._remaining = [budget] if budget is not None else None
+        self._lock = threading.Lock()
+
+    def share(self, manager: multiprocessing.managers.SyncManager) -> "RetryPolicy":
+        """
+        Get a copy of the policy whose budget is shared by all processes it is passed to
+        :param manager: Manager holding the shared state
+        :return: RetryPolicy
+        """
+        policy = copy.copy(self)
+        policy._lock = manager.Lock()
+        if self._remaining is not None:
+            policy._remaining = manager.list(self._remaining)
+        return policy
+
+    def get_delay(self, attempt: int, message: str) -> Optional[float]:
+        """
+        Decide whether a failed attempt is retried
+        :param attempt: Number of failed attempts before this one
+        :param message: Error output of git
+        :return: Seconds to wait before retrying or None if the failure is final
+        """
+        if attempt >= self.retries or not is_transient_error(message):
+            return None
+
+        with self._lock:
+            if self._remaining is not None:
+                if self._remaining[0] <= 0:
+                    return None
+                self._remaining[0] -= 1
+
+        # Full jitter keeps repositories failing at the same time from retrying in lockstep
+        delay = min(self.max_delay, self.base_delay * 2**attempt)
+        return random.uniform(delay / 2, delay)
+
+    def call(self, func: Callable, timer: "SyncTimer"):
+        """
+        Call a function running git, retrying transient failures
+        :param func: Function to call
+        :param timer: Timer counting the retries
+        :return: Return value of func
+        """
+        attempt = 0
+        while True:
+            try:
+                return func()
+            except git.GitCommandError as exc:
+                delay = self.get_delay(attempt, str(exc.stderr))
+                if delay is None:
+                    raise
+            timer.retries += 1
+            attempt += 1
+            time.sleep(delay)
+
+
+class ProgressReporter:
+    """Shows the label of one repository, the progress bar entry is added on the first update"""
+
+    def __init__(self, progress: ProgressBar):
+        """
+        Progress reporter
+        :param progress: ProgressBar instance
+        """
+        self._progress = progress
+        self._counter = None
+
+    def __call__(self, label: str):
+        """
+        Update label
+        :param label: Formatted label
+        """
+        if self._counter is None:
+            self._counter = self._progress()
+        self._counter.label = ANSI(label)
+
+
+def parse_transfer_size(text: str) -> Optional[int]:
+    """
+    Get the amount of data received from git progress output
+    :param text: Progress output
+    :return: Number of bytes or None if the output does not mention it
+    """
+    matches = TRANSFER_SIZE_PATTERN.findall(text)
+    if not matches:
+        return None
+    amount, unit = matches[-1]
+    return int(float(amount) * TRANSFER_SIZE_UNITS[unit])
+
+
+class SyncTimer:
+    """Measures where the time synchronizing one repository is spent"""
+
+    def __init__(self):
+        self.fetch_seconds = 0.0
+        self.checkout_seconds = 0.0
+        self.tune_seconds = 0.0
+        self.bytes_received = None
+        self.retries = 0
+
+    @contextlib.contextmanager
+    def measure(self, phase: str):
+        """
+        Add the time spent within the context to a phase
+        :param phase: 'fetch', 'checkout' or 'tune'
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            attribute = f"{phase}_seconds"
+            setattr(self, attribute, getattr(self, attribute) + time.perf_counter() - start)
+
+    def get_timing(self) -> history.Timing:
+        """Get the measured timing, tuning is left out since it mostly happens on the first sync only"""
+        return history.Timing(self.fetch_seconds, self.checkout_seconds, self.bytes_received)
+
+
+class FetchProgress(git.RemoteProgress):
+    """Records the amount of data received by a fetch"""
+
+    def __init__(self, timer: SyncTimer):
+        """
+        Fetch progress
+        :param timer: Timer to record the amount of data in
+        """
+        super().__init__()
+        self._timer = timer
+
+    def update(self, op_code, cur_count, max_count=None, message=""):
+        if op_code & self.RECEIVING and message:
+            size = parse_transfer_size(message)
+            if size is not None:
+                self._timer.bytes_received = size
+
+
+def create_repo(repo_path: Path, repo_data: Repository, object_cache: Optional[ObjectCache] = None):
+    """
+    Create a new empty repository
+    :param repo_path: Path to repository
+    :param repo_data: Repository data
+    :param object_cache: Object cache to borrow objects from (if any)
+    """
+    # Shallow repositories only need a few objects and are not worth caching
+    if object_cache and not repo_data.depth:
+        try:
+            object_cache.update(repo_data.url, repo_data.track, repo_data.filter)
+        except git.GitCommandError:
+            # The cache is just an optimization, continue without it
+            object_cache = None
+    else:
+        object_cache = None
+
+    repo = git.Repo.init(repo_path)
+    repo.create_remote("origin", repo_data.url)
+
+    if object_cache:
+        object_cache.link(repo_data.url, Path(repo.git_dir))
+
+
+def interleave_by_host(items: list, get_url: Callable = lambda repo: repo.url) -> list:
+    """
+    Order items so that consecutive items use different remote hosts when possible
+    :param items: Repositories or anything get_url can retrieve the remote URL from
+    :param get_url: Function returning the remote URL of an item
+    :return: Reordered items
+    """
+    by_host = defaultdict(list)
+    for item in items:
+        by_host[vcs_git.get_remote_host(get_url(item))].append(item)
+
+    return [item for group in itertools.zip_longest(*by_host.values()) for item in group if item is not None]
+
+
+def probe_remotes(root_path: Path, repos: List[Repository]) -> Dict[Path, Optional[str]]:
+    """
+    Retrieve the SHA of the tracked branch on the remote of every existing repository
+    :param root_path: Path to the workspace root
+    :param repos: Repositories to probe
+    :return: Dictionary with the remote SHA (or None if unknown) for each probed repository path
+    """
+    repos = interleave_by_host([repo for repo in repos if (root_path / repo.path).exists()])
+    host_limits = {vcs_git.get_remote_host(repo.url): threading.Semaphore(PROBES_PER_HOST) for repo in repos}
+
+    def probe(repo_data: Repository) -> Optional[str]:
+        with host_limits[vcs_git.get_remote_host(repo_data.url)]:
+            try:
+                return vcs_git.probe_remote_sha(repo_data.url, repo_data.track)
+            except git.GitCommandError:
+                # Let the fetch report the problem
+                return None
+
+    if not repos:
+        return {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(repos), PROBES_PER_HOST * len(host_limits))) as pool:
+        return dict(zip([repo.path for repo in repos], pool.map(probe, repos)))
+
+
+def apply_sparse_patterns(repo: vcs_git.RepoTool, repo_data: Repository, timer: SyncTimer) -> list:
+    """
+    Change the sparse checkout patterns of a repository to the ones in the manifest
+    :param repo: Repository
+    :param repo_data: Repository data
+    :param timer: Timer measuring the checkout
+    :return: List of extra attributes to display
+    """
+    with timer.measure("checkout"):
+        if not repo.set_sparse_patterns(repo_data.sparse):
+            return []
+
+    if repo_data.sparse is None:
+        return ["Sparse checkout disabled"]
+    return [("sparse", ",".join(repo_data.sparse))]
+
+
+def apply_tuning(repo: vcs_git.RepoTool, timer: SyncTimer):
+    """
+    Configure a repository for fast status, see 'metarepo tune'
+    :param repo: Repository
+    :param timer: Timer measuring the tuning
+    """
+    with timer.measure("tune"):
+        try:
+            repo.tune()
+        except git.GitCommandError:
+            # Only an optimization, the repository is synchronized either way
+            pass
+
+
+def fetch_track(
+    repo: vcs_git.RepoTool,
+    repo_data: Repository,
+    remote_sha: Optional[str],
+    prefetched: bool,
+    prefetch_sha: Optional[str],
+    timer: SyncTimer,
+    retry_policy: RetryPolicy,
+) -> Tuple[vcs_git.FetchResult, bool]:
+    """
+    Bring origin/<track> up to date, fetching only if needed
+    :param repo: Repository
+    :param repo_data: Repository data
+    :param remote_sha: SHA of the tracked branch on the remote if it has been probed
+    :param prefetched: The tracked branch has already been fetched
+    :param prefetch_sha: SHA fetched by the prefetch command, if recent enough to be used instead of fetching
+    :param timer: Timer measuring the fetch
+    :param retry_policy: Policy for retrying failed fetches
+    :return: (FetchResult, True if fetched from the remote)
+    """
+    if prefetched:
+        return repo.compare_to_remote(repo_data.track), True
+
+    # Nothing changed on the remote since the last fetch, or it has been fetched in the background
+    if (remote_sha is not None and repo.get_remote_sha(repo_data.track) == remote_sha) or (
+        prefetch_sha is not None and repo.use_prefetched(repo_data.track, prefetch_sha)
+    ):
+        return repo.compare_to_remote(repo_data.track), False
+
+    fetch = functools.partial(
+        repo.fetch, repo_data.track, FetchProgress(timer), depth=repo_data.depth, filter_spec=repo_data.filter
+    )
+    with timer.measure("fetch"):
+        return retry_policy.call(fetch, timer), True
+
+
+def sync_to_track(
+    repo: vcs_git.RepoTool,
+    repo_data: Repository,
+    remote_sha: Optional[str] = None,
+    prefetched: bool = False,
+    timer: Optional[SyncTimer] = None,
+    retry_policy: Optional[RetryPolicy] = None,
+    prefetch_sha: Optional[str] = None,
+):
+    """
+    Fetch the tracked branch and check it out
+    :param repo: Repository
+    :param repo_data: Repository data
+    :param remote_sha: SHA of the tracked branch on the remote if it has been probed
+    :param prefetched: The tracked branch has already been fetched
+    :param timer: Timer measuring the fetch and checkout
+    :param retry_policy: Policy for retrying failed fetches
+    :param prefetch_sha: SHA fetched by the prefetch command, if recent enough to be used instead of fetching
+    :return: (Checked out commit, list of extra attributes to display, True if fetched)
+    """
+    timer = timer or SyncTimer()
+    retry_policy = retry_policy or RetryPolicy()
+    fetch_result, fetched = fetch_track(repo, repo_data, remote_sha, prefetched, prefetch_sha, timer, retry_policy)
+
+    # Warn if ahead
+    if fetch_result.ahead:
+        raise SyncSkipped(f"Ahead by {fetch_result.ahead} commit(s)")
+
+    status = repo.get_status()
+
+    # Warn if dirty
+    if status.is_dirty:
+        raise SyncSkipped("Workspace is dirty")
+
+    current_commit = status.head_sha
+    new_commit = fetch_result.fetch_head.hexsha
+
+    extras = []
+
+    if current_commit is None:
+        extras.append(f"Checked out {repo_data.track}")
+    elif current_commit == new_commit:
+        extras.append("Already up to date")
+    else:
+        extras.append(("update", f"{current_commit[0:7]} -> {new_commit[0:7]}"))
+        extras.append(("commits", fetch_result.behind))
+
+    # Applied before the checkout so that only the selected paths are written
+    extras.extend(apply_sparse_patterns(repo, repo_data, timer))
+
+    if current_commit != new_commit or status.branch != repo_data.track:
+        with timer.measure("checkout"):
+            repo.checkout("origin/" + repo_data.track, repo_data.track)
+    return new_commit, extras, fetched
+
+
+def sync_to_commit(
+    repo: vcs_git.RepoTool,
+    repo_data: Repository,
+    commit: str,
+    timer: Optional[SyncTimer] = None,
+    retry_policy: Optional[RetryPolicy] = None,
+):
+    """
+    Check out a locked commit, only using the network if the commit is missing
+    :param repo: Repository
+    :param repo_data: Repository data
+    :param commit: Commit SHA to check out
+    :param timer: Timer measuring the fetch and checkout
+    :param retry_policy: Policy for retrying failed fetches
+    :return: (Checked out commit, list of extra attributes to display, True if fetched)
+    """
+    timer = timer or SyncTimer()
+    retry_policy = retry_policy or RetryPolicy()
+    status = repo.get_status()
+
+    if status.head_sha == commit and status.branch == repo_data.track:
+        # Sparse checkout patterns are not changed underneath local changes
+        extras = [] if status.is_dirty else apply_sparse_patterns(repo, repo_data, timer)
+        return commit, ["Already up to date", *extras], False
+
+    # Warn if dirty
+    if status.is_dirty:
+        raise SyncSkipped("Workspace is dirty")
+
+    fetched = not repo.has_commit(commit)
+    with timer.measure("fetch"):
+        if fetched:
+            retry_policy.call(
+                lambda: repo.fetch(
+                    repo_data.track, FetchProgress(timer), depth=repo_data.depth, filter_spec=repo_data.filter
+                ),
+                timer,
+            )
+        if not repo.has_commit(commit):
+            # The locked commit is no longer on the tracked branch
+            retry_policy.call(
+                lambda: repo.fetch_commit(commit, depth=repo_data.depth, filter_spec=repo_data.filter), timer
+            )
+
+    # Warn if checking out would lose local commits
+    if repo.has_head(repo_data.track):
+        ahead, _ = repo.count_divergence(repo_data.track, commit)
+        if ahead:
+            raise SyncSkipped(f"Ahead by {ahead} commit(s)")
+
+    if status.head_sha is None:
+        extras = [f"Checked out {commit[0:7]}"]
+    else:
+        extras = [("update", f"{status.head_sha[0:7]} -> {commit[0:7]}")]
+    extras.extend(apply_sparse_patterns(repo, repo_data, timer))
+
+    with timer.measure("checkout"):
+        repo.checkout(commit, repo_data.track)
+    return commit, extras, fetched
+
+
+def describe_error(exc: Exception) -> str:
+    """
+    Describe why synchronizing a repository failed
+    :param exc: Exception
+    :return: One line description
+    """
+    if isinstance(exc, git.GitCommandError):
+        return vcs_git.get_error_message(str(exc.stderr))
+    if isinstance(exc, vcs_git.InvalidRepository):
+        return "Invalid repository"
+    if isinstance(exc, vcs_git.WrongOrigin):
+        return "Origin mismatch"
+    if isinstance(exc, vcs_git.NotFound):
+        return f"Not found: {exc}"
+    return str(exc) or type(exc).__name__
+
+
+def format_details(extras: list) -> str:
+    """
+    Format the extra attributes of a synchronized repository as plain text
+    :param extras: Extra attributes as passed to ui.format_item_ok()
+    :return: Formatted attributes
+    """
+    return ", ".join(extra if isinstance(extra, str) else f"{extra[0]}: {extra[1]}" for extra in extras)
+
+
+def do_sync_repo(
+    report: Callable[[str], None],
+    repo_path: Path,
+    repo_data: Repository,
+    object_cache: Optional[ObjectCache] = None,
+    locked_commit: Optional[str] = None,
+    remote_sha: Optional[str] = None,
+    prefetched: bool = False,
+    timer: Optional[SyncTimer] = None,
+    retry_policy: Optional[RetryPolicy] = None,
+    tune: bool = False,
+    prefetch_sha: Optional[str] = None,
+) -> SyncResult:
+    """
+    Perform synchronization of one repository
+    Failures are reported and returned as the result, they are never raised.
+    :param report: Function called with the formatted label of the repository
+    :param repo_path: Path to repository
+    :param repo_data: Repository data
+    :param object_cache: Object cache used when creating new repositories (if any)
+    :param locked_commit: Check out this commit instead of the tip of the tracked branch
+    :param remote_sha: SHA of the tracked branch on the remote if it has been probed
+    :param prefetched: The tracked branch has already been fetched
+    :param timer: Timer that already holds the time spent prefetching (if any)
+    :param retry_policy: Policy for retrying failed fetches
+    :param tune: Configure the repository for fast status
+    :param prefetch_sha: SHA fetched by the prefetch command, if recent enough to be used instead of fetching
+    :return: SyncResult
+    """
+    timer = timer or SyncTimer()
+    report(ui.format_item(str(repo_data.path), ("track", repo_data.track)))
+
+    try:
+        if not repo_path.exists():
+            with timer.measure("fetch"):
+                create_repo(repo_path, repo_data, object_cache)
+
+        repo = vcs_git.RepoTool(repo_path, repo_data.url)
+
+        if locked_commit:
+            commit, extras, fetched = sync_to_commit(repo, repo_data, locked_commit, timer, retry_policy)
+        else:
+            commit, extras, fetched = sync_to_track(
+                repo, repo_data, remote_sha, prefetched, timer, retry_policy, prefetch_sha
+            )
+
+        if tune:
+            apply_tuning(repo, timer)
+    except SyncSkipped as exc:
+        report(ui.format_item_error(f"Skipped {repo_data.path!s}", err=str(exc)))
+        return SyncResult(repo_data, False, None, details=str(exc), skipped=True, retries=timer.retries)
+    except (vcs_git.GitError, git.GitError, OSError) as exc:
+        error = describe_error(exc)
+        report(ui.format_item_error(f"Unable to sync {repo_data.path!s}", error))
+        return SyncResult(repo_data, False, None, details=error, retries=timer.retries)
+
+    report(ui.format_item_ok(str(repo_data.path), *extras))
+    return SyncResult(
+        repo_data, True, commit, fetched, timer.get_timing(), details=format_details(extras), retries=timer.retries
+    )
+
+
+def sync_task(
+    report: Callable[[str], None],
+    task: SyncTask,
+    object_cache: Optional[ObjectCache] = None,
+    prefetched: bool = False,
+    timer: Optional[SyncTimer] = None,
+    retry_policy: Optional[RetryPolicy] = None,
+) -> SyncResult:
+    """
+    Perform synchronization of one repository
+    :param report: Function called with the formatted label of the repository
+    :param task: Repository to synchronize
+    :param object_cache: Object cache used when creating new repositories (if any)
+    :param prefetched: The tracked branch has already been fetched
+    :param timer: Timer that already holds the time spent prefetching (if any)
+    :param retry_policy: Policy for retrying failed fetches
+    :return: SyncResult
+    """
+    return do_sync_repo(
+        report,
+        task.repo_path,
+        task.repo_data,
+        object_cache,
+        task.locked_commit,
+        task.remote_sha,
+        prefetched,
+        timer,
+        retry_policy,
+        task.tune,
+        task.prefetch_sha,
+    )
+
+
+def run_threaded(
+    progress: ProgressBar,
+    tasks: List[SyncTask],
+    parallel: int,
+    object_cache: Optional[ObjectCache] = None,
+    stop_on_failure: bool = False,
+    limiter: Optional[AdaptiveLimiter] = None,
+    retry_policy: Optional[RetryPolicy] = None,
+) -> List[SyncResult]:
+    """
+    Synchronize repositories using a thread pool
+    :param progress: ProgressBar instance
+    :param tasks: Repositories to synchronize
+    :param parallel: Number of repositories to synchronize in parallel, the upper bound if a limiter is used
+    :param object_cache: Object cache used when creating new repositories (if any)
+    :param stop_on_failure: Stop starting new repositories after the first failure
+    :param limiter: Limiter adjusting the number of repositories synchronized in parallel (if any)
+    :param retry_policy: Policy for retrying failed fetches
+    :return: Results of all repositories that have been synchronized
+    """
+    results = []
+    slot = limiter.slot if limiter else contextlib.nullcontext
+    stop = threading.Event()
+
+    def run(task: SyncTask) -> Optional[SyncResult]:
+        # Repositories that have not been started are left alone after a failure
+        if stop.is_set():
+            return None
+
+        with slot():
+            result = sync_task(ProgressReporter(progress), task, object_cache, retry_policy=retry_policy)
+            # Back off if the remote is struggling
+            if limiter and (result.retries or not (result.success or result.skipped)):
+                limiter.report_failure()
+
+        if stop_on_failure and not result.success:
+            stop.set()
+        return result
+
+    with vcs_git.shared_repositories(), concurrent.futures.ThreadPoolExecutor(max_workers=parallel) as thread_pool:
+        futures = [thread_pool.submit(run, task) for task in tasks]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            if result is not None:
+                results.append(result)
+
+    return results
+
+
+def _init_worker():
+    """Share open repositories between all repositories synchronized by a worker process until it exits"""
+    stack = contextlib.ExitStack()
+    stack.enter_context(vcs_git.shared_repositories())
+    multiprocessing.util.Finalize(None, stack.close, exitpriority=10)
+
+
+def _sync_in_process(
+    labels: queue.Queue,
+    stop: threading.Event,
+    index: int,
+    task: SyncTask,
+    object_cache: Optional[ObjectCache],
+    retry_policy: RetryPolicy,
+    stop_on_failure: bool,
+) -> Optional[SyncResult]:
+    """
+    Synchronize one repository in a worker process
+    :param labels: Queue the labels are sent to as (index, label)
+    :param stop: Event set when no more repositories should be started
+    :param index: Index of the repository, identifies its labels
+    :param task: Repository to synchronize
+    :param object_cache: Object cache used when creating new repositories (if any)
+    :param retry_policy: Policy for retrying failed fetches
+    :param stop_on_failure: Set stop if the repository fails
+    :return: SyncResult or None if the repository was not started
+    """
+    if stop.is_set():
+        return None
+
+    result = sync_task(lambda label: labels.put((index, label)), task, object_cache, retry_policy=retry_policy)
+    if stop_on_failure and not result.success:
+        stop.set()
+    return result
+
+
+def run_process_pool(
+    progress: ProgressBar,
+    tasks: List[SyncTask],
+    parallel: int,
+    object_cache: Optional[ObjectCache] = None,
+    stop_on_failure: bool = False,
+    retry_policy: Optional[RetryPolicy] = None,
+) -> List[SyncResult]:
+    """
+    Synchronize repositories using a process pool
+
+    Every repository is synchronized in a worker process, so parsing the output
+    of git does not contend for the GIL of a single process. Labels are sent
+    back over a queue and shown by the progress bar of this process.
+
+    :param progress: ProgressBar instance
+    :param tasks: Repositories to synchronize
+    :param parallel: Number of worker processes
+    :param object_cache: Object cache used when creating new repositories (if any)
+    :param stop_on_failure: Stop starting new repositories after the first failure
+    :param retry_policy: Policy for retrying failed fetches, the budget is shared by all workers
+    :return: Results of all repositories that have been synchronized
+    """
+    results = []
+    reporters = [ProgressReporter(progress) for _ in tasks]
+
+    # Forking a process that runs the progress bar thread is not safe, always start fresh interpreters
+    context = multiprocessing.get_context("spawn")
+
+    with context.Manager() as manager:
+        labels = manager.Queue()
+        stop = manager.Event()
+        retry_policy = (retry_policy or RetryPolicy()).share(manager)
+
+        def show_labels():
+            for index, label in iter(labels.get, None):
+                reporters[index](label)
+
+        label_thread = threading.Thread(target=show_labels, daemon=True)
+        label_thread.start()
+
+        try:
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=parallel, mp_context=context, initializer=_init_worker
+            ) as pool:
+                futures = [
+                    pool.submit(
+                        _sync_in_process, labels, stop, index, task, object_cache, retry_policy, stop_on_failure
+                    )
+                    for index, task in enumerate(tasks)
+                ]
+                for future in concurrent.futures.as_completed(futures):
+                    result = future.result()
+                    if result is not None:
+                        results.append(result)
+        finally:
+            labels.put(None)
+            label_thread.join()
+
+    return results
+
+
+def prepare_fetch(task: SyncTask, object_cache: Optional[ObjectCache] = None) -> Optional[List[str]]:
+    """
+    Create the repository if needed and get the command line that fetches its tracked branch
+    :param task: Repository to synchronize
+    :param object_cache: Object cache used when creating new repositories (if any)
+    :return: Command line or None if the repository does not need to be fetched
+    """
+    repo_data = task.repo_data
+
+    if not task.repo_path.exists():
+        create_repo(task.repo_path, repo_data, object_cache)
+
+    try:
+        repo = vcs_git.RepoTool(task.repo_path, repo_data.url)
+    except vcs_git.GitError:
+        # Reported when synchronizing
+        return None
+
+    if task.remote_sha is not None and repo.get_remote_sha(repo_data.track) == task.remote_sha:
+        return None
+
+    # Fetched in the background, unless the prefetched commit is older than origin/<track> already is
+    if task.prefetch_sha is not None and repo.use_prefetched(repo_data.track, task.prefetch_sha):
+        return None
+
+    return repo.get_fetch_command(repo_data.track, depth=repo_data.depth, filter_spec=repo_data.filter, progress=True)
+
+
+class AsyncSyncEngine:
+    """
+    Synchronize repositories running fetches as asyncio subprocesses
+
+    The number of concurrent fetches is limited both globally and per remote host.
+    Repositories are started interleaved by host so that waiting on a busy host
+    does not keep other hosts waiting. Local work (status, checkout) runs in a
+    thread pool once the fetch is done.
+    """
+
+    def __init__(
+        self,
+        progress: ProgressBar,
+        parallel: int,
+        object_cache: Optional[ObjectCache] = None,
+        max_per_host: Optional[int] = None,
+        host_limits: Optional[Dict[str, int]] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+    ):
+        """
+        Async sync engine
+        :param progress: ProgressBar instance
+        :param parallel: Maximum number of repositories synchronized in parallel
+        :param object_cache: Object cache used when creating new repositories (if any)
+        :param max_per_host: Maximum number of concurrent fetches against one host (default: FETCHES_PER_HOST)
+        :param host_limits: Maximum number of concurrent fetches for specific hosts
+        :param retry_policy: Policy for retrying failed fetches
+        """
+        self._progress = progress
+        self._parallel = parallel
+        self._object_cache = object_cache
+        self._max_per_host = max_per_host or FETCHES_PER_HOST
+        self._host_limits = {host.lower(): limit for host, limit in (host_limits or {}).items()}
+        self._retry_policy = retry_policy or RetryPolicy()
+
+    def run(self, tasks: List[SyncTask], stop_on_failure: bool = False) -> List[SyncResult]:
+        """
+        Synchronize repositories
+        :param tasks: Repositories to synchronize
+        :param stop_on_failure: Stop synchronizing after the first failure
+        :return: Results of all repositories that have been synchronized
+        """
+        # Use a private loop, asyncio.run() would reset the event loop of the current thread
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self._run(tasks, stop_on_failure))
+        finally:
+            loop.close()
+
+    async def _run(self, tasks: List[SyncTask], stop_on_failure: bool) -> List[SyncResult]:
+        loop = asyncio.get_running_loop()
+        global_limit = asyncio.Semaphore(self._parallel)
+        host_limits = {}
+        for task in tasks:
+            host = vcs_git.get_remote_host(task.repo_data.url)
+            if host not in host_limits:
+                host_limits[host] = asyncio.Semaphore(self._host_limits.get(host, self._max_per_host))
+
+        results = []
+
+        with vcs_git.shared_repositories(), concurrent.futures.ThreadPoolExecutor(
+            max_workers=self._parallel
+        ) as executor:
+            pending = [
+                asyncio.ensure_future(
+                    self._sync_repo(
+                        loop,
+                        executor,
+                        task,
+                        global_limit,
+                        host_limits[vcs_git.get_remote_host(task.repo_data.url)],
+                    )
+                )
+                for task in interleave_by_host(tasks, lambda task: task.repo_data.url)
+            ]
+
+            for next_result in asyncio.as_completed(pending):
+                results.append(await next_result)
+                if stop_on_failure and not results[-1].success:
+                    break
+
+            for future in pending:
+                future.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        return results
+
+    async def _sync_repo(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        executor: concurrent.futures.Executor,
+        task: SyncTask,
+        global_limit: asyncio.Semaphore,
+        host_limit: asyncio.Semaphore,
+    ) -> SyncResult:
+        """
+        Synchronize one repository
+        :param loop: Running event loop
+        :param executor: Executor for local work
+        :param task: Repository to synchronize
+        :param global_limit: Semaphore limiting the total number of concurrent fetches
+        :param host_limit: Semaphore limiting the number of concurrent fetches against the host
+        :return: SyncResult
+        """
+        report = ProgressReporter(self._progress)
+        timer = SyncTimer()
+        sync = functools.partial(
+            sync_task, report, task, self._object_cache, timer=timer, retry_policy=self._retry_policy
+        )
+
+        # Locked repositories rarely need the network, let them decide themselves
+        if task.locked_commit:
+            async with host_limit:
+                async with global_limit:
+                    return await loop.run_in_executor(executor, sync)
+
+        report(ui.format_item(str(task.repo_data.path), ("track", task.repo_data.track)))
+
+        attempt = 0
+        while True:
+            try:
+                async with host_limit:
+                    async with global_limit:
+                        fetch_command, error = await self._fetch(loop, executor, task, timer)
+            except (vcs_git.GitError, git.GitError, OSError) as exc:
+                # E.g. the repository could not be created, fail it like the other engines do
+                message = describe_error(exc)
+                report(ui.format_item_error(f"Unable to sync {task.repo_data.path!s}", message))
+                return SyncResult(task.repo_data, False, None, details=message, retries=timer.retries)
+            if error is None:
+                break
+
+            # Wait without holding on to the limits
+            delay = self._retry_policy.get_delay(attempt, error)
+            if delay is None:
+                message = vcs_git.get_error_message(error)
+                report(ui.format_item_error(f"Unable to fetch {task.repo_data.path!s}", message))
+                return SyncResult(task.repo_data, False, None, details=message, retries=timer.retries)
+            timer.retries += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+        return await loop.run_in_executor(executor, functools.partial(sync, prefetched=fetch_command is not None))
+
+    async def _fetch(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        executor: concurrent.futures.Executor,
+        task: SyncTask,
+        timer: SyncTimer,
+    ) -> Tuple[Optional[List[str]], Optional[str]]:
+        """
+        Fetch the tracked branch of one repository
+        :param loop: Running event loop
+        :param executor: Executor for local work
+        :param task: Repository to synchronize
+        :param timer: Timer measuring the fetch
+        :return: (Fetch command or None if nothing needed to be fetched, error output of git or None on success)
+        """
+        start = time.perf_counter()
+        fetch_command = await loop.run_in_executor(executor, prepare_fetch, task, self._object_cache)
+
+        if fetch_command:
+            process = await asyncio.create_subprocess_exec(
+                *fetch_command, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+            )
+            _, stderr = await process.communicate()
+            output = stderr.decode(errors="replace")
+            timer.bytes_received = parse_transfer_size(output)
+            if process.returncode != 0:
+                return fetch_command, output or "git fetch failed"
+
+        timer.fetch_seconds += time.perf_counter() - start
+        return fetch_command, None
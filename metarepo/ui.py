@@ -1,8 +1,8 @@
 """Command line user interface helpers"""
-from typing import Tuple, Union
+from typing import Iterable, List, Tuple, Union
 
 import click
-from colorama import Fore, Style
+from colorama import Cursor, Fore, Style, ansi
 
 CHECK_MARK = "\u2713"
 CROSS_MARK = "\u2717"
@@ -115,3 +115,37 @@ def item_error(message: str, err: str):
     :param err: Error details
     """
     click.echo(format_item_error(message, err))
+
+
+def format_table(headers: List[str], rows: List[List[str]]) -> List[str]:
+    """
+    Format rows as a table with aligned columns
+    :param headers: Column headers
+    :param rows: Rows of plain text cells
+    :return: Formatted lines
+    """
+    widths = [max(len(cell) for cell in column) for column in zip(headers, *rows)]
+
+    def format_row(cells: Iterable[str]) -> str:
+        return "  " + "  ".join(cell.ljust(width) for cell, width in zip(cells, widths)).rstrip()
+
+    return [format_row(headers), format_row("-" * width for width in widths), *map(format_row, rows)]
+
+
+def table(headers: List[str], rows: List[List[str]]):
+    """
+    Print rows as a table with aligned columns
+    :param headers: Column headers
+    :param rows: Rows of plain text cells
+    """
+    for line in format_table(headers, rows):
+        click.echo(line)
+
+
+def rewrite_line(line: str, lines_up: int):
+    """
+    Replace a line that has already been printed, the cursor is left below the last line
+    :param line: New content of the line
+    :param lines_up: Number of lines the line is above the cursor
+    """
+    click.echo(f"{Cursor.UP(lines_up)}\r{ansi.clear_line()}{line}{Cursor.DOWN(lines_up)}\r", nl=False)
@@ -1,9 +1,13 @@
 """GIT Utilities"""
 import configparser
+import contextlib
 import os.path
+import threading
+import time
 from collections import namedtuple
 from pathlib import Path
-from typing import Union
+from typing import List, Optional, Tuple, Union
+from urllib.parse import urlsplit
 
 import git
 
@@ -29,16 +33,232 @@ class InvalidRepository(GitError):
     """Path exists but was not a git repository"""
 
 
-RepoStatus = namedtuple("RepoStatus", ["active_branch", "untracked_files", "head", "is_detached", "is_dirty"])
+class RepoStatus:
+    """
+    Status of a repository
+
+    Only plain values are stored. GitPython objects are created on access and
+    the untracked files are not scanned for until they are requested.
+    """
+
+    __slots__ = ("_repo", "branch", "head_sha", "is_detached", "is_dirty", "ahead", "behind", "_untracked_files")
+
+    def __init__(self, repo: git.Repo, branch=None, head_sha=None, is_dirty=False, ahead=None, behind=None):
+        """
+        Repository status
+        :param repo: Repository the status belongs to
+        :param branch: Name of the checked out branch or None if detached
+        :param head_sha: Hex SHA of HEAD or None if there are no commits
+        :param is_dirty: True if there are uncommitted changes
+        :param ahead: Number of commits ahead of upstream (if any)
+        :param behind: Number of commits behind upstream (if any)
+        """
+        self._repo = repo
+        self.branch = branch
+        self.head_sha = head_sha
+        self.is_detached = branch is None
+        self.is_dirty = is_dirty
+        self.ahead = ahead
+        self.behind = behind
+        self._untracked_files = None
+
+    @property
+    def active_branch(self):
+        """Checked out head or None if detached"""
+        return git.Head(self._repo, f"refs/heads/{self.branch}") if self.branch is not None else None
+
+    @property
+    def head(self):
+        """Commit at HEAD or None if there are no commits"""
+        return git.Commit(self._repo, bytes.fromhex(self.head_sha)) if self.head_sha is not None else None
+
+    @property
+    def untracked_files(self):
+        """Untracked files, scanned on first access"""
+        if self._untracked_files is None:
+            output = self._repo.git.ls_files("--others", "--exclude-standard", "-z")
+            self._untracked_files = [path for path in output.split("\0") if path]
+        return self._untracked_files
+
+    def __repr__(self):
+        return (
+            f"RepoStatus(branch={self.branch!r}, head_sha={self.head_sha!r}, is_dirty={self.is_dirty!r}, "
+            f"ahead={self.ahead!r}, behind={self.behind!r})"
+        )
+
+
 FetchResult = namedtuple("FetchResult", ["fetch_head", "ahead", "behind"])
 
 
+def get_remote_host(url: str) -> str:
+    """
+    Get the host name of a remote URL
+    :param url: Remote URL, e.g. https://host/repo, ssh://user@host/repo or user@host:repo
+    :return: Host name or an empty string for local repositories
+    """
+    if "://" in url:
+        return (urlsplit(url).hostname or "").lower()
+
+    # scp-like syntax, a colon before the first slash
+    host, colon, _ = url.partition(":")
+    if colon and "/" not in host and len(host) > 1:
+        return host.rpartition("@")[2].lower()
+
+    return ""
+
+
+def get_error_message(stderr: str) -> str:
+    """
+    Get the most relevant line of the error output of git
+    :param stderr: Error output, either as printed by git or as formatted by GitCommandError
+    :return: First fatal or error line, or the first line if there is none
+    """
+    stderr = stderr.strip()
+    if stderr.startswith("stderr: '"):
+        stderr = stderr.split("'", 1)[1].rstrip("'")
+
+    lines = [line.strip() for line in stderr.splitlines() if line.strip()]
+    for line in lines:
+        if line.startswith(("fatal:", "error:")):
+            return line
+    return lines[0] if lines else "git failed"
+
+
+# Namespace the prefetch command fetches tracked branches into, next to where 'git maintenance' puts its prefetches
+PREFETCH_NAMESPACE = "refs/prefetch/metarepo/origin/"
+
+# Configuration that keeps status fast in large working trees, see git-config(1)
+TUNING_CONFIG = {
+    "core.untrackedCache": "true",
+    "core.splitIndex": "true",
+    "feature.manyFiles": "true",
+}
+
+# Watch the working tree with the built-in file system monitor, where git has one
+FSMONITOR_CONFIG = {"core.fsmonitor": "true"}
+
+# Whether git has a built-in file system monitor daemon, checked once per process
+_has_fsmonitor_daemon: Optional[bool] = None
+
+
+def has_fsmonitor_daemon(repo: git.Repo) -> bool:
+    """
+    Check if git has a built-in file system monitor daemon on this platform
+    :param repo: Any repository, the check needs one to run in
+    :return: True if the daemon is available
+    """
+    global _has_fsmonitor_daemon
+
+    if _has_fsmonitor_daemon is None:
+        try:
+            repo.git.fsmonitor__daemon("status")
+            _has_fsmonitor_daemon = True
+        except git.GitCommandError as exc:
+            # An available daemon that is not running yet fails as well
+            message = str(exc.stderr)
+            _has_fsmonitor_daemon = "not supported" not in message and "not a git command" not in message
+
+    return _has_fsmonitor_daemon
+
+
+def probe_remote_sha(url: str, ref: str) -> Optional[str]:
+    """
+    Get the SHA of a remote branch without fetching anything
+    :param url: Remote URL
+    :param ref: Branch name
+    :return: Hex SHA or None if the branch does not exist
+    """
+    output = git.Git().ls_remote(url, f"refs/heads/{ref}")
+    for line in output.splitlines():
+        sha, _, name = line.partition("\t")
+        if name == f"refs/heads/{ref}":
+            return sha
+    return None
+
+
+class RepoPool:
+    """
+    Open repositories, shared by the RepoTool instances created while the pool is active
+
+    GitPython looks up objects through persistent 'git cat-file --batch' and
+    '--batch-check' processes that belong to a git.Repo. Sharing the git.Repo
+    of every repository reuses those processes for all RepoTool instances in
+    this process, instead of starting new ones each time a repository is opened.
+    A repository must only be used by one thread at a time.
+    """
+
+    def __init__(self):
+        self._repos = {}
+        self._lock = threading.Lock()
+
+    def open(self, path: Union[Path, str], search_parent: bool = False) -> git.Repo:
+        """
+        Get the open repository at a path, opening it if needed
+        :param path: Path to git repository
+        :param search_parent: Recursively search parent for repository
+        :return: git.Repo
+        """
+        key = (os.path.abspath(path), search_parent)
+        with self._lock:
+            repo = self._repos.get(key)
+        if repo is not None:
+            return repo
+
+        repo = git.Repo(path=path, search_parent_directories=search_parent)
+        with self._lock:
+            shared = self._repos.setdefault(key, repo)
+
+        # Another thread opened it first
+        if shared is not repo:
+            repo.close()
+        return shared
+
+    def close(self):
+        """Close all repositories, stopping their git processes"""
+        with self._lock:
+            repos = list(self._repos.values())
+            self._repos.clear()
+
+        for repo in repos:
+            repo.close()
+
+
+# Pool used by RepoTool, if any
+_active_pool: Optional[RepoPool] = None
+
+
+@contextlib.contextmanager
+def shared_repositories():
+    """Share open repositories between all RepoTool instances created within the context"""
+    global _active_pool
+
+    # Nested contexts keep using the outer pool
+    if _active_pool is not None:
+        yield _active_pool
+        return
+
+    _active_pool = RepoPool()
+    try:
+        yield _active_pool
+    finally:
+        pool, _active_pool = _active_pool, None
+        pool.close()
+
+
+def _open_repo(path: Union[Path, str], search_parent: bool) -> git.Repo:
+    """Open a repository from the active pool if there is one"""
+    if _active_pool is not None:
+        return _active_pool.open(path, search_parent)
+    return git.Repo(path=path, search_parent_directories=search_parent)
+
+
 class RepoTool:
     """Repository management tool"""
 
     def __init__(self, path: Union[Path, str], expected_origin=None, search_parent=False, allow_create=False):
         """
         Repository tool
+        The repository is shared with other instances if created within shared_repositories().
         :param path: Path to git repository
         :param expected_origin: Expected origin
         :param search_parent: Recursively search parent for repository
@@ -51,8 +271,10 @@ class RepoTool:
             repo = git.Repo.init(path)
             repo.create_remote("origin", expected_origin)
 
+        self._shared = _active_pool is not None
+
         try:
-            self._repo = git.Repo(path=path, search_parent_directories=search_parent)
+            self._repo = _open_repo(path, search_parent)
         except git.InvalidGitRepositoryError:
             raise InvalidRepository()
         except git.NoSuchPathError:
@@ -74,62 +296,368 @@ class RepoTool:
 
         self._path = Path(self._repo.working_tree_dir)
 
-    def get_status(self) -> RepoStatus:
-        """Retrieve the status of the repository"""
+    def close(self):
+        """Stop the git processes of the repository, unless it is shared"""
+        if not self._shared:
+            self._repo.close()
 
-        info = {
-            "is_detached": self._repo.head.is_detached,
-            "is_dirty": self._repo.is_dirty(),
-            "untracked_files": self._repo.untracked_files,
-            "head": self._repo.head.commit if self._repo.heads else None,
-        }
+    def __enter__(self):
+        return self
 
-        if info["is_detached"]:
-            info["active_branch"] = None
-        else:
-            info["active_branch"] = self._repo.active_branch
+    def __exit__(self, *exc_info):
+        self.close()
 
-        return RepoStatus(**info)
+    def get_status(self, optional_locks: bool = True) -> RepoStatus:
+        """
+        Retrieve the status of the repository
+        :param optional_locks: Allow git to refresh the index, disable to leave the repository untouched
+        :return: RepoStatus
+        """
+        env = None if optional_locks else {"GIT_OPTIONAL_LOCKS": "0"}
+        # Everything except the untracked files is retrieved using a single git process
+        output = self._repo.git.status("--porcelain=v2", "--branch", "--untracked-files=no", "-z", env=env)
+        return self._parse_porcelain_status(output)
+
+    def _parse_porcelain_status(self, output: str) -> RepoStatus:
+        """
+        Parse the output of 'git status --porcelain=v2 --branch -z'
+        :param output: Output from git
+        :return: RepoStatus
+        """
+        info = {"is_dirty": False}
+        headers = {}
+
+        records = iter(output.split("\0"))
+        for record in records:
+            if record.startswith("# "):
+                _, key, value = record.split(" ", 2)
+                headers[key] = value
+            elif record.startswith(("1 ", "u ")):
+                info["is_dirty"] = True
+            elif record.startswith("2 "):
+                info["is_dirty"] = True
+                # Renamed and copied entries are followed by the original path
+                next(records, None)
+
+        if headers.get("branch.oid", "(initial)") != "(initial)":
+            info["head_sha"] = headers["branch.oid"]
+
+        if "branch.ab" in headers:
+            ahead, behind = headers["branch.ab"].split()
+            info["ahead"] = int(ahead)
+            info["behind"] = -int(behind)
+
+        if headers.get("branch.head") != "(detached)":
+            info["branch"] = headers.get("branch.head")
+
+        return RepoStatus(self._repo, **info)
 
     def get_root_path(self) -> Path:
         """Get the root path of the current git repository"""
         return self._path
 
-    def fetch(self, ref, progress_cb=None) -> FetchResult:
+    def fetch(self, ref, progress_cb=None, depth=None, filter_spec=None) -> FetchResult:
         """
         Fetch ref
         :param ref: Reference to fetch
         :param progress_cb: Callback to call with progress
-        :return: Dictionary with the fetch result
+        :param depth: Limit the history to this many commits if ref has not been checked out before.
+                      Later fetches only retrieve the new commits and keep the repository shallow.
+        :param filter_spec: Partial clone filter, e.g. 'blob:none' or 'tree:0'
+        :return: FetchResult with the number of commits ahead and behind the fetched ref
         """
-        fetch_result = self._repo.remote("origin").fetch(ref, progress=progress_cb)
+        options = self._get_fetch_options(ref, depth, filter_spec)
+        fetch_result = self._repo.remote("origin").fetch(ref, progress=progress_cb, **options)
+        return self._compare_to(ref, fetch_result[0].commit)
 
-        result = {"fetch_head": fetch_result[0].commit, "ahead": [], "behind": []}
+    def get_fetch_command(self, ref, depth=None, filter_spec=None, progress=False) -> List[str]:
+        """
+        Get the command line that fetches ref, for callers that run git themselves
+        :param ref: Reference to fetch
+        :param depth: Same as for fetch()
+        :param filter_spec: Same as for fetch()
+        :param progress: Report progress on stderr even if it is not a terminal
+        :return: Command line arguments
+        """
+        options = self._get_fetch_options(ref, depth, filter_spec)
+        if progress:
+            options["progress"] = True
+        options = self._repo.git.transform_kwargs(**options)
+        return [self._repo.git.GIT_PYTHON_GIT_EXECUTABLE, "-C", str(self._path), "fetch", *options, "origin", ref]
+
+    def _get_fetch_options(self, ref, depth=None, filter_spec=None) -> dict:
+        """
+        Get the options used when fetching ref
+        :param ref: Reference to fetch
+        :param depth: Same as for fetch()
+        :param filter_spec: Same as for fetch()
+        :return: Dictionary with options
+        """
+        options = {}
+        if depth and ref not in self._repo.heads:
+            options["depth"] = depth
+        if filter_spec:
+            options["filter"] = filter_spec
+        return options
+
+    def compare_to_remote(self, ref) -> FetchResult:
+        """
+        Compare a local branch to the remote branch as of the last fetch, without fetching
+        :param ref: Branch name
+        :return: FetchResult with the number of commits ahead and behind the remote branch
+        """
+        sha = self.get_remote_sha(ref)
+        if sha is None:
+            raise NotFound(f"origin/{ref}")
+        return self._compare_to(ref, git.Commit(self._repo, bytes.fromhex(sha)))
+
+    def _compare_to(self, ref, fetch_head: git.Commit) -> FetchResult:
+        """
+        Count how many commits a local branch is ahead or behind a fetched commit
+        :param ref: Branch name
+        :param fetch_head: Fetched commit
+        :return: FetchResult
+        """
+        result = {"fetch_head": fetch_head, "ahead": 0, "behind": 0}
 
         # If we have anything checked out locally
-        # Retrieve which commits are ahead or behind the remote
+        # Count how many commits are ahead or behind the remote
         if ref in self._repo.heads:
             local_ref = str(self._repo.heads[ref])
-            remote_ref = str(result["fetch_head"])
-            result["ahead"] = list(self._repo.iter_commits(f"{remote_ref}..{local_ref}"))
-            result["behind"] = list(self._repo.iter_commits(f"{local_ref}..{remote_ref}"))
+            remote_ref = str(fetch_head)
+            result["ahead"], result["behind"] = self.count_divergence(local_ref, remote_ref)
 
         return FetchResult(**result)
 
-    def checkout(self, ref, name, track=None):
+    def get_remote_sha(self, ref) -> Optional[str]:
+        """
+        Get the SHA of a remote branch as of the last fetch
+        :param ref: Branch name
+        :return: Hex SHA or None if the branch has not been fetched
+        """
+        try:
+            return git.SymbolicReference.dereference_recursive(self._repo, f"refs/remotes/origin/{ref}")
+        except ValueError:
+            return None
+
+    def fetch_commit(self, sha, depth=None, filter_spec=None):
+        """
+        Fetch a specific commit
+        :param sha: Commit SHA to fetch
+        :param depth: Limit the history to this many commits
+        :param filter_spec: Partial clone filter
+        """
+        options = {}
+        if depth:
+            options["depth"] = depth
+        if filter_spec:
+            options["filter"] = filter_spec
+
+        self._repo.git.fetch("origin", sha, **options)
+
+    def prefetch(self, ref, filter_spec=None) -> str:
+        """
+        Fetch a branch into PREFETCH_NAMESPACE, leaving the remote-tracking branches and the working tree alone
+        :param ref: Branch name
+        :param filter_spec: Partial clone filter
+        :return: Hex SHA of the fetched commit
+        """
+        options = {"no_tags": True, "no_write_fetch_head": True, "refmap": ""}
+        if filter_spec:
+            options["filter"] = filter_spec
+
+        # An empty refmap keeps the configured refspec from updating origin/<ref> as well
+        self._repo.git.fetch("origin", f"+refs/heads/{ref}:{PREFETCH_NAMESPACE}{ref}", **options)
+        return self.get_prefetched_sha(ref)
+
+    def get_prefetched_sha(self, ref) -> Optional[str]:
+        """
+        Get the SHA of a branch as of the last prefetch
+        :param ref: Branch name
+        :return: Hex SHA or None if the branch has not been prefetched
+        """
+        try:
+            return git.SymbolicReference.dereference_recursive(self._repo, f"{PREFETCH_NAMESPACE}{ref}")
+        except ValueError:
+            return None
+
+    def use_prefetched(self, ref, sha) -> bool:
+        """
+        Fast forward origin/<ref> to a prefetched commit without using the network
+        :param ref: Branch name
+        :param sha: Expected SHA of the prefetched branch
+        :return: True if origin/<ref> is now at the prefetched commit, False if the prefetch cannot be used
+        """
+        if self.get_prefetched_sha(ref) != sha:
+            return False
+
+        current = self.get_remote_sha(ref)
+        if current == sha:
+            return True
+
+        # origin/<ref> may have been fetched after the prefetch, never move it backwards
+        if current is not None and self.count_divergence(current, sha)[0]:
+            return False
+
+        self._repo.git.update_ref("-m", "metarepo: use prefetch", f"refs/remotes/origin/{ref}", sha)
+        return True
+
+    def has_head(self, name) -> bool:
+        """
+        Check if a local branch exists
+        :param name: Branch name
+        :return: True if the branch exists
+        """
+        return name in self._repo.heads
+
+    def has_commit(self, sha) -> bool:
+        """
+        Check if a commit exists in the local object database
+        :param sha: Commit SHA
+        :return: True if the commit exists
+        """
+        try:
+            self._repo.git.cat_file("-e", f"{sha}^{{commit}}")
+            return True
+        except git.GitCommandError:
+            return False
+
+    def count_divergence(self, local_ref, remote_ref) -> Tuple[int, int]:
+        """
+        Count the commits that are only reachable from one of two refs
+        :param local_ref: Local ref
+        :param remote_ref: Remote ref
+        :return: (Number of commits ahead, number of commits behind)
+        """
+        output = self._repo.git.rev_list("--left-right", "--count", f"{local_ref}...{remote_ref}")
+        ahead, behind = output.split()
+        return int(ahead), int(behind)
+
+    def list_commits(self, rev_range, max_count=100) -> List[git.Commit]:
+        """
+        List commits in a range, for callers that need more than the count
+        :param rev_range: Range of commits, e.g. 'master..origin/master'
+        :param max_count: Maximum number of commits to list
+        :return: List of commits, newest first
+        """
+        return list(self._repo.iter_commits(rev_range, max_count=max_count))
+
+    def get_tuning_changes(self, fsmonitor: bool = True) -> dict:
+        """
+        Get the configuration that is missing for fast status
+        :param fsmonitor: Include the file system monitor, if git has one on this platform
+        :return: Dictionary of configuration names and values that differ
+        """
+        wanted = dict(TUNING_CONFIG)
+        if fsmonitor and has_fsmonitor_daemon(self._repo):
+            wanted.update(FSMONITOR_CONFIG)
+
+        # Reading the configuration in process keeps this cheap enough to run on every sync
+        reader = self._repo.config_reader("repository")
+        changes = {}
+        for name, value in wanted.items():
+            section, option = name.rsplit(".", 1)
+            current = reader.get_value(section, option, "")
+            if str(current).lower() != value:
+                changes[name] = value
+        return changes
+
+    def tune(self, fsmonitor: bool = True) -> List[str]:
+        """
+        Configure the repository for fast status
+        The index is rewritten with the new settings by the next status.
+        :param fsmonitor: Use the file system monitor, if git has one on this platform
+        :return: Names of the settings that were changed
+        """
+        changes = self.get_tuning_changes(fsmonitor)
+        for name, value in changes.items():
+            self._repo.git.config("--local", name, value)
+        return list(changes)
+
+    def measure_status(self, repeat: int = 3) -> float:
+        """
+        Measure how long 'git status' takes, including untracked files like a user would see
+        :param repeat: Number of measurements
+        :return: Best time in seconds
+        """
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            self._repo.git.status("--porcelain=v2")
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    def get_sparse_patterns(self) -> Optional[List[str]]:
+        """
+        Get the sparse checkout patterns
+        :return: Cone mode directories or None if sparse checkout is disabled
+        """
+        # Avoid running git for the common case of a repository that has never been sparse
+        if not (Path(self._repo.git_dir) / "info" / "sparse-checkout").exists():
+            return None
+
+        try:
+            return self._repo.git.sparse_checkout("list").splitlines()
+        except git.GitCommandError:
+            # Not a sparse worktree
+            return None
+
+    def set_sparse_patterns(self, patterns: Optional[List[str]]) -> bool:
+        """
+        Change the sparse checkout patterns, the working tree is updated if there is a commit checked out
+        :param patterns: Cone mode directories to check out or None to check out everything
+        :return: True if the patterns were changed
+        """
+        current = self.get_sparse_patterns()
+
+        if patterns is None:
+            if current is None:
+                return False
+            self._repo.git.sparse_checkout("disable")
+            return True
+
+        directories = sorted({pattern.strip("/") for pattern in patterns})
+        if current is not None and sorted(current) == directories:
+            return False
+
+        self._repo.git.sparse_checkout("set", "--cone", *directories)
+        return True
+
+    def checkout(self, ref, name, track=None) -> bool:
         """
         Checkout a ref into the local workspace
+
+        Only the paths that differ between the current and the new commit are
+        written, files that do not change keep their modification time. Local
+        changes that would be overwritten make the checkout fail.
+
         :param ref: Ref to checkout
         :param name: Name of head to create if it doesn't exist
-        :param track: What remote branch to track (if any)
+        :param track: What remote branch to track (if any), e.g. 'origin/master'
+        :return: True if anything was changed, False if the head was already checked out at ref
         """
-        if name not in self._repo.heads:
-            self._repo.create_head(name, ref)
-        else:
-            self._repo.heads[name].set_commit(ref)
+        target = self._repo.commit(ref).hexsha
+        head = self._repo.head
+
+        try:
+            current = head.commit.hexsha
+        except ValueError:
+            # No commits yet
+            current = None
 
-        self._repo.heads[name].checkout()
-        self._repo.head.reset(index=True, working_tree=True)
+        changed = head.is_detached or head.ref.name != name or current != target
+
+        if current is None:
+            self._repo.git.read_tree("--reset", "-u", target)
+        elif current != target:
+            # Two tree merge, a fast forward of the index and working tree from current to target
+            self._repo.git.read_tree("-m", "-u", current, target)
+
+        if changed:
+            self._repo.git.update_ref("-m", f"metarepo: checkout {ref}", f"refs/heads/{name}", target)
+            self._repo.git.symbolic_ref("HEAD", f"refs/heads/{name}")
 
         if track:
-            self._repo.heads[name].set_tracking_branch(track)
+            self._repo.git.branch(f"--set-upstream-to={track}", name)
+
+        return changed
@@ -0,0 +1,338 @@
+"""Watching repositories for changes"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+from collections import namedtuple
+from pathlib import Path
+from typing import Dict, Hashable, List, Optional, Set
+
+# Seconds between checks of the polling watcher
+POLL_INTERVAL = 2.0
+
+# Changes that come in this close together are reported together
+SETTLE_SECONDS = 0.1
+
+# inotify(7) event flags
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+)
+
+EVENT_HEADER = struct.Struct("iIII")
+
+# Files in the git directory that the status depends on, git touches others such as the shared index just by reading
+GIT_STATE_FILES = frozenset(["HEAD", "index", "packed-refs"])
+
+# Watched directory, the keys of the repositories it belongs to, whether new subdirectories are watched
+# and the names that matter (None for all)
+Watch = namedtuple("Watch", ["directory", "keys", "recursive", "names"])
+
+
+def list_directories(top: Path) -> List[Path]:
+    """
+    List a working tree and all directories below it that belong to the same repository
+    The git directory and nested repositories are left out.
+    :param top: Working tree
+    :return: Directories
+    """
+    directories = []
+    for path, dirnames, _ in os.walk(top):
+        directories.append(Path(path))
+        dirnames[:] = [
+            name for name in dirnames if name != ".git" and not os.path.exists(os.path.join(path, name, ".git"))
+        ]
+    return directories
+
+
+def get_signature(path: Path) -> int:
+    """
+    Get a value that changes when anything that affects the status of a repository changes
+    :param path: Path to the working tree
+    :return: Signature
+    """
+    git_dir = path / ".git"
+    stats = []
+    for directory in [*list_directories(path), *list_directories(git_dir / "refs")]:
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        # Symbolic links themselves, a dangling link must not hide the entries after it
+                        stat = entry.stat(follow_symlinks=False)
+                        stats.append((entry.path, stat.st_mtime_ns, stat.st_size))
+                    except OSError:
+                        # Removed while reading
+                        stats.append((entry.path, None, None))
+        except OSError:
+            # Removed while reading
+            continue
+
+    for name in sorted(GIT_STATE_FILES):
+        try:
+            stat = (git_dir / name).stat()
+            stats.append((name, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            stats.append((name, None, None))
+
+    return hash(tuple(stats))
+
+
+class PollingWatcher:
+    """Watcher that compares the state of every repository at a fixed interval"""
+
+    def __init__(self, interval: float = POLL_INTERVAL):
+        """
+        Polling watcher
+        :param interval: Seconds between checks
+        """
+        self._interval = interval
+        self._signatures = {}
+        self._paths = {}
+
+    def add(self, key: Hashable, path: Path):
+        """
+        Watch a repository
+        :param key: Key reported when the repository changes
+        :param path: Path to the working tree
+        """
+        self._paths[key] = Path(path)
+        self._signatures[key] = get_signature(Path(path))
+
+    def is_empty(self) -> bool:
+        """Check if no repository is watched"""
+        return not self._paths
+
+    def check(self) -> Set[Hashable]:
+        """
+        Check all repositories once
+        :return: Keys of the repositories that changed since the last check
+        """
+        changed = set()
+        for key, path in self._paths.items():
+            signature = get_signature(path)
+            if signature != self._signatures[key]:
+                self._signatures[key] = signature
+                changed.add(key)
+        return changed
+
+    def wait(self, timeout: Optional[float] = None) -> Set[Hashable]:
+        """
+        Wait for changes
+        :param timeout: Maximum number of seconds to wait, None to wait until something changes
+        :return: Keys of the repositories that changed, empty if the timeout expired
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = self.check()
+            if changed:
+                return changed
+
+            remaining = self._interval if deadline is None else min(self._interval, deadline - time.monotonic())
+            if remaining <= 0:
+                return set()
+            time.sleep(remaining)
+
+    def close(self):
+        """Stop watching"""
+        self._paths.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class InotifyWatcher:
+    """
+    Watcher that is notified of changes by the Linux kernel
+
+    Every directory of the working tree is watched, as well as the git directory
+    and the refs below it, so the watcher sleeps until something changes.
+    Repositories that run into the limit of inotify watches are polled instead.
+    """
+
+    def __init__(self, libc: ctypes.CDLL):
+        """
+        Inotify watcher, use create_watcher() to get a watcher for the current platform
+        :param libc: C library
+        """
+        self._libc = libc
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self._watches: Dict[int, Watch] = {}
+        self._paths: Dict[Hashable, Path] = {}
+        self._fallback = PollingWatcher()
+
+    def add(self, key: Hashable, path: Path):
+        """
+        Watch a repository
+        :param key: Key reported when the repository changes
+        :param path: Path to the working tree
+        """
+        path = Path(path)
+        self._paths[key] = path
+        try:
+            for directory in [*list_directories(path), *list_directories(path / ".git" / "refs")]:
+                self._add_watch(directory, key)
+            self._add_watch(path / ".git", key, recursive=False, names=GIT_STATE_FILES)
+        except OSError as exc:
+            if exc.errno != errno.ENOSPC:
+                raise
+            self._poll_instead(key)
+
+    def _poll_instead(self, key: Hashable):
+        """Stop watching a repository that ran into the limit of inotify watches and poll it instead"""
+        self._remove_key(key)
+        self._fallback.add(key, self._paths[key])
+
+    def _add_watch(self, directory: Path, key: Hashable, recursive: bool = True, names: Optional[frozenset] = None):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            # Removed before it could be watched
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise OSError(error, os.strerror(error), str(directory))
+
+        # The same directory is watched once, even if it belongs to several repositories
+        self._watches.setdefault(wd, Watch(directory, set(), recursive, names)).keys.add(key)
+
+    def _remove_key(self, key: Hashable):
+        for wd, watch in list(self._watches.items()):
+            watch.keys.discard(key)
+            if not watch.keys:
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._watches[wd]
+
+    def _read_events(self) -> Set[Hashable]:
+        """Read all pending events and get the keys of the repositories they belong to"""
+        changed = set()
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            (name,) = struct.unpack_from(f"{length}s", data, offset + EVENT_HEADER.size)
+            offset += EVENT_HEADER.size + length
+            changed |= self._handle_event(wd, mask, os.fsdecode(name.rstrip(b"\0")))
+        return changed
+
+    def _handle_event(self, wd: int, mask: int, name: str) -> Set[Hashable]:
+        if mask & IN_Q_OVERFLOW:
+            # Events were lost, anything may have changed
+            return {key for watch in self._watches.values() for key in watch.keys}
+
+        if wd not in self._watches:
+            return set()
+
+        watch = self._watches[wd]
+        if mask & IN_IGNORED:
+            del self._watches[wd]
+            return set()
+
+        if watch.names is not None and name not in watch.names:
+            return set()
+
+        keys = set(watch.keys)
+        if watch.recursive and mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and name != ".git":
+            self._watch_new_directory(watch.directory / name, keys)
+        return keys
+
+    def _watch_new_directory(self, top: Path, keys: Set[Hashable]):
+        """
+        Watch a directory created in a working tree, and the directories below it
+        :param top: New directory
+        :param keys: Keys of the repositories the directory belongs to
+        """
+        directories = list_directories(top)
+        for key in keys:
+            try:
+                for directory in directories:
+                    self._add_watch(directory, key)
+            except OSError as exc:
+                if exc.errno != errno.ENOSPC:
+                    raise
+                self._poll_instead(key)
+
+    def wait(self, timeout: Optional[float] = None) -> Set[Hashable]:
+        """
+        Wait for changes
+        :param timeout: Maximum number of seconds to wait, None to wait until something changes
+        :return: Keys of the repositories that changed, empty if the timeout expired
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait_seconds = None if deadline is None else max(0.0, deadline - time.monotonic())
+            polling = not self._fallback.is_empty()
+            if polling:
+                wait_seconds = POLL_INTERVAL if wait_seconds is None else min(POLL_INTERVAL, wait_seconds)
+
+            readable, _, _ = select.select([self._fd], [], [], wait_seconds)
+            changed = self._fallback.check() if polling else set()
+            if readable:
+                changed |= self._read_events()
+                # Wait for the rest of the changes, e.g. a checkout, to arrive
+                while select.select([self._fd], [], [], SETTLE_SECONDS)[0]:
+                    changed |= self._read_events()
+
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def close(self):
+        """Stop watching"""
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+        self._watches.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def create_watcher():
+    """
+    Create the best watcher for this platform
+    :return: InotifyWatcher on Linux, PollingWatcher elsewhere
+    """
+    if sys.platform.startswith("linux"):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        try:
+            return InotifyWatcher(libc)
+        except (OSError, AttributeError):
+            # Without inotify, e.g. in some sandboxes
+            pass
+    return PollingWatcher()
@@ -0,0 +1,68 @@
+"""Workspace discovery"""
+import functools
+import os
+from pathlib import Path
+from typing import Optional
+
+from .manifest import MANIFEST_NAME
+
+
+def find_root_path(start: Optional[Path] = None) -> Path:
+    """
+    Find the root of the workspace without opening any repository
+
+    The root is the top level directory of the git repository containing start.
+    If start is not inside a repository the closest directory containing a
+    manifest is used, and if there is none, start itself.
+
+    :param start: Directory to start searching from (default: current directory)
+    :return: Path to the workspace root
+    """
+    return _find_root_path(
+        Path.cwd() if start is None else Path(start), os.environ.get("GIT_DIR"), os.environ.get("GIT_WORK_TREE")
+    )
+
+
+def _is_git_dir_entry(path: Path) -> bool:
+    """
+    Check if path is a '.git' directory or a '.git' file pointing to one (worktrees and submodules)
+    :param path: Path to '.git'
+    :return: True if path belongs to a repository
+    """
+    if path.is_dir():
+        return (path / "HEAD").is_file()
+
+    if path.is_file():
+        with open(path, "r") as git_file:
+            return git_file.readline().startswith("gitdir:")
+
+    return False
+
+
+@functools.lru_cache(maxsize=None)
+def _find_root_path(start: Path, git_dir: Optional[str], work_tree: Optional[str]) -> Path:
+    """
+    Find the root of the workspace, the result is cached for the lifetime of the process
+    :param start: Directory to start searching from
+    :param git_dir: Value of GIT_DIR
+    :param work_tree: Value of GIT_WORK_TREE
+    :return: Path to the workspace root
+    """
+    if work_tree:
+        return start / work_tree
+
+    if git_dir:
+        git_dir_path = start / git_dir
+        return git_dir_path.parent if git_dir_path.name == ".git" else start
+
+    directories = [start, *start.parents]
+
+    for directory in directories:
+        if _is_git_dir_entry(directory / ".git"):
+            return directory
+
+    for directory in directories:
+        if (directory / MANIFEST_NAME).is_file():
+            return directory
+
+    return start
@@ -1,9 +1,14 @@
 import os
+import sys
+from abc import ABC
 
 import git
 import metarepo.cli
 import pytest
 from click.testing import CliRunner
+from prompt_toolkit.application import create_app_session
+from prompt_toolkit.input import DummyInput
+from prompt_toolkit.output import DummyOutput
 from tests import helpers
 
 
@@ -60,3 +65,28 @@ def fixture_synced_repo_and_workspace(test_repo_and_workspace):
 
     data["dest_repo"] = git.Repo(data["workspace"] / "test")
     return data
+
+
+@pytest.fixture(autouse=True)
+def fixture_cache_dir(tmp_path, monkeypatch):
+    """Keep caches created by the tests out of the home directory"""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.delenv("METAREPO_OBJECT_CACHE", raising=False)
+
+
+@pytest.fixture(name="stdout_redirection")
+def fixture_stdout_redirection():
+    """
+    Prompt toolkit will try to create a VT100/Win32 output which expects stdout/stdout to have a file descriptor.
+    Since Click's CliRunner wraps stdout in io.TextIOWrapper that does not have one we will get an error.
+    Therefore we create a AppSession with an custom output module that simply writes to the current sys.stdout
+    """
+
+    class StdoutOutput(DummyOutput, ABC):
+        def write(self, data: str) -> None:
+            sys.stdout.write(data)
+
+    # Create app session
+    with create_app_session(input=DummyInput(), output=StdoutOutput()):
+        # Yield control to the test case
+        yield
@@ -47,3 +47,28 @@ def write_and_commit(repo, filename):
 
     repo.index.add([filename])
     return repo.index.commit(f"Wrote to {filename}")
+
+
+FAKE_SSH = """#!/bin/sh
+echo "$@" >> "{log}"
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -o|-p|-O) shift 2 ;;
+        -*) shift ;;
+        *) break ;;
+    esac
+done
+shift
+[ $# -gt 0 ] && exec sh -c "$*"
+exit 0
+"""
+
+
+def create_fake_ssh(path, log):
+    """
+    Create an ssh replacement that logs its arguments and runs the remote command locally
+    :param path: Path of the script to create
+    :param log: Path of the file that the arguments are appended to
+    """
+    path.write_text(FAKE_SSH.format(log=log))
+    path.chmod(0o755)
@@ -0,0 +1,32 @@
+"""Test 'history' command"""
+import metarepo.cli
+import pytest
+from click.testing import CliRunner
+from metarepo import history
+from tests import helpers
+
+pytestmark = pytest.mark.usefixtures("stdout_redirection")
+
+
+def test_history_no_history(test_repo_and_workspace):
+    """Repositories that have never been synchronized have no history"""
+    result = CliRunner().invoke(metarepo.cli.cli, ["history"])
+    assert result.exit_code == 0
+    assert "no history" in result.output
+
+
+def test_history_after_sync(synced_repo_and_workspace):
+    """Sync records the timing of every repository"""
+    data = synced_repo_and_workspace
+
+    timings = history.History.load(data["workspace"]).get_timings("test")
+    assert len(timings) == 1
+    assert timings[0].fetch_seconds > 0
+
+    helpers.write_and_commit(data["source_repo"], "newfile.txt")
+    assert CliRunner().invoke(metarepo.cli.cli, ["sync", "--engine", "async"]).exit_code == 0
+
+    result = CliRunner().invoke(metarepo.cli.cli, ["history"])
+    assert result.exit_code == 0
+    assert "expected" in result.output
+    assert "runs:" in result.output
@@ -34,3 +34,31 @@ def test_list_basic(tmpdir):
     assert result.exit_code == 0
     assert os.path.normpath("the/path") in result.output
     assert "http://localhost/repo" in result.output
+
+
+def test_list_filtered(tmpdir):
+    """Only repositories matching the group and path filters are listed"""
+    helpers.create_manifest(
+        tmpdir,
+        {
+            "repos": [
+                {"url": "http://localhost/a", "path": "libs/a", "groups": ["core"]},
+                {"url": "http://localhost/b", "path": "tools/b"},
+            ]
+        },
+    )
+    tmpdir.chdir()
+    runner = CliRunner()
+
+    result = runner.invoke(metarepo.cli.cli, ["list", "--group", "core"])
+    assert result.exit_code == 0
+    assert "http://localhost/a" in result.output
+    assert "http://localhost/b" not in result.output
+
+    result = runner.invoke(metarepo.cli.cli, ["list", "--path", "tools/*"])
+    assert "http://localhost/a" not in result.output
+    assert "http://localhost/b" in result.output
+
+    result = runner.invoke(metarepo.cli.cli, ["list", "--group", "missing"])
+    assert result.exit_code == 1
+    assert "Unknown group: missing" in result.output
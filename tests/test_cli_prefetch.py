@@ -0,0 +1,76 @@
+"""Test 'prefetch' command"""
+import shutil
+
+import git
+import metarepo.cli
+import pytest
+from click.testing import CliRunner
+from metarepo import manifest, prefetch, sync_engine, vcs_git
+from tests import helpers
+
+pytestmark = pytest.mark.usefixtures("stdout_redirection")
+
+
+def test_prefetch(synced_repo_and_workspace):
+    """New commits are fetched into the prefetch namespace, the working tree and origin/* are left alone"""
+    data = synced_repo_and_workspace
+    dest_repo = data["dest_repo"]
+    head = dest_repo.head.commit
+    new_commit = helpers.write_and_commit(data["source_repo"], "new_file")
+
+    result = CliRunner().invoke(metarepo.cli.cli, ["prefetch"])
+    assert result.exit_code == 0
+
+    assert dest_repo.commit(f"{vcs_git.PREFETCH_NAMESPACE}master") == new_commit
+    assert dest_repo.commit("origin/master") == head
+    assert dest_repo.head.commit == head
+    assert prefetch.PrefetchLog.load(data["workspace"]).get_sha(
+        manifest.Repository(url=str(data["tmpdir"] / "source" / ".git"), path="test")
+    ) == str(new_commit)
+
+
+def test_sync_uses_prefetch(synced_repo_and_workspace):
+    """Sync checks out prefetched commits without the remote, unless they are too old"""
+    data = synced_repo_and_workspace
+    new_commit = helpers.write_and_commit(data["source_repo"], "new_file")
+    assert CliRunner().invoke(metarepo.cli.cli, ["prefetch"]).exit_code == 0
+
+    # The remote is gone, only the prefetched commit can be used
+    source_path = data["tmpdir"] / "source"
+    shutil.move(str(source_path), str(data["tmpdir"] / "moved"))
+
+    result = CliRunner().invoke(metarepo.cli.cli, ["sync", "--max-prefetch-age", "0"])
+    assert result.exit_code == 1
+
+    result = CliRunner().invoke(metarepo.cli.cli, ["sync"])
+    assert result.exit_code == 0
+    assert git.Repo(data["workspace"] / "test").head.commit == new_commit
+
+
+def test_prefetch_not_synchronized(test_repo_and_workspace):
+    """Repositories have to be synchronized before they can be prefetched"""
+    result = CliRunner().invoke(metarepo.cli.cli, ["prefetch"])
+    assert result.exit_code == 1
+    assert "NOT FOUND" in result.output
+
+
+def test_prepare_fetch_outdated_prefetch(synced_repo_and_workspace):
+    """The async engine fetches if origin/<track> is newer than the prefetched commit"""
+    data = synced_repo_and_workspace
+    prefetched_commit = helpers.write_and_commit(data["source_repo"], "new_file")
+    assert CliRunner().invoke(metarepo.cli.cli, ["prefetch"]).exit_code == 0
+
+    # origin/master is fetched past the prefetched commit
+    helpers.write_and_commit(data["source_repo"], "newer_file")
+    data["dest_repo"].remote("origin").fetch("master")
+
+    repo_data = manifest.Repository(url=str(data["tmpdir"] / "source" / ".git"), path="test")
+    task = sync_engine.SyncTask(data["workspace"] / "test", repo_data, prefetch_sha=str(prefetched_commit))
+    assert sync_engine.prepare_fetch(task) is not None
+
+    # Usable prefetches are applied without fetching
+    newest = helpers.write_and_commit(data["source_repo"], "newest_file")
+    assert CliRunner().invoke(metarepo.cli.cli, ["prefetch"]).exit_code == 0
+    task = sync_engine.SyncTask(data["workspace"] / "test", repo_data, prefetch_sha=str(newest))
+    assert sync_engine.prepare_fetch(task) is None
+    assert data["dest_repo"].commit("origin/master") == newest
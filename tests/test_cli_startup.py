@@ -0,0 +1,53 @@
+"""Test that the command line interface starts without importing heavy dependencies"""
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from tests import helpers
+
+HEAVY_MODULES = ["git", "pydantic", "prompt_toolkit", "colorama", "yaml"]
+
+CHECK_IMPORTS = """
+import sys
+from click.testing import CliRunner
+import metarepo.cli
+result = CliRunner().invoke(metarepo.cli.cli, sys.argv[1:])
+assert result.exit_code == 0, result.output
+print(" ".join(sorted(set(module.split(".")[0] for module in sys.modules))))
+"""
+
+
+def get_imported_modules(*args, cwd=None):
+    """
+    Run the command line interface in a new interpreter
+    :param args: Command line arguments
+    :param cwd: Working directory
+    :return: Set of imported top level modules
+    """
+    project_root = str(Path(__file__).resolve().parent.parent)
+    output = subprocess.check_output(
+        [sys.executable, "-c", CHECK_IMPORTS, *args],
+        cwd=cwd or project_root,
+        env=dict(os.environ, PYTHONPATH=project_root),
+    )
+    return set(output.decode().split())
+
+
+@pytest.mark.parametrize("args", [["--help"], ["list", "--help"], ["status", "--help"], ["sync", "--help"]])
+def test_help_does_not_import_heavy_modules(args):
+    """Showing help only needs click"""
+    imported_modules = get_imported_modules(*args)
+    assert "metarepo" in imported_modules
+    assert imported_modules.isdisjoint(HEAVY_MODULES)
+
+
+def test_list_does_not_import_git(tmpdir):
+    """Listing repositories does not need GitPython or prompt_toolkit"""
+    helpers.create_commits(tmpdir)
+    helpers.create_manifest(tmpdir, {"repos": [{"url": "http://localhost/repo", "path": "the/path"}]})
+
+    imported_modules = get_imported_modules("list", cwd=str(tmpdir.mkdir("subdir")))
+    assert "git" not in imported_modules
+    assert "prompt_toolkit" not in imported_modules
@@ -3,6 +3,7 @@ import re
 
 import metarepo.cli
 from click.testing import CliRunner
+from metarepo import watcher
 from tests import helpers
 
 TEST_MANIFEST_ORIGIN = "http://localhost/nop"
@@ -115,3 +116,55 @@ def test_status_no_recurse_on_file(tmpdir):
     result = runner.invoke(metarepo.cli.cli, ["status"])
     assert result.exit_code == 0
     assert "INVALID" in result.output
+
+
+def test_status_parallel_keeps_manifest_order(tmpdir):
+    """Status of repositories checked in parallel is printed in manifest order"""
+    names = [f"repo_{i}" for i in range(8)]
+    for name in names:
+        helpers.create_commits(tmpdir.join(name), TEST_MANIFEST_ORIGIN)
+    helpers.create_manifest(tmpdir, {"repos": [{"url": TEST_MANIFEST_ORIGIN, "path": name} for name in names]})
+    tmpdir.chdir()
+
+    runner = CliRunner()
+    result = runner.invoke(metarepo.cli.cli, ["status", "-j", "4"])
+    assert result.exit_code == 0
+
+    positions = [result.output.index(name) for name in names]
+    assert positions == sorted(positions)
+
+
+def test_status_parallel_auto(tmpdir):
+    """The parallel level can be auto and must otherwise be a positive number"""
+    helpers.create_commits(tmpdir.join("the_repo"), TEST_MANIFEST_ORIGIN)
+    helpers.create_manifest(tmpdir, {"repos": [{"url": TEST_MANIFEST_ORIGIN, "path": "the_repo"}]})
+    tmpdir.chdir()
+
+    runner = CliRunner()
+    assert runner.invoke(metarepo.cli.cli, ["status", "-j", "auto"]).exit_code == 0
+    assert runner.invoke(metarepo.cli.cli, ["status", "-j", "many"]).exit_code == 2
+
+
+def test_status_watch(tmpdir, monkeypatch):
+    """Only repositories that changed are checked again, and only lines that changed are printed again"""
+    helpers.create_commits(tmpdir.join("the_repo"), TEST_MANIFEST_ORIGIN)
+    helpers.create_manifest(tmpdir, TEST_MANIFEST)
+    tmpdir.chdir()
+
+    class FakeWatcher(watcher.PollingWatcher):
+        def __init__(self):
+            super().__init__()
+            self.changes = [lambda: None, lambda: tmpdir.join("the_repo").join("output.txt").write("Hello")]
+
+        def wait(self, timeout=None):
+            if not self.changes:
+                raise KeyboardInterrupt()
+            self.changes.pop(0)()
+            return set(self._paths)
+
+    monkeypatch.setattr(watcher, "create_watcher", FakeWatcher)
+
+    result = CliRunner().invoke(metarepo.cli.cli, ["status", "--watch"])
+    assert result.exit_code == 0
+    assert len(re.findall(r"dirty:.{0,5}False", result.output)) == 1
+    assert len(re.findall(r"dirty:.{0,5}True", result.output)) == 1
@@ -1,33 +1,16 @@
 """Test 'status' command"""
 import sys
-from abc import ABC
+from pathlib import Path
 
 import git
 import metarepo.cli
 import pytest
+import yaml
 from click.testing import CliRunner
-from prompt_toolkit.application import create_app_session
-from prompt_toolkit.input import DummyInput
-from prompt_toolkit.output import DummyOutput
+from metarepo import cache, manifest
 from tests import helpers
 
-
-@pytest.fixture(autouse=True)
-def setup_stdout_redirection():
-    """
-    Prompt toolkit will try to create a VT100/Win32 output which expects stdout/stdout to have a file descriptor.
-    Since Click's CliRunner wraps stdout in io.TextIOWrapper that does not have one we will get an error.
-    Therefore we create a AppSession with an custom output module that simply writes to the current sys.stdout
-    """
-
-    class StdoutOutput(DummyOutput, ABC):
-        def write(self, data: str) -> None:
-            sys.stdout.write(data)
-
-    # Create app session
-    with create_app_session(input=DummyInput(), output=StdoutOutput()):
-        # Yield control to the test case
-        yield
+pytestmark = pytest.mark.usefixtures("stdout_redirection")
 
 
 def test_sync_basic(test_repo_and_workspace):
@@ -116,3 +99,428 @@ def test_sync_different_branch(synced_repo_and_workspace):
     # We expect to be at the tracked branch now
     assert data["dest_repo"].head.commit == data["commits"][5]
     assert data["dest_repo"].active_branch.name == "my_branch"
+
+
+def test_sync_shallow(test_repo_and_workspace):
+    """Repositories with a depth are fetched shallow and stay shallow on incremental syncs"""
+    data = test_repo_and_workspace
+    helpers.create_manifest(
+        data["workspace"], {"repos": [{"url": str(data["tmpdir"] / "source/.git"), "path": "test", "depth": 1}]}
+    )
+
+    runner = CliRunner()
+    result = runner.invoke(metarepo.cli.cli, ["sync"])
+    assert result.exit_code == 0
+
+    dest_repo = git.Repo(data["workspace"] / "test")
+    assert dest_repo.head.commit == data["commits"][0]
+    assert len(list(dest_repo.iter_commits())) == 1
+
+    # Incremental sync only fetches the new commit
+    new_commit = helpers.write_and_commit(data["source_repo"], "newfile.txt")
+    result = runner.invoke(metarepo.cli.cli, ["sync"])
+    assert result.exit_code == 0
+    assert "commits:" in result.output
+
+    assert dest_repo.head.commit == new_commit
+    assert len(list(dest_repo.iter_commits())) == 2
+
+
+def test_sync_partial_clone(test_repo_and_workspace):
+    """Repositories with a filter are fetched as partial clones"""
+    data = test_repo_and_workspace
+    data["source_repo"].config_writer().set_value("uploadpack", "allowFilter", "true").release()
+    helpers.create_manifest(
+        data["workspace"],
+        {"repos": [{"url": str(data["tmpdir"] / "source/.git"), "path": "test", "filter": "blob:none"}]},
+    )
+
+    result = CliRunner().invoke(metarepo.cli.cli, ["sync"])
+    assert result.exit_code == 0
+
+    dest_repo = git.Repo(data["workspace"] / "test")
+    assert dest_repo.head.commit == data["commits"][0]
+    assert dest_repo.config_reader().get_value('remote "origin"', "partialclonefilter") == "blob:none"
+
+
+def test_sync_object_cache(test_repo_and_workspace):
+    """New repositories borrow their objects from the object cache"""
+    data = test_repo_and_workspace
+    cache_dir = data["tmpdir"] / "object_cache"
+
+    result = CliRunner().invoke(metarepo.cli.cli, ["sync", "--object-cache", str(cache_dir)])
+    assert result.exit_code == 0
+
+    dest_repo = git.Repo(data["workspace"] / "test")
+    assert dest_repo.head.commit == data["commits"][0]
+
+    cached_repos = cache_dir.listdir()
+    assert len(cached_repos) == 1
+    alternates = (data["workspace"] / "test" / ".git" / "objects" / "info" / "alternates").read()
+    assert str(cached_repos[0] / "objects") in alternates
+
+    # All objects are borrowed from the cache
+    assert dest_repo.git.count_objects("-v").startswith("count: 0\n")
+
+
+def test_sync_object_cache_default_location(test_repo_and_workspace):
+    """Object cache is created in the default location if no path is given"""
+    data = test_repo_and_workspace
+
+    result = CliRunner().invoke(metarepo.cli.cli, ["sync", "--object-cache"])
+    assert result.exit_code == 0
+
+    cached_repo = cache.ObjectCache().get_repo_path(str(data["tmpdir"] / "source" / ".git"))
+    assert cached_repo.exists()
+    assert cached_repo.parent == cache.get_cache_dir() / "objects"
+
+
+def test_sync_writes_lock(synced_repo_and_workspace):
+    """Sync records the checked out commits in the lock file"""
+    data = synced_repo_and_workspace
+
+    lock = manifest.load_lock(data["workspace"] / manifest.LOCK_NAME)
+    assert len(lock.repos) == 1
+    assert lock.repos[0].path == Path("test")
+    assert lock.repos[0].commit == data["commits"][0].hexsha
+
+
+def test_sync_subset_merges_lock(synced_repo_and_workspace):
+    """Only the selected repositories are synchronized, the others keep their locked commits"""
+    data = synced_repo_and_workspace
+    url = str(data["tmpdir"] / "source" / ".git")
+    helpers.create_manifest(
+        data["workspace"],
+        {"repos": [{"url": url, "path": "test"}, {"url": url, "path": "other", "groups": ["extra"]}]},
+    )
+    new_commit = helpers.write_and_commit(data["source_repo"], "new_file")
+
+    result = CliRunner().invoke(metarepo.cli.cli, ["sync", "--group", "extra"])
+    assert result.exit_code == 0
+    assert (data["workspace"] / "other").exists()
+    assert data["dest_repo"].head.commit == data["commits"][0]
+
+    lock = manifest.load_lock(data["workspace"] / manifest.LOCK_NAME)
+    assert [(locked.path, locked.commit) for locked in lock.repos] == [
+        (Path("test"), data["commits"][0].hexsha),
+        (Path("other"), new_commit.hexsha),
+    ]
+
+
+def test_sync_locked(synced_repo_and_workspace):
+    """Locked sync checks out the recorded commits instead of the tracked branch"""
+    data = synced_repo_and_workspace
+    runner = CliRunner()
+
+    # Move the local repository away from the locked commit
+    helpers.write_and_commit(data["source_repo"], "newfile.txt")
+    result = runner.invoke(metarepo.cli.cli, ["sync", "--locked"])
+    assert result.exit_code == 0
+    assert data["dest_repo"].head.commit == data["commits"][0]
+
+    data["dest_repo"].head.reset(data["commits"][3], index=True, working_tree=True)
+    result = runner.invoke(metarepo.cli.cli, ["sync", "--locked"])
+    assert result.exit_code == 0
+    assert data["dest_repo"].head.commit == data["commits"][0]
+    assert data["dest_repo"].active_branch.name == "master"
+
+
+def test_sync_locked_no_network(synced_repo_and_workspace):
+    """Locked sync does not need the remote if the recorded commit is checked out"""
+    data = synced_repo_and_workspace
+
+    # Make the remote unavailable
+    (data["tmpdir"] / "source").rename(data["tmpdir"] / "moved")
+
+    result = CliRunner().invoke(metarepo.cli.cli, ["sync", "--locked"])
+    assert result.exit_code == 0
+    assert "Already up to date" in result.output
+
+
+def test_sync_locked_without_lock(test_repo_and_workspace):
+    """Locked sync fails if there is no lock file"""
+    result = CliRunner().invoke(metarepo.cli.cli, ["sync", "--locked"])
+    assert result.exit_code == 1
+    assert "Not found" in result.output
+
+
+def test_sync_probe_skips_unchanged(synced_repo_and_workspace):
+    """Repositories are only fetched if the remote has changed"""
+    data = synced_repo_and_workspace
+    runner = CliRunner()
+
+    result = runner.invoke(metarepo.cli.cli, ["sync"])
+    assert result.exit_code == 0
+    assert "Already up to date" in result.output
+    assert "Skipped fetching 1 of 1" in result.output
+
+    new_commit = helpers.write_and_commit(data["source_repo"], "newfile.txt")
+    result = runner.invoke(metarepo.cli.cli, ["sync"])
+    assert result.exit_code == 0
+    assert "Skipped fetching 0 of 1" in result.output
+    assert data["dest_repo"].head.commit == new_commit
+
+    result = runner.invoke(metarepo.cli.cli, ["sync", "--no-probe"])
+    assert result.exit_code == 0
+    assert "Skipped fetching" not in result.output
+
+
+def test_sync_async_engine(test_repo_and_workspace):
+    """Synchronize using the async engine"""
+    data = test_repo_and_workspace
+    runner = CliRunner()
+
+    result = runner.invoke(metarepo.cli.cli, ["sync", "--engine", "async", "--host-limit", "localhost=2"])
+    assert result.exit_code == 0
+    assert "Checked out master" in result.output
+
+    dest_repo = git.Repo(data["workspace"] / "test")
+    assert dest_repo.head.commit == data["source_repo"].head.commit
+
+    new_commit = helpers.write_and_commit(data["source_repo"], "newfile.txt")
+    result = runner.invoke(metarepo.cli.cli, ["sync", "--engine", "async"])
+    assert result.exit_code == 0
+    assert dest_repo.head.commit == new_commit
+    assert "Skipped fetching 0 of 1" in result.output
+
+    result = runner.invoke(metarepo.cli.cli, ["sync", "--engine", "async"])
+    assert result.exit_code == 0
+    assert "Skipped fetching 1 of 1" in result.output
+
+
+def test_sync_async_engine_dirty(synced_repo_and_workspace):
+    """The async engine stops on dirty repositories as well"""
+    data = synced_repo_and_workspace
+    (data["workspace"] / "test" / "output.txt").write("Changed")
+
+    result = CliRunner().invoke(metarepo.cli.cli, ["sync", "--engine", "async", "--no-probe"])
+    assert result.exit_code == 1
+
+
+def test_sync_invalid_host_limit(test_repo_and_workspace):
+    """Host limits must be in the format HOST=N"""
+    result = CliRunner().invoke(metarepo.cli.cli, ["sync", "--host-limit", "localhost"])
+    assert result.exit_code == 2
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="SSH multiplexing is not used on Windows")
+def test_sync_ssh_multiplex_keeps_ssh_command(test_repo_and_workspace, tmp_path, monkeypatch):
+    """Repositories with a core.sshCommand of their own keep using it when fetches are multiplexed"""
+    data = test_repo_and_workspace
+
+    shared_log = tmp_path / "shared.log"
+    helpers.create_fake_ssh(tmp_path / "ssh", shared_log)
+    monkeypatch.delenv("GIT_SSH_COMMAND", raising=False)
+    monkeypatch.setenv("GIT_SSH", str(tmp_path / "ssh"))
+
+    helpers.create_manifest(
+        data["workspace"], {"repos": [{"url": f"localhost:{data['tmpdir'] / 'source/.git'}", "path": "test"}]}
+    )
+    runner = CliRunner()
+    assert runner.invoke(metarepo.cli.cli, ["sync"]).exit_code == 0
+    assert "ControlMaster=auto" in shared_log.read_text()
+
+    own_log = tmp_path / "own.log"
+    helpers.create_fake_ssh(tmp_path / "work-ssh", own_log)
+    dest_repo = git.Repo(data["workspace"] / "test")
+    with dest_repo.config_writer() as config:
+        config.set_value("core", "sshCommand", str(tmp_path / "work-ssh"))
+
+    new_commit = helpers.write_and_commit(data["source_repo"], "newfile.txt")
+    result = runner.invoke(metarepo.cli.cli, ["sync", "--no-probe"])
+    assert result.exit_code == 0
+    assert dest_repo.head.commit == new_commit
+    assert "git-upload-pack" in own_log.read_text()
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="SSH multiplexing is not used on Windows")
+def test_sync_ssh_multiplex(test_repo_and_workspace, tmp_path, monkeypatch):
+    """Fetches over SSH go through the shared control connection"""
+    data = test_repo_and_workspace
+
+    log = tmp_path / "ssh.log"
+    fake_ssh = tmp_path / "ssh"
+    helpers.create_fake_ssh(fake_ssh, log)
+    monkeypatch.setenv("GIT_SSH_COMMAND", str(fake_ssh))
+
+    helpers.create_manifest(
+        data["workspace"], {"repos": [{"url": f"localhost:{data['tmpdir'] / 'source/.git'}", "path": "test"}]}
+    )
+
+    result = CliRunner().invoke(metarepo.cli.cli, ["sync"])
+    assert result.exit_code == 0
+    assert git.Repo(data["workspace"] / "test").head.commit == data["commits"][0]
+
+    calls = log.read_text().splitlines()
+    assert "-N -f" in calls[0]
+    assert "-O exit" in calls[-1]
+    assert all("ControlMaster=auto" in call for call in calls)
+    assert any("git-upload-pack" in call for call in calls)
+
+    result = CliRunner().invoke(metarepo.cli.cli, ["sync", "--no-ssh-multiplex"])
+    assert result.exit_code == 0
+    assert "ControlMaster" not in log.read_text().splitlines()[-1]
+
+    # Nothing to fetch, no connection at all
+    calls = len(log.read_text().splitlines())
+    result = CliRunner().invoke(metarepo.cli.cli, ["sync", "--locked"])
+    assert result.exit_code == 0
+    assert len(log.read_text().splitlines()) == calls
+
+
+def test_sync_parallel_auto(synced_repo_and_workspace, monkeypatch):
+    """The parallel level is automatic by default and can be set by the manifest, environment and command line"""
+    data = synced_repo_and_workspace
+    runner = CliRunner()
+
+    result = runner.invoke(metarepo.cli.cli, ["sync"])
+    assert result.exit_code == 0
+    assert "Parallel: auto (started at 1" in result.output
+
+    helpers.create_manifest(
+        data["workspace"],
+        {"repos": [{"url": str(data["tmpdir"] / "source/.git"), "path": "test"}], "settings": {"parallel": 2}},
+    )
+    assert "Parallel: 2" in runner.invoke(metarepo.cli.cli, ["sync"]).output
+
+    monkeypatch.setenv("METAREPO_PARALLEL", "3")
+    assert "Parallel: 3" in runner.invoke(metarepo.cli.cli, ["sync"]).output
+    assert "Parallel: 4" in runner.invoke(metarepo.cli.cli, ["sync", "-j", "4"]).output
+    assert "Parallel: auto" in runner.invoke(metarepo.cli.cli, ["sync", "-j", "auto"]).output
+
+    assert runner.invoke(metarepo.cli.cli, ["sync", "-j", "0"]).exit_code == 2
+
+
+def test_sync_keep_going(test_repo_and_workspace):
+    """All repositories are synchronized even if one fails, unless --fail-fast is given"""
+    data = test_repo_and_workspace
+    helpers.create_manifest(
+        data["workspace"],
+        {
+            "repos": [
+                {"url": str(data["tmpdir"] / "missing/.git"), "path": "broken"},
+                {"url": str(data["tmpdir"] / "source/.git"), "path": "test"},
+            ]
+        },
+    )
+    runner = CliRunner()
+
+    result = runner.invoke(metarepo.cli.cli, ["sync", "-j", "1", "--fail-fast"])
+    assert result.exit_code == 1
+    assert "not started" in result.output
+    assert not (data["workspace"] / "test").exists()
+
+    result = runner.invoke(metarepo.cli.cli, ["sync", "-j", "1"])
+    assert result.exit_code == 1
+    assert "1 ok, 0 skipped, 1 failed" in result.output
+    assert "does not appear to be a git repository" in result.output
+    assert git.Repo(data["workspace"] / "test").head.commit == data["commits"][0]
+
+
+def test_sync_sparse(test_repo_and_workspace):
+    """Only the directories in the sparse patterns are checked out, and patterns can be changed later"""
+    data = test_repo_and_workspace
+    source_repo = data["source_repo"]
+    source_repo.config_writer().set_value("uploadpack", "allowFilter", "true").release()
+    for directory in ("include", "other"):
+        (Path(source_repo.working_dir) / directory).mkdir()
+        helpers.write_and_commit(source_repo, f"{directory}/file.txt")
+
+    def sync_with(**repo):
+        helpers.create_manifest(
+            data["workspace"],
+            {"repos": [{"url": str(data["tmpdir"] / "source/.git"), "path": "test", "filter": "blob:none", **repo}]},
+        )
+        result = CliRunner().invoke(metarepo.cli.cli, ["sync"])
+        assert result.exit_code == 0
+        return result
+
+    dest_path = data["workspace"] / "test"
+    sync_with(sparse=["include/"])
+    assert (dest_path / "include" / "file.txt").exists()
+    assert (dest_path / "output.txt").exists()
+    assert not (dest_path / "other").exists()
+
+    # Blobs outside of the sparse patterns are never fetched
+    missing = git.Repo(dest_path).git.rev_list("--objects", "--missing=print", "HEAD").splitlines()
+    assert [line for line in missing if line.startswith("?")]
+
+    # Unchanged patterns are left alone
+    assert "sparse:" not in sync_with(sparse=["include/"]).output
+
+    result = sync_with(sparse=["include", "other"])
+    assert "sparse:" in result.output
+    assert (dest_path / "other" / "file.txt").exists()
+
+    result = sync_with()
+    assert "Sparse checkout disabled" in result.output
+    assert not git.Repo(dest_path).is_dirty(untracked_files=True)
+
+
+def test_sync_process_engine(test_repo_and_workspace):
+    """Synchronize using worker processes"""
+    data = test_repo_and_workspace
+    runner = CliRunner()
+
+    result = runner.invoke(metarepo.cli.cli, ["sync", "--engine", "process", "-j", "2"])
+    assert result.exit_code == 0
+    assert "Checked out master" in result.output
+
+    dest_repo = git.Repo(data["workspace"] / "test")
+    assert dest_repo.head.commit == data["source_repo"].head.commit
+
+    new_commit = helpers.write_and_commit(data["source_repo"], "newfile.txt")
+    result = runner.invoke(metarepo.cli.cli, ["sync", "--engine", "process"])
+    assert result.exit_code == 0
+    assert dest_repo.head.commit == new_commit
+
+
+def test_sync_includes(test_repo_and_workspace):
+    """Manifests included from synchronized repositories are resolved and synchronized in the same sync"""
+    data = test_repo_and_workspace
+    url = str(data["tmpdir"] / "source" / ".git")
+
+    # The source repository publishes a manifest requesting itself at another path
+    source_manifest = {"repos": [{"url": url, "path": "test"}, {"url": url, "path": "dependency"}]}
+    (data["tmpdir"] / "source" / "manifest.yml").write(yaml.dump(source_manifest))
+    data["source_repo"].index.add(["manifest.yml"])
+    data["source_repo"].index.commit("Add manifest")
+
+    helpers.create_manifest(
+        data["workspace"], {"repos": [{"url": url, "path": "test"}], "include": ["test/manifest.yml"]}
+    )
+
+    runner = CliRunner()
+    result = runner.invoke(metarepo.cli.cli, ["list"])
+    assert "Not included until synchronized: test/manifest.yml" in result.output
+
+    result = runner.invoke(metarepo.cli.cli, ["sync"])
+    assert result.exit_code == 0
+    assert (data["workspace"] / "dependency" / "manifest.yml").exists()
+
+    lock = manifest.load_lock(data["workspace"] / manifest.LOCK_NAME)
+    assert [locked.path for locked in lock.repos] == [Path("test"), Path("dependency")]
+
+    result = runner.invoke(metarepo.cli.cli, ["list"])
+    assert "dependency" in result.output
+    assert "Not included" not in result.output
+
+
+def test_sync_failure_keeps_lock(test_repo_and_workspace):
+    """The commits of the repositories that were synchronized are recorded even if another repository failed"""
+    data = test_repo_and_workspace
+    url = str(data["tmpdir"] / "source" / ".git")
+    helpers.create_manifest(
+        data["workspace"],
+        {"repos": [{"url": url, "path": "test"}, {"url": str(data["tmpdir"] / "missing"), "path": "broken"}]},
+    )
+
+    result = CliRunner().invoke(metarepo.cli.cli, ["sync"])
+    assert result.exit_code == 1
+
+    lock = manifest.load_lock(data["workspace"] / manifest.LOCK_NAME)
+    assert [(locked.path, locked.commit) for locked in lock.repos] == [(Path("test"), data["commits"][0].hexsha)]
+
+    result = CliRunner().invoke(metarepo.cli.cli, ["sync"])
+    assert result.exit_code == 1
+    assert "Skipped fetching 1 of 1" in result.output
@@ -0,0 +1,43 @@
+"""Test 'tune' command"""
+import git
+import metarepo.cli
+import pytest
+from click.testing import CliRunner
+from metarepo import vcs_git
+
+pytestmark = pytest.mark.usefixtures("stdout_redirection")
+
+
+def get_tuning(repo: git.Repo) -> dict:
+    reader = repo.config_reader("repository")
+    return {name: str(reader.get_value(*name.rsplit(".", 1), "")).lower() for name in vcs_git.TUNING_CONFIG}
+
+
+def test_tune(test_repo_and_workspace):
+    """Repositories are configured for fast status and the latency is shown"""
+    result = CliRunner().invoke(metarepo.cli.cli, ["sync", "--no-tune"])
+    assert result.exit_code == 0
+
+    dest_repo = git.Repo(test_repo_and_workspace["workspace"] / "test")
+    assert get_tuning(dest_repo) != vcs_git.TUNING_CONFIG
+
+    result = CliRunner().invoke(metarepo.cli.cli, ["tune", "--no-fsmonitor"])
+    assert result.exit_code == 0
+    assert "core.untrackedCache" in result.output
+    assert "Total status latency" in result.output
+    assert get_tuning(dest_repo) == vcs_git.TUNING_CONFIG
+
+    result = CliRunner().invoke(metarepo.cli.cli, ["tune", "--no-fsmonitor"])
+    assert "already tuned" in result.output
+
+
+def test_tune_missing_repository(test_repo_and_workspace):
+    """Repositories that have not been synchronized are reported"""
+    result = CliRunner().invoke(metarepo.cli.cli, ["tune"])
+    assert result.exit_code == 0
+    assert "NOT FOUND" in result.output
+
+
+def test_sync_tunes(synced_repo_and_workspace):
+    """Synchronized repositories are tuned by default"""
+    assert get_tuning(synced_repo_and_workspace["dest_repo"]) == vcs_git.TUNING_CONFIG
@@ -0,0 +1,41 @@
+"""Test the timing history"""
+from pathlib import Path
+
+from metarepo import history
+
+
+def test_history_round_trip(tmp_path):
+    """Recorded timings are saved in the workspace and trimmed to the history length"""
+    sync_history = history.History.load(tmp_path)
+    for i in range(history.HISTORY_LENGTH + 2):
+        sync_history.record(Path("a/b"), history.Timing(float(i), 1.0, 1024))
+    sync_history.save()
+
+    assert (tmp_path / history.STATE_DIR / ".gitignore").read_text() == "*\n"
+
+    loaded = history.History.load(tmp_path)
+    timings = loaded.get_timings(Path("a/b"))
+    assert len(timings) == history.HISTORY_LENGTH
+    assert timings[-1] == history.Timing(float(history.HISTORY_LENGTH + 1), 1.0, 1024)
+    assert loaded.expected_seconds(Path("a/b")) == sum(t.fetch_seconds + 1.0 for t in timings) / len(timings)
+    assert loaded.expected_seconds(Path("other")) is None
+
+
+def test_history_unreadable(tmp_path):
+    """A corrupt history is ignored"""
+    (tmp_path / history.STATE_DIR).mkdir()
+    (tmp_path / history.STATE_DIR / history.HISTORY_NAME).write_text("{not json")
+
+    assert history.History.load(tmp_path).get_timings(Path("a")) == []
+
+
+def test_order_longest_first(tmp_path):
+    """Repositories without history go first, then the longest expected"""
+    sync_history = history.History(tmp_path / "history.json")
+    sync_history.record(Path("fast"), history.Timing(0.1, 0.1))
+    sync_history.record(Path("slow"), history.Timing(5.0, 1.0))
+    sync_history.record(Path("medium"), history.Timing(1.0, 0.5))
+
+    paths = [Path(name) for name in ("fast", "medium", "new", "slow")]
+    ordered = sync_history.order_longest_first(paths, lambda path: path)
+    assert ordered == [Path("new"), Path("slow"), Path("medium"), Path("fast")]
@@ -67,3 +67,212 @@ def test_manifest_save(tmpdir):
     loaded_manifest = manifest.load_manifest(filename)
 
     assert manifest_to_save == loaded_manifest
+
+
+def test_manifest_shallow_and_partial():
+    result = manifest.parse_manifest(
+        {"repos": [{"url": "git://localhost/repo", "path": "my/path", "depth": 1, "filter": "blob:none"}]}
+    )
+    repos = result.get_repos()
+    assert repos[0].depth == 1
+    assert repos[0].filter == "blob:none"
+
+    with pytest.raises(manifest.ValidationFailed):
+        manifest.parse_manifest({"repos": [{"url": "git://localhost/repo", "path": "my/path", "depth": 0}]})
+
+
+def test_manifest_load_cached(tmpdir, monkeypatch):
+    """Loading an unchanged manifest a second time does not parse it again"""
+    manifest_filename = tmpdir / "manifest.yml"
+    with open(manifest_filename, "w") as fp:
+        yaml.safe_dump({"repos": [{"url": "git://localhost/repo", "path": "my/path"}]}, fp)
+
+    # Pretend the manifest was written a while ago
+    timestamp = os.stat(manifest_filename).st_mtime - 60
+    os.utime(manifest_filename, (timestamp, timestamp))
+
+    first = manifest.load_manifest(manifest_filename)
+
+    def fail(_):
+        raise AssertionError("Manifest parsed again")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(manifest, "parse_manifest", fail)
+        assert manifest.load_manifest(manifest_filename) == first
+
+        # Touching the file without changing the content does not parse it again
+        os.utime(manifest_filename)
+        assert manifest.load_manifest(manifest_filename) == first
+
+
+def test_manifest_load_cached_modified(tmpdir):
+    """Modifications are detected even if the size and modification time are unchanged"""
+    manifest_filename = tmpdir / "manifest.yml"
+    with open(manifest_filename, "w") as fp:
+        yaml.safe_dump({"repos": [{"url": "git://localhost/repo", "path": "my/path"}]}, fp)
+    stat = os.stat(manifest_filename)
+
+    assert manifest.load_manifest(manifest_filename).get_repos()[0].path == Path("my/path")
+
+    with open(manifest_filename, "w") as fp:
+        yaml.safe_dump({"repos": [{"url": "git://localhost/repo", "path": "my/ptah"}]}, fp)
+    os.utime(manifest_filename, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    assert manifest.load_manifest(manifest_filename).get_repos()[0].path == Path("my/ptah")
+
+
+def test_manifest_cache_invalidated(tmpdir, monkeypatch):
+    """Cached manifests are parsed again when the model changes or the cache is damaged"""
+    manifest_filename = tmpdir / "manifest.yml"
+    with open(manifest_filename, "w") as fp:
+        yaml.safe_dump({"repos": [{"url": "git://localhost/repo", "path": "my/path"}]}, fp)
+    timestamp = os.stat(manifest_filename).st_mtime - 60
+    os.utime(manifest_filename, (timestamp, timestamp))
+    manifest.load_manifest(manifest_filename)
+
+    parsed = []
+    parse_manifest = manifest.parse_manifest
+    monkeypatch.setattr(manifest, "parse_manifest", lambda data: parsed.append(data) or parse_manifest(data))
+
+    # Same field names, different default
+    monkeypatch.setattr(manifest.Manifest, "schema_json", classmethod(lambda cls: '{"track": "main"}'))
+    manifest._get_manifest_cache_key.cache_clear()
+    manifest.load_manifest(manifest_filename)
+    assert len(parsed) == 1
+
+    manifest._get_manifest_cache_path(Path(manifest_filename)).write_bytes(b"garbage")
+    manifest.load_manifest(manifest_filename)
+    assert len(parsed) == 2
+
+    monkeypatch.undo()
+    manifest._get_manifest_cache_key.cache_clear()
+
+
+def test_manifest_package_version(tmp_path, monkeypatch):
+    """The installed version is taken from the dist-info directory next to the package"""
+    monkeypatch.setattr(manifest, "__file__", str(tmp_path / "metarepo" / "manifest.py"))
+    assert manifest._get_package_version() == ""
+
+    (tmp_path / "metarepo-1.2.3.dist-info").mkdir()
+    assert manifest._get_package_version() == "1.2.3"
+
+
+def test_manifest_select():
+    """Repositories are selected by group and path pattern, patterns also select the paths below them"""
+    result = manifest.parse_manifest(
+        {
+            "repos": [
+                {"url": "git://localhost/a", "path": "libs/a", "groups": ["core"]},
+                {"url": "git://localhost/b", "path": "libs/b", "groups": ["core", "extra"]},
+                {"url": "git://localhost/c", "path": "libsx/c"},
+                {"url": "git://localhost/d", "path": "tools/d", "groups": ["extra"]},
+            ]
+        }
+    )
+    index = result.get_index()
+
+    def select(**filters):
+        return [repo.path.as_posix() for repo in index.select(**filters)]
+
+    assert select() == ["libs/a", "libs/b", "libsx/c", "tools/d"]
+    assert select(groups=["extra"]) == ["libs/b", "tools/d"]
+    assert select(patterns=["libs"]) == ["libs/a", "libs/b"]
+    assert select(patterns=["./libs/"]) == ["libs/a", "libs/b"]
+    assert select(patterns=["./libs/a", "libs\\b"]) == ["libs/a", "libs/b"]
+    assert select(patterns=["libs*/c", "tools/d/"]) == ["libsx/c", "tools/d"]
+    assert select(patterns=["*/b", "*/d"], groups=["core"]) == ["libs/b"]
+    assert select(groups=["unknown"]) == []
+    assert index.get_groups() == ["core", "extra"]
+
+
+def test_manifest_index_cached(tmpdir, monkeypatch):
+    """The index is stored in the manifest cache"""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmpdir / "cache"))
+    manifest_filename = tmpdir / "manifest.yml"
+    with open(manifest_filename, "w") as fp:
+        yaml.safe_dump({"repos": [{"url": "git://localhost/repo", "path": "my/path", "groups": ["a"]}]}, fp)
+
+    manifest.load_manifest(manifest_filename)
+
+    def fail(*_):
+        raise AssertionError("Index built again")
+
+    monkeypatch.setattr(manifest.RepositoryIndex, "__init__", fail)
+    assert manifest.load_manifest(manifest_filename).get_index().get_groups() == ["a"]
+
+
+def write_manifest(path: Path, data: dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as fp:
+        yaml.safe_dump(data, fp)
+
+
+def test_manifest_resolve_includes(tmp_path):
+    """Included manifests are resolved transitively and repositories requested twice are added once"""
+    write_manifest(
+        tmp_path / manifest.MANIFEST_NAME,
+        {
+            "repos": [
+                {"url": "git://localhost/a", "path": "a"},
+                {"url": "git://localhost/c", "path": "c", "track": "v1"},
+            ],
+            "include": ["a/manifest.yml", "b.yml"],
+        },
+    )
+    write_manifest(
+        tmp_path / "a" / "manifest.yml",
+        {"repos": [{"url": "git://localhost/c", "path": "c", "track": "v2"}], "include": ["../b.yml", "nested/x.yml"]},
+    )
+    write_manifest(tmp_path / "a" / "nested" / "x.yml", {"repos": [{"url": "git://localhost/d", "path": "d"}]})
+    write_manifest(tmp_path / "b.yml", {"repos": [{"url": "git://localhost/b", "path": "b"}]})
+
+    resolved = manifest.resolve_manifest(tmp_path / manifest.MANIFEST_NAME)
+    assert [(repo.path, repo.track) for repo in resolved.get_repos()] == [
+        (Path("a"), "master"),
+        (Path("c"), "v1"),
+        (Path("b"), "master"),
+        (Path("d"), "master"),
+    ]
+    assert resolved.get_pending_includes() == []
+    assert [repo.path for repo in resolved.get_index().select(patterns=["d"])] == [Path("d")]
+
+
+def test_manifest_resolve_pending(tmp_path):
+    """Manifests in repositories that have not been synchronized are pending, other missing manifests are errors"""
+    write_manifest(
+        tmp_path / manifest.MANIFEST_NAME,
+        {"repos": [{"url": "git://localhost/a", "path": "a"}], "include": ["a/manifest.yml"]},
+    )
+    resolved = manifest.resolve_manifest(tmp_path / manifest.MANIFEST_NAME)
+    assert [repo.path for repo in resolved.get_repos()] == [Path("a")]
+    assert resolved.get_pending_includes() == [tmp_path / "a" / "manifest.yml"]
+
+    write_manifest(
+        tmp_path / manifest.MANIFEST_NAME,
+        {"repos": [{"url": "git://localhost/a", "path": "a"}], "include": ["missing.yml"]},
+    )
+    with pytest.raises(manifest.NotFound):
+        manifest.resolve_manifest(tmp_path / manifest.MANIFEST_NAME)
+
+
+def test_manifest_resolve_errors(tmp_path):
+    """Cycles and different repositories at the same path are detected"""
+    top_path = tmp_path / manifest.MANIFEST_NAME
+    write_manifest(top_path, {"repos": [{"url": "git://localhost/a", "path": "a"}], "include": ["x.yml"]})
+    write_manifest(tmp_path / "x.yml", {"repos": [{"url": "git://localhost/x", "path": "x"}], "include": ["y.yml"]})
+    write_manifest(tmp_path / "y.yml", {"repos": [{"url": "git://localhost/y", "path": "y"}], "include": ["x.yml"]})
+    with pytest.raises(manifest.IncludeCycle, match="x.yml -> .*y.yml -> .*x.yml"):
+        manifest.resolve_manifest(top_path)
+
+    # Siblings including each other, both are also included by the top manifest
+    write_manifest(top_path, {"repos": [{"url": "git://localhost/a", "path": "a"}], "include": ["x.yml", "y.yml"]})
+    with pytest.raises(manifest.IncludeCycle, match="x.yml -> .*y.yml -> .*x.yml"):
+        manifest.resolve_manifest(top_path)
+
+    write_manifest(tmp_path / "y.yml", {"repos": [{"url": "git://localhost/other", "path": "a/../x"}]})
+    with pytest.raises(manifest.Conflict, match="git://localhost/x"):
+        manifest.resolve_manifest(top_path)
+
+    write_manifest(tmp_path / "y.yml", {"repos": {}})
+    with pytest.raises(manifest.ManifestError, match="y.yml, included by"):
+        manifest.resolve_manifest(top_path)
@@ -0,0 +1,71 @@
+"""Test parallel level selection"""
+import pytest
+from metarepo import parallel
+
+
+def test_resolve_level():
+    """The first level that is set wins, auto if none is"""
+    assert parallel.resolve_level(None, 4) == 4
+    assert parallel.resolve_level(2, 4) == 2
+    assert parallel.resolve_level(None, None) == parallel.AUTO
+
+
+def test_auto_range(monkeypatch):
+    """The automatic level is bounded by the number of repositories and CPUs"""
+    monkeypatch.setattr(parallel, "get_cpu_count", lambda: 2)
+    assert parallel.get_auto_range(1) == (1, 1)
+    assert parallel.get_auto_range(10) == (4, 10)
+    assert parallel.get_auto_range(1000) == (4, 16)
+
+
+@pytest.fixture(name="clock")
+def fixture_clock(monkeypatch):
+    """Fake clock and an idle CPU"""
+    clock = {"now": 0.0}
+    monkeypatch.setattr(parallel.time, "monotonic", lambda: clock["now"])
+    monkeypatch.setattr(parallel, "get_cpu_seconds", lambda: 0.0)
+    return clock
+
+
+def run_window(limiter, clock, seconds, fail=False):
+    """Complete as many repositories as the current limit, taking seconds in total"""
+    for _ in range(limiter.limit):
+        clock["now"] += seconds / limiter.limit
+        try:
+            with limiter.slot():
+                if fail:
+                    raise RuntimeError("fetch failed")
+        except RuntimeError:
+            pass
+
+
+def test_limiter_ramps_up_while_throughput_improves(clock):
+    """The limit grows by one per window as long as throughput improves"""
+    limiter = parallel.AdaptiveLimiter(2, 4)
+
+    run_window(limiter, clock, 1.0)
+    assert limiter.limit == 3
+
+    # 3 repositories in one second is an improvement
+    run_window(limiter, clock, 1.0)
+    assert limiter.limit == 4
+
+    # Never beyond the maximum
+    run_window(limiter, clock, 0.5)
+    assert limiter.limit == 4
+    assert limiter.peak == 4
+
+
+def test_limiter_holds_when_throughput_stalls(clock):
+    """The limit stays if more concurrency does not help"""
+    limiter = parallel.AdaptiveLimiter(2, 8)
+    run_window(limiter, clock, 1.0)
+    run_window(limiter, clock, 10.0)
+    assert limiter.limit == 3
+
+
+def test_limiter_backs_off_on_errors(clock):
+    """The limit is halved when repositories fail"""
+    limiter = parallel.AdaptiveLimiter(4, 8)
+    run_window(limiter, clock, 1.0, fail=True)
+    assert limiter.limit == 2
@@ -0,0 +1,30 @@
+"""Test the prefetch log"""
+from pathlib import Path
+
+from metarepo import manifest, prefetch
+
+
+def test_prefetch_log_round_trip(tmp_path):
+    """Prefetches are saved in the workspace and only apply to the same URL and tracked branch"""
+    repo = manifest.Repository(url="https://host/repo", path="a/b")
+    prefetch_log = prefetch.PrefetchLog.load(tmp_path)
+    prefetch_log.record(repo, "1" * 40)
+    prefetch_log.save()
+
+    loaded = prefetch.PrefetchLog.load(tmp_path)
+    assert loaded.get_sha(repo) == "1" * 40
+    assert loaded.get_sha(manifest.Repository(url="https://host/repo", path="a/b", track="other")) is None
+    assert loaded.get_sha(manifest.Repository(url="https://host/moved", path="a/b")) is None
+
+
+def test_prefetch_usable_shas(tmp_path):
+    """Old prefetches are only used if the remote has been probed and still has the prefetched commit"""
+    repos = [manifest.Repository(url=f"https://host/{name}", path=name) for name in ("fresh", "probed", "changed")]
+    prefetch_log = prefetch.PrefetchLog(tmp_path / "prefetch.json")
+    for repo in repos:
+        prefetch_log.record(repo, repo.path.name * 4)
+
+    assert prefetch_log.get_usable_shas(repos, {}, max_age=60) == {repo.path: repo.path.name * 4 for repo in repos}
+
+    remote_shas = {Path("probed"): "probed" * 4, Path("changed"): "other"}
+    assert prefetch_log.get_usable_shas(repos, remote_shas, max_age=-1) == {Path("probed"): "probed" * 4}
@@ -1,5 +1,6 @@
 import git
 import pytest
+from metarepo import vcs_git
 from metarepo.vcs_git import InvalidRepository, RepoTool
 from tests import helpers
 
@@ -28,8 +29,8 @@ def test_fetch_behind(test_repo_and_workspace):
     repo.checkout("origin/master", "master")
 
     # We are currently up to date
-    assert fetch_result.ahead == []
-    assert fetch_result.behind == []
+    assert fetch_result.ahead == 0
+    assert fetch_result.behind == 0
 
     new_commit = helpers.write_and_commit(data["source_repo"], "new_file_on_remote")
 
@@ -37,8 +38,9 @@ def test_fetch_behind(test_repo_and_workspace):
     fetch_result = repo.fetch("master")
 
     # We are now behind
-    assert fetch_result.ahead == []
-    assert fetch_result.behind == [new_commit]
+    assert fetch_result.ahead == 0
+    assert fetch_result.behind == 1
+    assert repo.list_commits("master..origin/master") == [new_commit]
 
 
 def test_fetch_ahead(test_repo_and_workspace):
@@ -56,9 +58,10 @@ def test_fetch_ahead(test_repo_and_workspace):
     # Fetch the new commit
     fetch_result = repo.fetch("master")
 
-    # We are now behind
-    assert fetch_result.ahead == [new_commit]
-    assert fetch_result.behind == []
+    # We are now ahead
+    assert fetch_result.ahead == 1
+    assert fetch_result.behind == 0
+    assert repo.list_commits("origin/master..master") == [new_commit]
 
 
 def test_checkout(test_repo_and_workspace):
@@ -96,3 +99,111 @@ def test_local_is_dirty(test_repo_and_workspace_behind):
     # Repo should be dirty now
     status = repo.get_status()
     assert status.is_dirty
+
+
+def test_list_commits_bounded(test_repo_and_workspace):
+    """Listing commits is limited to the requested number"""
+    data = test_repo_and_workspace
+
+    repo = RepoTool(data["workspace"] / "repo", expected_origin=data["source_repo"].git_dir, allow_create=True)
+    repo.fetch("master")
+
+    assert repo.list_commits("origin/master", max_count=3) == data["commits"][0:3]
+
+
+def test_checkout_noop(test_repo_and_workspace):
+    """Checking out the commit that is already checked out does not touch the repository"""
+    data = test_repo_and_workspace
+
+    repo = RepoTool(data["workspace"] / "repo", expected_origin=data["source_repo"].git_dir, allow_create=True)
+    repo.fetch("master")
+    assert repo.checkout("origin/master", "master")
+
+    index = data["workspace"] / "repo" / ".git" / "index"
+    index_mtime = index.mtime()
+
+    assert not repo.checkout("origin/master", "master")
+    assert index.mtime() == index_mtime
+
+
+def test_checkout_keeps_unchanged_files(test_repo_and_workspace):
+    """Only files that change are rewritten by a checkout"""
+    data = test_repo_and_workspace
+    repo_path = data["workspace"] / "repo"
+
+    repo = RepoTool(repo_path, expected_origin=data["source_repo"].git_dir, allow_create=True)
+    repo.fetch("master")
+    repo.checkout("origin/master", "master")
+
+    # Pretend the file was checked out long ago
+    unchanged = repo_path / "output.txt"
+    unchanged.setmtime(1000000000)
+    git.Repo(repo_path).git.update_index("--refresh")
+
+    new_commit = helpers.write_and_commit(data["source_repo"], "new_file_on_remote")
+    repo.fetch("master")
+    assert repo.checkout("origin/master", "master")
+
+    assert unchanged.mtime() == 1000000000
+    assert (repo_path / "new_file_on_remote").exists()
+    status = repo.get_status()
+    assert status.head == new_commit
+    assert not status.is_dirty
+
+
+def test_checkout_switch_branch_and_track(test_repo_and_workspace):
+    """Checking out another branch moves HEAD and can set the upstream branch"""
+    data = test_repo_and_workspace
+    data["source_repo"].create_head("old", data["commits"][5])
+
+    repo = RepoTool(data["workspace"] / "repo", expected_origin=data["source_repo"].git_dir, allow_create=True)
+    repo.fetch("master")
+    repo.fetch("old")
+    repo.checkout("origin/master", "master")
+
+    assert repo.checkout("origin/old", "old", track="origin/old")
+
+    local_repo = git.Repo(data["workspace"] / "repo")
+    assert local_repo.active_branch.name == "old"
+    assert local_repo.head.commit == data["commits"][5]
+    assert local_repo.active_branch.tracking_branch().name == "origin/old"
+    assert not local_repo.is_dirty(untracked_files=True)
+
+
+def test_checkout_does_not_overwrite_local_changes(test_repo_and_workspace):
+    """Local changes that conflict with the checkout make it fail"""
+    data = test_repo_and_workspace
+    repo_path = data["workspace"] / "repo"
+
+    repo = RepoTool(repo_path, expected_origin=data["source_repo"].git_dir, allow_create=True)
+    repo.fetch("master")
+    repo.checkout("origin/master", "master")
+
+    helpers.write_and_commit(data["source_repo"], "new_file_on_remote")
+    repo.fetch("master")
+    (repo_path / "new_file_on_remote").write("Local file")
+
+    with pytest.raises(git.GitCommandError):
+        repo.checkout("origin/master", "master")
+    assert (repo_path / "new_file_on_remote").read() == "Local file"
+    assert git.Repo(repo_path).head.commit == data["commits"][0]
+
+
+def test_shared_repositories(test_repo_and_workspace):
+    """Repositories are shared within the context and their git processes stopped when it exits"""
+    data = test_repo_and_workspace
+    repo_path = data["workspace"] / "repo"
+    RepoTool(repo_path, expected_origin=data["source_repo"].git_dir, allow_create=True).fetch("master")
+
+    with vcs_git.shared_repositories():
+        first = RepoTool(repo_path, expected_origin=data["source_repo"].git_dir)
+        second = RepoTool(repo_path, expected_origin=data["source_repo"].git_dir)
+        first.checkout("origin/master", "master")
+        second.close()
+
+        shared_repo = first._repo
+        assert second._repo is shared_repo
+        assert shared_repo.git.cat_file_header is not None
+
+    assert shared_repo.git.cat_file_header is None
+    assert RepoTool(repo_path)._repo is not shared_repo
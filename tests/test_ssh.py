@@ -0,0 +1,101 @@
+"""Test SSH connection multiplexing"""
+import os
+
+import pytest
+from metarepo import ssh
+from tests import helpers
+
+pytestmark = pytest.mark.skipif(os.name == "nt", reason="SSH multiplexing is not used on Windows")
+
+
+@pytest.fixture(name="fake_ssh")
+def fixture_fake_ssh(tmp_path, monkeypatch):
+    """
+    Install an ssh replacement that logs its arguments and runs the remote command locally
+    :return: Path to the log file
+    """
+    log = tmp_path / "ssh.log"
+    script = tmp_path / "ssh"
+    helpers.create_fake_ssh(script, log)
+    monkeypatch.setenv("GIT_SSH_COMMAND", str(script))
+    return log
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        ("ssh://git@example.com/repo.git", ssh.SshTarget("git", "example.com", None)),
+        ("git+ssh://example.com:2222/repo.git", ssh.SshTarget(None, "example.com", 2222)),
+        ("git@example.com:repo.git", ssh.SshTarget("git", "example.com", None)),
+        ("example.com:repo.git", ssh.SshTarget(None, "example.com", None)),
+        ("https://example.com/repo.git", None),
+        ("/srv/repo.git", None),
+        ("C:/repo.git", None),
+    ],
+)
+def test_get_ssh_target(url, expected):
+    """SSH destinations are extracted from SSH URLs only"""
+    assert ssh.get_ssh_target(url) == expected
+
+
+def test_multiplexed(fake_ssh):
+    """Master connections are set up before and closed after the context"""
+    original_command = os.environ["GIT_SSH_COMMAND"]
+    urls = ["git@example.com:a.git", "git@example.com:b.git", "ssh://other.com:2222/c.git", "/srv/d.git"]
+
+    with ssh.multiplexed(urls):
+        command = os.environ["GIT_SSH_COMMAND"]
+        assert command.startswith(original_command)
+        assert "ControlMaster=auto" in command
+        control_dir = command.split("ControlPath=")[1].split()[0].rsplit("/", 1)[0]
+        assert os.path.isdir(control_dir)
+
+        calls = fake_ssh.read_text().splitlines()
+        assert len(calls) == 2
+        assert all("-N -f" in call for call in calls)
+
+    assert os.environ["GIT_SSH_COMMAND"] == original_command
+    assert not os.path.exists(control_dir)
+
+    exits = [call for call in fake_ssh.read_text().splitlines() if "-O exit" in call]
+    assert sorted(call.split("-O exit ")[1] for call in exits) == ["-p 2222 other.com", "git@example.com"]
+
+
+def test_multiplexed_git_ssh(tmp_path, monkeypatch):
+    """Without GIT_SSH_COMMAND the extended command is installed as GIT_SSH, which core.sshCommand overrides"""
+    log = tmp_path / "ssh.log"
+    script = tmp_path / "my-ssh"
+    helpers.create_fake_ssh(script, log)
+    monkeypatch.delenv("GIT_SSH_COMMAND", raising=False)
+    monkeypatch.setenv("GIT_SSH", str(script))
+
+    with ssh.multiplexed(["git@example.com:a.git"]):
+        assert "GIT_SSH_COMMAND" not in os.environ
+        wrapper = os.environ["GIT_SSH"]
+        assert os.path.basename(wrapper) == "ssh"
+        assert str(script) in open(wrapper).read()
+        assert "-N -f" in log.read_text()
+
+    assert os.environ["GIT_SSH"] == str(script)
+    assert not os.path.exists(wrapper)
+
+
+def test_multiplexed_global_ssh_command(tmp_path, monkeypatch):
+    """A global core.sshCommand is not overridden, multiplexing is skipped instead"""
+    global_config = tmp_path / "gitconfig"
+    global_config.write_text("[core]\n\tsshCommand = ssh -i work_key\n")
+    monkeypatch.setenv("GIT_CONFIG_GLOBAL", str(global_config))
+    monkeypatch.delenv("GIT_SSH_COMMAND", raising=False)
+    monkeypatch.delenv("GIT_SSH", raising=False)
+
+    with ssh.multiplexed(["git@example.com:a.git"]):
+        assert "GIT_SSH_COMMAND" not in os.environ
+        assert "GIT_SSH" not in os.environ
+
+
+def test_multiplexed_without_ssh_urls(monkeypatch):
+    """Nothing is changed if no URL uses SSH"""
+    monkeypatch.delenv("GIT_SSH_COMMAND", raising=False)
+
+    with ssh.multiplexed(["https://example.com/repo.git"]):
+        assert "GIT_SSH_COMMAND" not in os.environ
@@ -0,0 +1,212 @@
+"""Test sync engines"""
+import asyncio
+import multiprocessing
+import pickle
+import time
+from collections import Counter
+from pathlib import Path
+from types import SimpleNamespace
+
+import git
+import pytest
+from metarepo import manifest, sync_engine
+
+
+def dummy_progress():
+    """Stand-in for the ProgressBar"""
+    return SimpleNamespace(label=None)
+
+
+def make_tasks(*urls):
+    return [
+        sync_engine.SyncTask(Path(f"repo_{i}"), manifest.Repository(url=url, path=f"repo_{i}"))
+        for i, url in enumerate(urls)
+    ]
+
+
+def test_interleave_by_host():
+    """Repositories on different hosts are interleaved"""
+    repos = [task.repo_data for task in make_tasks("https://a/1", "https://a/2", "https://a/3", "https://b/1")]
+    ordered = sync_engine.interleave_by_host(repos)
+    assert [repo.url for repo in ordered] == ["https://a/1", "https://b/1", "https://a/2", "https://a/3"]
+
+
+@pytest.fixture(name="fake_fetch")
+def fixture_fake_fetch(monkeypatch):
+    """
+    Replace fetching and local work with fakes that record how many fetches run concurrently per host
+    :return: Dictionary with the highest number of concurrent fetches, in total and per host
+    """
+    running = Counter()
+    peak = Counter()
+
+    class FakeProcess:
+        def __init__(self, host):
+            self.host = host
+            self.returncode = 1 if host == "broken" else 0
+
+        async def communicate(self):
+            running[self.host] += 1
+            running["total"] += 1
+            peak[self.host] = max(peak[self.host], running[self.host])
+            peak["total"] = max(peak["total"], running["total"])
+            await asyncio.sleep(0.01)
+            running[self.host] -= 1
+            running["total"] -= 1
+            return b"", b"fatal: unable to access"
+
+    async def fake_create_subprocess_exec(host, **_):
+        return FakeProcess(host)
+
+    monkeypatch.setattr(
+        sync_engine, "prepare_fetch", lambda task, _: [sync_engine.vcs_git.get_remote_host(task.repo_data.url)]
+    )
+    monkeypatch.setattr(sync_engine.asyncio, "create_subprocess_exec", fake_create_subprocess_exec)
+    monkeypatch.setattr(
+        sync_engine,
+        "sync_task",
+        lambda report, task, object_cache=None, **_: sync_engine.SyncResult(task.repo_data, True, "sha"),
+    )
+    return peak
+
+
+def test_async_engine_limits(fake_fetch):
+    """Concurrent fetches are limited globally and per host"""
+    tasks = make_tasks(*[f"https://a/{i}" for i in range(10)], *[f"https://b/{i}" for i in range(10)])
+
+    engine = sync_engine.AsyncSyncEngine(dummy_progress, parallel=4, max_per_host=3, host_limits={"B": 1})
+    results = engine.run(tasks)
+
+    assert len(results) == 20
+    assert all(result.success for result in results)
+    assert fake_fetch["total"] == 4
+    assert fake_fetch["a"] == 3
+    assert fake_fetch["b"] == 1
+
+
+def test_async_engine_default_host_limit(fake_fetch):
+    """Without a per host limit a single host gets FETCHES_PER_HOST concurrent fetches, not the global limit"""
+    tasks = make_tasks(*[f"https://a/{i}" for i in range(40)])
+
+    results = sync_engine.AsyncSyncEngine(dummy_progress, parallel=32).run(tasks)
+
+    assert len(results) == 40
+    assert fake_fetch["a"] == sync_engine.FETCHES_PER_HOST
+
+
+def test_async_engine_fetch_failure(fake_fetch):
+    """Failing fetches are reported and only stop the synchronization if requested"""
+    tasks = make_tasks("https://broken/repo", *[f"https://a/{i}" for i in range(10)])
+
+    results = sync_engine.AsyncSyncEngine(dummy_progress, parallel=1).run(tasks, stop_on_failure=True)
+    assert not results[0].success
+    assert len(results) < len(tasks)
+
+    results = sync_engine.AsyncSyncEngine(dummy_progress, parallel=1).run(tasks)
+    assert len(results) == len(tasks)
+    assert sum(1 for result in results if not result.success) == 1
+    assert "unable to access" in next(result.details for result in results if not result.success)
+
+
+def test_async_engine_prepare_failure(fake_fetch, monkeypatch):
+    """A repository that can not be created fails on its own instead of aborting the synchronization"""
+    prepare_fetch = sync_engine.prepare_fetch
+
+    def failing_prepare_fetch(task, object_cache):
+        if task.repo_data.url == "https://a/blocked":
+            raise NotADirectoryError(20, "Not a directory", "blocker/bad")
+        return prepare_fetch(task, object_cache)
+
+    monkeypatch.setattr(sync_engine, "prepare_fetch", failing_prepare_fetch)
+    tasks = make_tasks("https://a/blocked", *[f"https://a/{i}" for i in range(5)])
+
+    results = sync_engine.AsyncSyncEngine(dummy_progress, parallel=2).run(tasks)
+
+    assert len(results) == len(tasks)
+    failed = [result for result in results if not result.success]
+    assert [result.repo.url for result in failed] == ["https://a/blocked"]
+    assert "Not a directory" in failed[0].details
+
+
+def test_parse_transfer_size():
+    """The amount of data received is parsed from progress output, ignoring the rate"""
+    output = (
+        "Receiving objects:  50% (5/10), 512 bytes\rReceiving objects: 100% (10/10), 1.50 MiB | 3.00 MiB/s, done.\n"
+    )
+    assert sync_engine.parse_transfer_size(output) == int(1.5 * 1024**2)
+    assert sync_engine.parse_transfer_size("Receiving objects: 100% (3/3), done.") is None
+
+
+def flaky(*errors):
+    """
+    Function that fails with the given errors before succeeding
+    :return: (Function, list of calls)
+    """
+    calls = []
+
+    def func():
+        calls.append(len(calls))
+        if len(calls) <= len(errors):
+            raise git.GitCommandError("fetch", 128, errors[len(calls) - 1].encode())
+        return "done"
+
+    return func, calls
+
+
+def test_retry_transient_errors():
+    """Transient errors are retried, other errors are not"""
+    policy = sync_engine.RetryPolicy(retries=2, base_delay=0)
+    timer = sync_engine.SyncTimer()
+
+    func, calls = flaky("fatal: the remote end hung up unexpectedly", "error: RPC failed; curl 56 Connection reset")
+    assert policy.call(func, timer) == "done"
+    assert len(calls) == 3
+    assert timer.retries == 2
+
+    func, calls = flaky("fatal: repository 'x' not found")
+    with pytest.raises(git.GitCommandError):
+        policy.call(func, sync_engine.SyncTimer())
+    assert len(calls) == 1
+
+
+def test_retry_limits():
+    """Retries are limited per call and by the shared budget"""
+    policy = sync_engine.RetryPolicy(retries=1, budget=2, base_delay=0)
+
+    func, calls = flaky("fatal: early EOF", "fatal: early EOF")
+    with pytest.raises(git.GitCommandError):
+        policy.call(func, sync_engine.SyncTimer())
+    assert len(calls) == 2
+
+    assert policy.get_delay(0, "Connection timed out") is not None
+    assert policy.get_delay(0, "Connection timed out") is None
+
+
+def test_retry_backoff():
+    """The delay doubles with every attempt up to the maximum"""
+    policy = sync_engine.RetryPolicy(retries=10, base_delay=1, max_delay=5)
+    assert 0.5 <= policy.get_delay(0, "timed out") <= 1
+    assert 2 <= policy.get_delay(2, "timed out") <= 4
+    assert 2.5 <= policy.get_delay(6, "timed out") <= 5
+
+
+def test_retry_budget_shared():
+    """A shared retry policy keeps one budget for all copies"""
+    with multiprocessing.Manager() as manager:
+        policy = sync_engine.RetryPolicy(retries=1, budget=1, base_delay=0).share(manager)
+        copied = pickle.loads(pickle.dumps(policy))
+
+        assert copied.get_delay(0, "Connection timed out") is not None
+        assert policy.get_delay(0, "Connection timed out") is None
+
+
+def test_tuning_not_timed_as_checkout():
+    """Time spent tuning is measured separately and left out of the recorded timing"""
+    timer = sync_engine.SyncTimer()
+    fake_repo = SimpleNamespace(tune=lambda: time.sleep(0.05))
+
+    sync_engine.apply_tuning(fake_repo, timer)
+
+    assert timer.tune_seconds >= 0.05
+    assert timer.checkout_seconds == 0.0
+    assert timer.get_timing().checkout_seconds == 0.0
@@ -91,3 +91,114 @@ def test_git_detect_root(tmpdir):
     repo = vcs_git.RepoTool(tmpdir.join("a/b/c"), REPO_URL, search_parent=True)
 
     assert repo.get_root_path() == tmpdir
+
+
+def test_git_status_untracked(tmpdir):
+    """Untracked files are listed but do not make the repository dirty"""
+    helpers.create_commits(tmpdir, REPO_URL)
+    tmpdir.mkdir("sub").join("new file.txt").write("Untracked")
+
+    repo = vcs_git.RepoTool(tmpdir, REPO_URL)
+    status = repo.get_status()
+
+    assert not status.is_dirty
+    assert status.untracked_files == ["sub/new file.txt"]
+
+
+def test_git_status_renamed(tmpdir):
+    """Staged renames make the repository dirty"""
+    _, test_repo = helpers.create_commits(tmpdir, REPO_URL)
+    test_repo.git.mv("output.txt", "renamed.txt")
+
+    repo = vcs_git.RepoTool(tmpdir, REPO_URL)
+    status = repo.get_status()
+
+    assert status.is_dirty
+    assert status.untracked_files == []
+
+
+def test_git_status_empty_repository(tmpdir):
+    """Repository without any commits"""
+    test_repo = git.Repo.init(tmpdir)
+    test_repo.create_remote("origin", REPO_URL)
+
+    repo = vcs_git.RepoTool(tmpdir, REPO_URL)
+    status = repo.get_status()
+
+    assert status.head is None
+    assert not status.is_detached
+    assert status.active_branch.name == "master"
+
+
+def test_git_status_ahead_behind(test_repo_and_workspace):
+    """Ahead and behind counts are reported relative to the upstream branch"""
+    data = test_repo_and_workspace
+
+    repo = vcs_git.RepoTool(data["workspace"] / "repo", expected_origin=data["source_repo"].git_dir, allow_create=True)
+    repo.fetch("master")
+    repo.checkout("origin/master", "master")
+    local_repo = git.Repo(data["workspace"] / "repo")
+    local_repo.heads.master.set_tracking_branch(local_repo.remotes.origin.refs.master)
+
+    status = repo.get_status()
+    assert (status.ahead, status.behind) == (0, 0)
+
+    helpers.write_and_commit(data["source_repo"], "new_file_on_remote")
+    helpers.write_and_commit(local_repo, "new_file_created_locally")
+    repo.fetch("master")
+
+    status = repo.get_status()
+    assert (status.ahead, status.behind) == (1, 1)
+
+
+def test_git_status_untracked_on_demand(tmpdir):
+    """Untracked files are only scanned for when requested"""
+    commits, _ = helpers.create_commits(tmpdir, REPO_URL)
+
+    repo = vcs_git.RepoTool(tmpdir, REPO_URL)
+    status = repo.get_status()
+    assert not hasattr(status, "__dict__")
+    assert status.head_sha == commits[0].hexsha
+    assert status.branch == "master"
+
+    # The scan happens on first access, so files created afterwards are seen
+    tmpdir.join("created_later.txt").write("Untracked")
+    assert status.untracked_files == ["created_later.txt"]
+
+
+@pytest.mark.parametrize(
+    "url, host",
+    [
+        ("https://GitHub.com/blejdfist/git-metarepo", "github.com"),
+        ("ssh://git@example.com:2222/repo.git", "example.com"),
+        ("git@example.com:user/repo.git", "example.com"),
+        ("example.com:repo.git", "example.com"),
+        ("/path/to/repo", ""),
+        ("C:\\path\\to\\repo", ""),
+        ("file:///path/to/repo", ""),
+    ],
+)
+def test_get_remote_host(url, host):
+    """Host names are extracted from all supported URL styles"""
+    assert vcs_git.get_remote_host(url) == host
+
+
+def test_probe_remote_sha(tmpdir):
+    """Remote branches can be probed without fetching"""
+    commits, test_repo = helpers.create_commits(tmpdir)
+
+    assert vcs_git.probe_remote_sha(test_repo.git_dir, "master") == commits[0].hexsha
+    assert vcs_git.probe_remote_sha(test_repo.git_dir, "missing") is None
+
+
+def test_has_fsmonitor_daemon_configured_git(tmp_path, monkeypatch):
+    """The check runs the git executable configured for GitPython"""
+    calls = tmp_path / "calls"
+    wrapper = tmp_path / "git-wrapper"
+    wrapper.write_text(f'#!/bin/sh\necho "$@" >> {calls}\nexec git "$@"\n')
+    wrapper.chmod(0o755)
+    monkeypatch.setattr(git.Git, "GIT_PYTHON_GIT_EXECUTABLE", str(wrapper))
+    monkeypatch.setattr(vcs_git, "_has_fsmonitor_daemon", None)
+
+    vcs_git.has_fsmonitor_daemon(git.Repo.init(tmp_path / "repo"))
+    assert "fsmonitor--daemon status" in calls.read_text()
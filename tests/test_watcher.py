@@ -0,0 +1,107 @@
+"""Test watching repositories for changes"""
+from pathlib import Path
+
+import git
+import pytest
+from metarepo import watcher
+from tests import helpers
+
+
+@pytest.fixture(name="watched_repo", params=["inotify", "polling"])
+def fixture_watched_repo(request, tmpdir):
+    """
+    Repository watched by each kind of watcher
+    :return: (Watcher, path to the repository)
+    """
+    repo_path = Path(tmpdir) / "repo"
+    helpers.create_commits(repo_path)
+
+    if request.param == "inotify":
+        repo_watcher = watcher.create_watcher()
+        if not isinstance(repo_watcher, watcher.InotifyWatcher):
+            pytest.skip("inotify is not available")
+    else:
+        repo_watcher = watcher.PollingWatcher(interval=0.05)
+
+    with repo_watcher:
+        repo_watcher.add("repo", repo_path)
+        yield repo_watcher, repo_path
+
+
+def test_watch_working_tree(watched_repo):
+    """Changes to files are reported, also in directories created after the watch started"""
+    repo_watcher, repo_path = watched_repo
+    assert repo_watcher.wait(timeout=0.2) == set()
+
+    (repo_path / "output.txt").write_text("changed")
+    assert repo_watcher.wait(timeout=5) == {"repo"}
+
+    (repo_path / "new" / "deeper").mkdir(parents=True)
+    assert repo_watcher.wait(timeout=5) == {"repo"}
+    (repo_path / "new" / "deeper" / "file.txt").write_text("new")
+    assert repo_watcher.wait(timeout=5) == {"repo"}
+
+
+def test_watch_git_state(watched_repo):
+    """Changes to refs and HEAD are reported, reading the repository is not"""
+    repo_watcher, repo_path = watched_repo
+    repo = git.Repo(repo_path)
+
+    repo.git.status(env={"GIT_OPTIONAL_LOCKS": "0"})
+    assert repo_watcher.wait(timeout=0.2) == set()
+
+    repo.git.checkout("-b", "feature")
+    assert repo_watcher.wait(timeout=5) == {"repo"}
+
+
+def test_inotify_limit_reached(tmpdir):
+    """A repository whose new directories can not be watched any more is polled instead"""
+    import ctypes
+    import errno
+
+    repo_path = Path(tmpdir) / "repo"
+    helpers.create_commits(repo_path)
+
+    repo_watcher = watcher.create_watcher()
+    if not isinstance(repo_watcher, watcher.InotifyWatcher):
+        pytest.skip("inotify is not available")
+
+    class ExhaustedLibc:
+        """C library that is out of inotify watches"""
+
+        def __init__(self, libc):
+            self._libc = libc
+
+        def inotify_add_watch(self, *_):
+            ctypes.set_errno(errno.ENOSPC)
+            return -1
+
+        def __getattr__(self, name):
+            return getattr(self._libc, name)
+
+    with repo_watcher:
+        repo_watcher.add("repo", repo_path)
+        repo_watcher._libc = ExhaustedLibc(repo_watcher._libc)
+
+        (repo_path / "new").mkdir()
+        assert repo_watcher.wait(timeout=5) == {"repo"}
+
+        (repo_path / "new" / "file.txt").write_text("new")
+        assert repo_watcher.wait(timeout=5) == {"repo"}
+
+
+def test_polling_dangling_symlink(tmpdir):
+    """A dangling symbolic link does not hide changes to the other files in its directory"""
+    repo_path = Path(tmpdir) / "repo"
+    helpers.create_commits(repo_path)
+    directory = repo_path / "d"
+    directory.mkdir()
+    (directory / "broken").symlink_to("/nonexistent")
+    for i in range(1, 7):
+        (directory / f"f{i}").write_text("original")
+
+    with watcher.PollingWatcher(interval=0.05) as repo_watcher:
+        repo_watcher.add("repo", repo_path)
+        for i in range(1, 7):
+            (directory / f"f{i}").write_text(f"changed in f{i}")
+            assert repo_watcher.check() == {"repo"}, f"change to f{i} not detected"
@@ -0,0 +1,66 @@
+"""Test workspace discovery"""
+import git
+import pytest
+from metarepo import workspace
+from tests import helpers
+
+
+@pytest.fixture(autouse=True)
+def fixture_clean_environment(monkeypatch):
+    """Start every test with an empty cache and without git environment variables"""
+    monkeypatch.delenv("GIT_DIR", raising=False)
+    monkeypatch.delenv("GIT_WORK_TREE", raising=False)
+    workspace._find_root_path.cache_clear()
+
+
+def test_root_in_repository_subdirectory(tmpdir):
+    """Root of the enclosing repository is used"""
+    helpers.create_commits(tmpdir)
+    subdir = tmpdir.mkdir("a").mkdir("b")
+
+    assert workspace.find_root_path(subdir) == tmpdir
+
+
+def test_root_in_worktree(tmpdir):
+    """Worktrees have a '.git' file instead of a directory"""
+    _, repo = helpers.create_commits(tmpdir.join("main"))
+    repo.git.worktree("add", str(tmpdir.join("worktree")), "-b", "other")
+    subdir = tmpdir.join("worktree").mkdir("sub")
+
+    assert workspace.find_root_path(subdir) == tmpdir.join("worktree")
+
+
+def test_root_git_dir_environment(tmpdir, monkeypatch):
+    """GIT_DIR and GIT_WORK_TREE take precedence over searching"""
+    git.Repo.init(tmpdir.join("repo"))
+    subdir = tmpdir.mkdir("elsewhere")
+
+    monkeypatch.setenv("GIT_DIR", str(tmpdir.join("repo", ".git")))
+    assert workspace.find_root_path(subdir) == tmpdir.join("repo")
+
+    monkeypatch.setenv("GIT_WORK_TREE", str(tmpdir.join("work")))
+    assert workspace.find_root_path(subdir) == tmpdir.join("work")
+
+
+def test_root_manifest_outside_repository(tmpdir):
+    """Outside of a repository the closest directory containing a manifest is used"""
+    helpers.create_manifest(tmpdir, {"repos": []})
+    subdir = tmpdir.mkdir("a").mkdir("b")
+
+    assert workspace.find_root_path(subdir) == tmpdir
+
+
+def test_root_nothing_found(tmpdir):
+    """Outside of a repository and without a manifest the start directory is used"""
+    subdir = tmpdir.mkdir("a")
+
+    assert workspace.find_root_path(subdir) == subdir
+
+
+def test_root_invalid_git_directory(tmpdir):
+    """Empty '.git' directories are not repositories"""
+    helpers.create_commits(tmpdir)
+    subdir = tmpdir.mkdir("a")
+    subdir.mkdir(".git")
+
+    assert workspace.find_root_path(subdir) == tmpdir